@@ -0,0 +1,158 @@
+"""
+Load test of the async check_instance view against a slow openBIS instance.
+
+openBIS is simulated in process: every call sleeps LATENCY seconds, like a
+round trip to a remote server. N concurrent requests are sent to a single
+ASGI worker (one event loop, AsyncClient), and the same N requests are sent one
+after the other, as a single synchronous WSGI worker serves them. The masterdata
+cache is disabled so that every request really waits for openBIS.
+
+Usage:
+    python benchmarks/bench_async_views.py [--requests 20] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from cryptography.fernet import Fernet
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure(
+    SECRET_ENCRYPTION_KEY=Fernet.generate_key(),
+    SECRET_KEY="benchmark",
+    ROOT_URLCONF="excel_checker.urls",
+    INSTALLED_APPS=[
+        "django.contrib.admin", "django.contrib.auth", "django.contrib.contenttypes",
+        "django.contrib.sessions", "django.contrib.messages", "myapp",
+    ],
+    MIDDLEWARE=["django.contrib.sessions.middleware.SessionMiddleware"],
+    SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies",
+    TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates", "APP_DIRS": True}],
+    INSTANCE_CSV_DIR=tempfile.mkdtemp(),
+    MASTERDATA_CACHE_TTL=0,
+)
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.sessions.backends.signed_cookies import SessionStore  # noqa: E402
+from django.test import AsyncClient, Client  # noqa: E402
+from pybis.things import Things  # noqa: E402
+
+from myapp import views  # noqa: E402
+from myapp.utils import encrypt_password  # noqa: E402
+
+LATENCY = 0.05
+ITEMS = 5
+
+
+class Assignments(list):
+    df = pd.DataFrame(columns=["code"])
+
+
+class SlowEntity:
+    def __init__(self, code):
+        self.code = self.name = code
+
+    def get_property_assignments(self):
+        return Assignments()
+
+
+class SlowOpenbis:
+    url = "https://benchmark"
+
+    def _things(self, prefix, identifier="code"):
+        time.sleep(LATENCY)
+
+        def get_item(code):
+            time.sleep(LATENCY)
+            return SlowEntity(code)
+
+        codes = [f"{prefix}{i}" for i in range(ITEMS)]
+        return Things(self, prefix, identifier_name=identifier, single_item_method=get_item,
+                      df_initializer=lambda attrs, props, response: pd.DataFrame({identifier: codes}))
+
+    def get_spaces(self):
+        return self._things("SPACE")
+
+    def get_projects(self):
+        return self._things("PROJECT")
+
+    def get_collection_types(self):
+        return self._things("COLLECTION")
+
+    def get_object_types(self):
+        return self._things("OBJECT")
+
+    def get_material_types(self):
+        return self._things("MATERIAL")
+
+    def get_dataset_types(self):
+        return self._things("DATASET")
+
+    def get_vocabularies(self):
+        return self._things("VOCABULARY")
+
+    def get_plugins(self):
+        return self._things("PLUGIN", identifier="name")
+
+    def get_property_types(self):
+        return self._things("PROPERTY")
+
+
+def login(client):
+    session = SessionStore()
+    session["openbis_username"] = "benchmark"
+    session["openbis_password"] = encrypt_password("benchmark")
+    session.save()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+
+def run_sync(requests):
+    client = Client()
+    login(client)
+    start = time.perf_counter()
+    for i in range(requests):
+        assert client.post("/check_instance/", {"instance": f"instance{i}"}).status_code == 200
+    return time.perf_counter() - start
+
+
+async def run_async(requests):
+    client = AsyncClient()
+    login(client)
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[client.post("/check_instance/", {"instance": f"instance{i}"}) for i in range(requests)])
+    assert all(response.status_code == 200 for response in responses)
+    return time.perf_counter() - start
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description="check_instance requests against a slow openBIS, WSGI against ASGI.")
+    parser.add_argument("--requests", type=int, default=20, help="Requests sent by each worker.")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Seconds per openBIS call.")
+    args = parser.parse_args()
+    requests = args.requests
+    LATENCY = args.latency
+
+    async def get_openbis(request):
+        return SlowOpenbis()
+
+    views.get_openbis = get_openbis
+
+    sync_seconds = run_sync(requests)
+    async_seconds = asyncio.run(run_async(requests))
+    print(f"{requests} check_instance requests, {LATENCY * 1000:.0f} ms per openBIS call")
+    print(f"{'worker':<24}{'time (s)':>10}{'requests/s':>12}")
+    print(f"{'WSGI, one at a time':<24}{sync_seconds:>10.2f}{requests / sync_seconds:>12.1f}")
+    print(f"{'ASGI, concurrent':<24}{async_seconds:>10.2f}{requests / async_seconds:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
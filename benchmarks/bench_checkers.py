@@ -0,0 +1,189 @@
+"""
+Benchmark of the checkers on synthetic workbooks (see workbooks.py): time and
+peak memory of parsing, content_checker, check_properties and entity_checker
+for every sheet kind, valid and broken, from 10 to 100k rows.
+
+The entity checks run against an offline masterdata snapshot, without openBIS,
+on the sheets of up to --entity-max-rows rows.
+The incremental re-checks (INCREMENTAL_MAX_REVISIONS) are disabled, every run
+checks the whole sheet.
+
+Results are compared with the baseline stored in baselines/bench_checkers.json:
+a checker slower than --tolerance times its baseline, by at least MIN_DELTA
+seconds, is timed again RECHECK_REPEAT times; if its best time is still that
+slow it is marked SLOWER and the script exits with status 1. Baselines under
+MIN_SECONDS are not compared: the timings of the small sheets vary by more than
+the tolerance from one run to the next. Record a new baseline (e.g. on your
+machine, or after an intended change) with --update-baseline.
+
+Usage:
+    python benchmarks/bench_checkers.py [--sizes 10 1000 10000 100000] [--kinds SAMPLE_TYPE ...]
+                                        [--entity-max-rows 1000] [--tolerance 1.5] [--update-baseline]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure(SECRET_ENCRYPTION_KEY=Fernet.generate_key(), INCREMENTAL_MAX_REVISIONS=0, LOGGING_CONFIG=None)
+
+import workbooks  # noqa: E402
+from myapp.offline import OfflineLookups  # noqa: E402
+from myapp.utils import ParsedWorkbook, name_checker, content_checker, check_properties, entity_checker  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "bench_checkers.json")
+DEFAULT_SIZES = [10, 1000, 10000]
+
+# Timings below this are mostly noise, they are shown but not compared
+MIN_SECONDS = 0.02
+# Slowdowns smaller than this (seconds) are not regressions, whatever their ratio
+MIN_DELTA = 0.01
+# Runs of a checker found slower before it is reported (the best one counts)
+RECHECK_REPEAT = 10
+
+# Sheets whose property rows are checked by check_properties
+PROPERTY_SHEETS = ("SAMPLE_TYPE", "EXPERIMENT_TYPE", "DATASET_TYPE")
+
+
+def timed(function, repeat):
+    # Best of repeat runs
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def quiet(function):
+    # The checkers print their progress
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function()
+    return run
+
+
+def checkers(kind, path, rows, entity_max_rows):
+    # (name, function) of the checkers measured on one workbook
+    workbook = ParsedWorkbook.load(path, workbooks.file_name(kind))
+    name_ok = quiet(lambda: name_checker(workbook.file_name))()[2]
+    snapshot = workbooks.make_snapshot(kind, rows)
+    result = [
+        ("parse", lambda: ParsedWorkbook.load(path, workbooks.file_name(kind))),
+        ("content_checker", quiet(lambda: content_checker(workbook, name_ok))),
+    ]
+    if kind in PROPERTY_SHEETS:
+        result.append(("check_properties", lambda: check_properties(workbook.with_placeholders(), [])))
+    if kind != "PROPERTY_TYPE" and rows <= entity_max_rows:
+        # Fresh lookups every run: nothing memoized from the previous one
+        result.append(("entity_checker", lambda: entity_checker(workbook, None, OfflineLookups(snapshot))))
+    return result
+
+
+def issues(kind, path):
+    # Number of content issues, to tell the valid and broken sheets apart in the output
+    workbook = ParsedWorkbook.load(path, workbooks.file_name(kind))
+    return len(quiet(lambda: content_checker(workbook, name_checker(workbook.file_name)[2]))())
+
+
+def run(sizes, kinds, entity_max_rows):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in kinds:
+            for variant in workbooks.VARIANTS:
+                for rows in sizes:
+                    path = workbooks.make_workbook(os.path.join(tmp, workbooks.file_name(kind)), kind, rows, variant)
+                    found = issues(kind, path)
+                    for checker, function in checkers(kind, path, rows, entity_max_rows):
+                        key = f"{kind} {variant} {checker} {rows}"
+                        results[key] = {
+                            "seconds": round(timed(function, 5 if rows <= 1000 else 1), 6),
+                            "peak_mib": round(peak_memory(function), 3),
+                            "issues": found,
+                        }
+                        yield key, results[key], function
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE):
+        return {}
+    with open(BASELINE, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)["results"]
+
+
+def save_baseline(results):
+    os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+    baseline = load_baseline()
+    baseline.update(results)
+    data = {"python": platform.python_version(), "machine": platform.machine(), "results": dict(sorted(baseline.items()))}
+    with open(BASELINE, "w", encoding="utf-8") as baseline_file:
+        json.dump(data, baseline_file, indent=1)
+        baseline_file.write("\n")
+
+
+def regressed(result, before, tolerance):
+    if not before or before["seconds"] < MIN_SECONDS:
+        return False
+    return result["seconds"] > tolerance * before["seconds"] and result["seconds"] - before["seconds"] >= MIN_DELTA
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and peak memory of the checkers on synthetic workbooks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Property rows (or terms) per sheet.")
+    parser.add_argument("--kinds", nargs="+", choices=workbooks.KINDS, default=list(workbooks.KINDS))
+    parser.add_argument("--entity-max-rows", type=int, default=1000,
+                        help="Largest sheet given to entity_checker (it compares every property row with the snapshot).")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Slowdown over the baseline reported as a regression.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline.")
+    args = parser.parse_args()
+
+    baseline = load_baseline()
+    results = {}
+    slower = []
+    print(f"{'sheet':<16} {'variant':<7} {'checker':<17} {'rows':>7} {'issues':>6} {'time (s)':>10} {'baseline':>10}"
+          f" {'ratio':>6} {'peak (MiB)':>11} {'baseline':>9}")
+    for key, result, function in run(args.sizes, args.kinds, args.entity_max_rows):
+        results[key] = result
+        kind, variant, checker, rows = key.split()
+        before = baseline.get(key)
+        status = ""
+        if not args.update_baseline and regressed(result, before, args.tolerance):
+            # One slow run is not a regression: the best of more runs has to be slow too
+            result["seconds"] = round(min(result["seconds"], timed(function, RECHECK_REPEAT)), 6)
+            if regressed(result, before, args.tolerance):
+                status = "SLOWER"
+                slower.append(key)
+        ratio = result["seconds"] / before["seconds"] if before and before["seconds"] else None
+        print(f"{kind:<16} {variant:<7} {checker:<17} {rows:>7} {result['issues']:>6} {result['seconds']:>10.4f}"
+              f" {before['seconds'] if before else float('nan'):>10.4f} {ratio if ratio else float('nan'):>5.2f}x"
+              f" {result['peak_mib']:>11.2f} {before['peak_mib'] if before else float('nan'):>9.2f} {status}")
+
+    if args.update_baseline:
+        save_baseline(results)
+        print(f"Baseline saved to {BASELINE}")
+    elif slower:
+        sys.exit(f"{len(slower)} checker(s) more than {args.tolerance}x slower than the baseline")
+
+
+if __name__ == "__main__":
+    main()
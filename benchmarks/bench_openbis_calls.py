@@ -0,0 +1,104 @@
+"""
+openBIS calls and time of the checks that talk to openBIS, against the
+in-process fake (fake_openbis.py) with a simulated round trip latency:
+
+    entity_checker     a sheet of an existing entity type, and of a new one
+                       (compared with every entity type of its kind)
+    masterdata csv     generate_csv_and_download
+    entity type list   iterating pybis Things (one call per item), masterdata.materialize
+                       (concurrent calls) and masterdata.assigned_property_codes (no call)
+
+Every check runs cold (new masterdata snapshot) and warm (snapshot of the
+previous run still valid), so the repeated fetches show up as calls in the
+cold column only.
+
+Usage:
+    python benchmarks/bench_openbis_calls.py [--latency 0.02] [--jitter 0.005] [--rows 100]
+                                             [--fixture benchmarks/fixtures/openbis_snapshot.json]
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import os
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure(SECRET_ENCRYPTION_KEY=Fernet.generate_key(), INCREMENTAL_MAX_REVISIONS=0, LOGGING_CONFIG=None)
+
+import workbooks  # noqa: E402
+from fake_openbis import FIXTURE, FakeOpenbis  # noqa: E402
+from myapp import masterdata  # noqa: E402
+from myapp.utils import ParsedWorkbook, entity_checker, generate_csv_and_download  # noqa: E402
+
+KIND = "SAMPLE_TYPE"
+
+
+def with_workbook_types(data, rows, existing):
+    # The fixture plus the entity and property types of the benchmark sheet (see workbooks.make_snapshot)
+    data = copy.deepcopy(data)
+    sheet = workbooks.make_snapshot(KIND, rows)
+    if not existing:
+        del sheet["entity_types"][KIND][workbooks.CODE]
+    data["entity_types"][KIND].update(sheet["entity_types"][KIND])
+    data["property_types"].update(sheet["property_types"])
+    return data
+
+
+def measure(o, function):
+    # (seconds, calls) of one run
+    o.reset_calls()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    return time.perf_counter() - start, dict(o.calls)
+
+
+def cold_and_warm(o, function):
+    masterdata.invalidate(o.url)
+    return measure(o, function), measure(o, function)
+
+
+def show(name, cold, warm=None):
+    def calls(counts):
+        return ", ".join(f"{method} {count}" for method, count in sorted(counts.items())) or "-"
+    print(f"{name:<28} cold {cold[0]:>8.3f}s {sum(cold[1].values()):>5} calls  ({calls(cold[1])})")
+    if warm is not None:
+        print(f"{'':<28} warm {warm[0]:>8.3f}s {sum(warm[1].values()):>5} calls  ({calls(warm[1])})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="openBIS calls of the checks, against a fake openBIS with latency.")
+    parser.add_argument("--fixture", default=FIXTURE, help="Masterdata snapshot the fake answers from.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per openBIS call.")
+    parser.add_argument("--jitter", type=float, default=0.005, help="Random +/- seconds added to every call.")
+    parser.add_argument("--rows", type=int, default=100, help="Property rows of the benchmark sheet.")
+    args = parser.parse_args()
+
+    fixture = FakeOpenbis.load(args.fixture).data
+    print(f"latency {args.latency}s +/- {args.jitter}s, {args.rows} property rows, "
+          f"{len(fixture['entity_types'][KIND])} object types in the fixture")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = workbooks.make_workbook(os.path.join(tmp, workbooks.file_name(KIND)), KIND, args.rows)
+        workbook = ParsedWorkbook.load(path, workbooks.file_name(KIND))
+        for existing in (True, False):
+            o = FakeOpenbis(with_workbook_types(fixture, args.rows, existing), latency=args.latency, jitter=args.jitter)
+            show(f"entity_checker ({'existing' if existing else 'new'})", *cold_and_warm(o, lambda: entity_checker(workbook, o)))
+
+    o = FakeOpenbis(fixture, latency=args.latency, jitter=args.jitter)
+    show("masterdata csv", *cold_and_warm(o, lambda: generate_csv_and_download(o, o.url)))
+
+    show("object types: iterate", measure(o, lambda: list(o.get_object_types())))
+    show("object types: materialize", measure(o, lambda: masterdata.materialize(o.get_object_types())))
+    show("property sets: one search", measure(o, lambda: masterdata.assigned_property_codes(o.get_object_types())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark of the workbook parsing done for a single upload.
+
+Before, content_checker, entity_checker, check_entity_same_code,
+check_entity_diff_code and check_prefix_sufix each called
+openpyxl.load_workbook on the uploaded file. Now the file is parsed once into a
+ParsedWorkbook that is shared by all of them. The peak memory of a full
+openpyxl load is compared with the read-only, values-only parse.
+
+Usage:
+    python benchmarks/bench_parse_once.py [--sizes 100 1000 10000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+from cryptography.fernet import Fernet
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure(SECRET_ENCRYPTION_KEY=Fernet.generate_key())
+
+from myapp.utils import ParsedWorkbook  # noqa: E402
+
+# Number of load_workbook calls made for one upload before the shared parse
+LOADS_PER_UPLOAD = 5
+
+PROPERTY_HEADERS = [
+    "Version", "Code", "Description", "Mandatory", "Show in edit views",
+    "Section", "Property label", "Data type", "Vocabulary code", "Metadata", "Dynamic script",
+]
+
+
+def make_workbook(path, rows):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["SAMPLE_TYPE"])
+    sheet.append(["Version", "Code", "Description", "Validation script", "Generated code prefix", "Auto generate codes"])
+    sheet.append([1, "BENCH", "Benchmark//Benchmark", None, "BEN", "TRUE"])
+    sheet.append(PROPERTY_HEADERS)
+    for i in range(rows):
+        sheet.append([1, f"BENCH.PROP_{i}", "Property//Eigenschaft", "FALSE", "TRUE",
+                      "General Information", f"Property {i}", "VARCHAR", None, None, None])
+    workbook.save(path)
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def main(sizes):
+    print(f"{'rows':>8} {'before (s)':>12} {'after (s)':>12} {'speedup':>8} {'before (MiB)':>13} {'after (MiB)':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            path = os.path.join(tmp, f"object_type_BENCH_v1_S_bench_{rows}.xlsx")
+            make_workbook(path, rows)
+
+            before = timed(lambda: [openpyxl.load_workbook(path).close() for _ in range(LOADS_PER_UPLOAD)])
+            after = timed(lambda: ParsedWorkbook.load(path))
+            before_memory = peak_memory(lambda: openpyxl.load_workbook(path))
+            after_memory = peak_memory(lambda: ParsedWorkbook.load(path))
+            print(f"{rows:>8} {before:>12.3f} {after:>12.3f} {before / after:>7.1f}x"
+                  f" {before_memory:>13.1f} {after_memory:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse time and memory of an upload, openpyxl per check against a single parse.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Property rows of the benchmark sheet.")
+    main(parser.parse_args().sizes)
@@ -0,0 +1,99 @@
+"""
+Benchmark of the workbook reader backends (see READERS in myapp/utils.py): parse
+time and peak memory of ParsedWorkbook.load on the same synthetic sheets (see
+workbooks.py), written as .xlsx and as .xls.
+
+    openpyxl  .xlsx, read-only mode
+    calamine  .xlsx and .xls, when python-calamine is installed
+    xlrd      .xls
+
+The .xls files need xlwt to be written and hold at most 65536 rows. The peak
+memory is measured with tracemalloc, which does not see the memory allocated by
+native code (calamine): only the Python objects it returns are counted.
+
+Usage:
+    python benchmarks/bench_readers.py [--sizes 1000 10000 100000] [--kinds SAMPLE_TYPE ...] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure(SECRET_ENCRYPTION_KEY=Fernet.generate_key(), LOGGING_CONFIG=None)
+
+import workbooks  # noqa: E402
+from myapp import utils  # noqa: E402
+from myapp.utils import ParsedWorkbook, read_workbook_rows  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def available():
+    # (reader, file format) pairs that can run here
+    pairs = [("openpyxl", "xlsx")]
+    if utils.python_calamine is not None:
+        pairs += [("calamine", "xlsx"), ("calamine", "xls")]
+    if utils.xlrd is not None:
+        pairs.append(("xlrd", "xls"))
+    if workbooks.xlwt is None:
+        pairs = [pair for pair in pairs if pair[1] != "xls"]
+    return pairs
+
+
+def load(path, name, reader):
+    return ParsedWorkbook(list(read_workbook_rows(path, reader)), name)
+
+
+def measure(path, name, reader, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load(path, name, reader)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    workbook = load(path, name, reader)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak / 2 ** 20, workbook
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse time and memory of the workbook reader backends.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Property rows (or terms) per sheet.")
+    parser.add_argument("--kinds", nargs="+", choices=workbooks.KINDS, default=["SAMPLE_TYPE"])
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per reader (the best is shown).")
+    args = parser.parse_args()
+
+    pairs = available()
+    print(f"readers: {', '.join(f'{reader} (.{extension})' for reader, extension in pairs)}")
+    print(f"{'sheet':<16} {'rows':>7} {'reader':<9} {'format':<6} {'size (KiB)':>10} {'time (s)':>9} {'vs openpyxl':>11} {'peak (MiB)':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in args.kinds:
+            for rows in args.sizes:
+                name = workbooks.file_name(kind)
+                paths = {"xlsx": workbooks.make_workbook(os.path.join(tmp, name), kind, rows)}
+                if workbooks.xlwt is not None and rows + 4 <= workbooks.XLS_MAX_ROWS:
+                    paths["xls"] = workbooks.make_xls(os.path.join(tmp, name[:-1]), kind, rows)
+                reference = None
+                for reader, extension in pairs:
+                    if extension not in paths:
+                        continue
+                    seconds, peak, workbook = measure(paths[extension], name, reader, args.repeat)
+                    if reference is None:
+                        reference = (seconds, [workbook.row(i) for i in range(1, workbook.max_row + 1)])
+                    # Every backend has to read the same values
+                    same = [workbook.row(i) for i in range(1, workbook.max_row + 1)] == reference[1]
+                    print(f"{kind:<16} {rows:>7} {reader:<9} {'.' + extension:<6} {os.path.getsize(paths[extension]) / 1024:>10.0f}"
+                          f" {seconds:>9.4f} {seconds / reference[0]:>10.2f}x {peak:>11.2f}{'' if same else '  DIFFERENT VALUES'}")
+
+
+if __name__ == "__main__":
+    main()
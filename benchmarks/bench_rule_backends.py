@@ -0,0 +1,66 @@
+"""
+Benchmark of the two backends of the column rules (myapp/rules.py): the
+row-by-row pass ("python") and the vectorized pandas masks ("columnar").
+
+Both backends must report the same rows; the script stops if they differ.
+
+Usage:
+    python benchmarks/bench_rule_backends.py [--sizes 1000 10000 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from myapp.rules import PROPERTY_RULES, PROPERTY_TYPE_RULES  # noqa: E402
+
+PROPERTY_HEADERS = [
+    "Version", "Code", "Description", "Mandatory", "Show in edit views",
+    "Section", "Property label", "Data type", "Vocabulary code", "Metadata", "Dynamic script",
+]
+SECTIONS = ["General Information", "Details", "Additional Information", "Comments"]
+
+
+def make_rows(rows, seed=0):
+    # Mostly valid property rows with about 1% broken cells
+    generator = random.Random(seed)
+    block = max(rows // len(SECTIONS), 1)
+    result = []
+    for i in range(rows):
+        row = [1, f"BENCH.PROP_{i}", "Property//Eigenschaft", "FALSE", "TRUE",
+               SECTIONS[min(i // block, len(SECTIONS) - 1)], f"Property {i}", "VARCHAR", None, None, None]
+        if generator.random() < 0.01:
+            row[generator.randrange(9)] = generator.choice(["bad value", "x", None, "$PLACEHOLDER", 3.5])
+        result.append(tuple(row))
+    return result
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main(sizes):
+    print(f"{'rule set':<20} {'rows':>8} {'python (s)':>12} {'columnar (s)':>13} {'speedup':>8}")
+    for rule_set_name, rule_set, headers in (
+        ("PROPERTY_RULES", PROPERTY_RULES, PROPERTY_HEADERS),
+        ("PROPERTY_TYPE_RULES", PROPERTY_TYPE_RULES, PROPERTY_HEADERS),
+    ):
+        for rows in sizes:
+            data = make_rows(rows)
+            python_time, python_errors = timed(lambda: rule_set.run(headers, iter(data), backend="python"))
+            columnar_time, columnar_errors = timed(lambda: rule_set.run(headers, iter(data), backend="columnar"))
+            if python_errors != columnar_errors:
+                sys.exit(f"{rule_set_name}: the backends disagree on {rows} rows")
+            print(f"{rule_set_name:<20} {rows:>8} {python_time:>12.3f} {columnar_time:>13.3f} {python_time / columnar_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run time of the python and columnar backends of the column rules.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Rows checked per run.")
+    main(parser.parse_args().sizes)
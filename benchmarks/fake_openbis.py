@@ -0,0 +1,311 @@
+"""
+In-process stand-in for a pybis Openbis connection, for the benchmarks.
+
+FakeOpenbis answers the pybis methods used by the app (entity types and their
+property assignments, property types, vocabularies, plugins, spaces, projects,
+login and session checks) from a masterdata snapshot: the format written by
+"manage.py check_masterdata --dump-snapshot" (see myapp/offline.py), optionally
+with "spaces", "projects" and "plugins" lists. fixtures/openbis_snapshot.json is
+a small instance built by make_fixture.
+
+Every remote call sleeps latency seconds (plus or minus a random jitter), like a
+round trip to the server, and is counted by method in calls. The lists are
+pybis Things: iterating them fetches every item again with one call each, like
+pybis does, so the N+1 patterns cost what they cost against a real server.
+get_property_assignments is local in pybis and is counted without latency.
+
+The answers have the shape of the pybis ones, not of the snapshot: a property
+assignment only refers to its property type by permId (the code of the type) and
+has its own attributes (section, ordinal, mandatory, plugin); the label,
+description, data type, vocabulary and metadata of the type come from
+get_property_type or get_property_types, whose data frame has no permId column.
+
+Usage:
+    o = FakeOpenbis.load("benchmarks/fixtures/openbis_snapshot.json", latency=0.02, jitter=0.005)
+    entity_checker(workbook, o)
+    print(o.calls)
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import pandas as pd
+from pybis.things import Things
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "openbis_snapshot.json")
+
+# Sheet entity type -> (single getter, list getter, pybis entity name)
+ENTITY_METHODS = {
+    "SAMPLE_TYPE": ("get_object_type", "get_object_types", "sampleType"),
+    "EXPERIMENT_TYPE": ("get_collection_type", "get_collection_types", "experimentType"),
+    "DATASET_TYPE": ("get_dataset_type", "get_dataset_types", "dataSetType"),
+    "VOCABULARY_TYPE": ("get_vocabulary", "get_vocabularies", "vocabulary"),
+    "MATERIAL_TYPE": ("get_material_type", "get_material_types", "materialType"),
+}
+# Columns of the data frames of pybis property type searches, and of property assignments
+PROPERTY_TYPE_COLUMNS = ["code", "label", "description", "dataType", "vocabulary", "metaData"]
+ASSIGNMENT_COLUMNS = ["propertyType", "section", "ordinal", "mandatory", "plugin"]
+
+
+class FakeEntityType(SimpleNamespace):
+
+    def __init__(self, openbis, entry):
+        super().__init__(**entry["attributes"])
+        self._openbis = openbis
+        self._entry = entry
+
+    def get_property_assignments(self):
+        # Iterating them fetches every property type with get_property_type, their data frame does not
+        self._openbis._count("get_property_assignments")
+        response = [
+            {"propertyType": {"@type": "as.dto.property.id.PropertyTypePermId", "permId": record["propertyType"]},
+             "section": record.get("section"), "ordinal": record.get("ordinal"), "mandatory": record.get("mandatory"),
+             "plugin": record.get("plugin")}
+            for record in self._entry["assignments_df"]
+        ]
+        return Things(self._openbis, "propertyType", identifier_name="propertyType",
+                      single_item_method=self._openbis.get_property_type, response=response,
+                      df_initializer=lambda attrs, props, response: pd.DataFrame(
+                          [dict(item, propertyType=item["propertyType"]["permId"]) for item in response], columns=ASSIGNMENT_COLUMNS))
+
+
+class FakeOpenbis:
+
+    def __init__(self, data, latency=0.0, jitter=0.0, seed=0, url=None):
+        self.data = data
+        self.url = url or data.get("instance", "https://fake-openbis")
+        self.latency = latency
+        self.jitter = jitter
+        self.token = None
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=FIXTURE, **options):
+        with open(path, encoding="utf-8") as snapshot_file:
+            return cls(json.load(snapshot_file), **options)
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] += 1
+
+    def _call(self, method):
+        # One round trip: counted, and as slow as latency +/- jitter
+        with self._lock:
+            self.calls[method] += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        if delay:
+            time.sleep(delay)
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    # Session
+
+    def login(self, username, password, save_token=False):
+        self._call("login")
+        self.token = f"{username}-{self._random.getrandbits(32):08x}"
+        return self.token
+
+    def logout(self):
+        self._call("logout")
+        self.token = None
+
+    def is_session_active(self):
+        self._call("is_session_active")
+        return self.token is not None
+
+    def is_token_valid(self, token=None):
+        self._call("is_token_valid")
+        return (token or self.token) is not None
+
+    # Entity types
+
+    def _entity_types(self, e_type):
+        return self.data["entity_types"].get(e_type, {})
+
+    def _entity_type(self, e_type, code):
+        self._call(ENTITY_METHODS[e_type][0])
+        entry = self._entity_types(e_type).get(code)
+        if entry is None:
+            raise ValueError(f"no such {ENTITY_METHODS[e_type][2]}: {code}")
+        return FakeEntityType(self, entry)
+
+    def _entity_type_list(self, e_type):
+        self._call(ENTITY_METHODS[e_type][1])
+        entries = self._entity_types(e_type)
+        # The search response carries the property assignments of every type, like openBIS
+        response = {"objects": [
+            {"code": code, "description": entry["attributes"].get("description"),
+             "propertyAssignments": [{"propertyType": {"code": record.get("propertyType")}} for record in entry["assignments_df"]]}
+            for code, entry in entries.items()
+        ]}
+        return Things(self, ENTITY_METHODS[e_type][2], identifier_name="code",
+                      single_item_method=getattr(self, ENTITY_METHODS[e_type][0]), response=response,
+                      df_initializer=lambda attrs, props, response: pd.DataFrame(
+                          [{"code": item["code"], "description": item["description"]} for item in response["objects"]],
+                          columns=["code", "description"]))
+
+    def get_object_type(self, code):
+        return self._entity_type("SAMPLE_TYPE", code)
+
+    def get_object_types(self):
+        return self._entity_type_list("SAMPLE_TYPE")
+
+    def get_collection_type(self, code):
+        return self._entity_type("EXPERIMENT_TYPE", code)
+
+    def get_collection_types(self):
+        return self._entity_type_list("EXPERIMENT_TYPE")
+
+    def get_dataset_type(self, code):
+        return self._entity_type("DATASET_TYPE", code)
+
+    def get_dataset_types(self):
+        return self._entity_type_list("DATASET_TYPE")
+
+    def get_vocabulary(self, code):
+        return self._entity_type("VOCABULARY_TYPE", code)
+
+    def get_vocabularies(self):
+        return self._entity_type_list("VOCABULARY_TYPE")
+
+    def get_material_type(self, code):
+        return self._entity_type("MATERIAL_TYPE", code)
+
+    def get_material_types(self):
+        return self._entity_type_list("MATERIAL_TYPE")
+
+    # Property types
+
+    def get_property_type(self, code):
+        self._call("get_property_type")
+        if code not in self.data["property_types"]:
+            raise ValueError(f"no such propertyType: {code}")
+        return SimpleNamespace(**self.data["property_types"][code])
+
+    def get_property_types(self):
+        self._call("get_property_types")
+        records = [{name: values.get(name) for name in PROPERTY_TYPE_COLUMNS} for values in self.data["property_types"].values()]
+        return Things(self, "propertyType", identifier_name="code", single_item_method=self.get_property_type,
+                      response=records, df_initializer=lambda attrs, props, response: pd.DataFrame(response, columns=PROPERTY_TYPE_COLUMNS))
+
+    # Plugins, spaces and projects (names or codes only)
+
+    def _named(self, kind, method, identifier):
+        def get_item(name):
+            self._call(method)
+            if name not in self.data.get(kind, []):
+                raise ValueError(f"no such {kind[:-1]}: {name}")
+            return SimpleNamespace(**{identifier: name, "code": name, "name": name})
+        return get_item
+
+    def _named_list(self, kind, method, single_method, identifier):
+        self._call(method)
+        names = list(self.data.get(kind, []))
+        return Things(self, kind[:-1], identifier_name=identifier, single_item_method=getattr(self, single_method),
+                      response=names, df_initializer=lambda attrs, props, response: pd.DataFrame({identifier: response}, columns=[identifier]))
+
+    def get_plugin(self, name):
+        return self._named("plugins", "get_plugin", "name")(name)
+
+    def get_plugins(self):
+        return self._named_list("plugins", "get_plugins", "get_plugin", "name")
+
+    def get_space(self, code):
+        return self._named("spaces", "get_space", "code")(code)
+
+    def get_spaces(self):
+        return self._named_list("spaces", "get_spaces", "get_space", "code")
+
+    def get_project(self, code):
+        return self._named("projects", "get_project", "code")(code)
+
+    def get_projects(self):
+        return self._named_list("projects", "get_projects", "get_project", "code")
+
+
+def make_fixture(object_types=32, collection_types=8, dataset_types=8, vocabularies=8, properties=10, seed=0):
+    """
+    A small instance in the snapshot format: object types with properties
+    assignments each (the dotted codes extend the type before the last dot and
+    inherit its properties), collection and dataset types, vocabularies, the
+    property types, spaces, projects and plugins.
+    """
+    generator = random.Random(seed)
+    data_types = ["VARCHAR", "MULTILINE_VARCHAR", "INTEGER", "REAL", "BOOLEAN", "DATE", "CONTROLLEDVOCABULARY"]
+    property_types = {}
+
+    def property_type(code):
+        if code not in property_types:
+            data_type = generator.choice(data_types)
+            property_types[code] = {
+                "code": code, "permId": code, "label": code.title().replace("_", " "),
+                "description": f"{code}//{code}", "dataType": data_type,
+                "vocabulary": f"VOCABULARY_{generator.randrange(vocabularies)}" if data_type == "CONTROLLEDVOCABULARY" else None,
+                "metaData": {},
+            }
+        return property_types[code]
+
+    def entity_type(code, property_codes, prefix=""):
+        # The snapshot keeps the assignments joined with their property types, as dump_snapshot writes them
+        assignments = [property_type(name) for name in property_codes]
+        return {
+            "attributes": {"code": code, "description": f"{code}//{code}", "autoGeneratedCode": False,
+                           "validationPlugin": None, "generatedCodePrefix": prefix},
+            "assignments": assignments,
+            "assignments_df": [{"propertyType": name, "mandatory": i == 0, "section": "General Information",
+                                "plugin": None, "ordinal": i + 1} for i, name in enumerate(property_codes)],
+        }
+
+    shared = ["$NAME", "$SHOW_IN_PROJECT_OVERVIEW", "$XMLCOMMENTS", "$ANNOTATIONS_STATE"]
+    entity_types = {e_type: {} for e_type in ENTITY_METHODS}
+    object_codes = []
+    for i in range(object_types):
+        if i % 4 == 3 and object_codes:
+            # A specialization of an existing type: its properties plus a few of its own
+            parent = generator.choice([code for code in object_codes if code.count(".") < 2])
+            code = f"{parent}.SUB_{i}"
+            own = entity_types["SAMPLE_TYPE"][parent]["assignments_df"]
+            names = [record["propertyType"] for record in own] + [f"{code}.P{j}" for j in range(3)]
+        else:
+            code = f"TYPE_{i}"
+            names = shared[:generator.randint(1, len(shared))] + [f"{code}.P{j}" for j in range(properties)]
+        object_codes.append(code)
+        entity_types["SAMPLE_TYPE"][code] = entity_type(code, names, code[:3])
+    entity_types["SAMPLE_TYPE"]["UNKNOWN"] = entity_type("UNKNOWN", [])
+    for e_type, count, prefix in (("EXPERIMENT_TYPE", collection_types, "COLLECTION"), ("DATASET_TYPE", dataset_types, "DATA")):
+        for i in range(count):
+            code = f"{prefix}_{i}"
+            entity_types[e_type][code] = entity_type(code, shared[:1] + [f"{code}.P{j}" for j in range(properties // 3)])
+    for i in range(vocabularies):
+        code = f"VOCABULARY_{i}"
+        entity_types["VOCABULARY_TYPE"][code] = entity_type(code, [])
+
+    return {
+        "version": 1,
+        "instance": "https://fake-openbis",
+        "created": "2024-01-01T00:00:00",
+        "entity_types": entity_types,
+        "property_sets": {e_type: {code: sorted(record["propertyType"] for record in entry["assignments_df"])
+                                   for code, entry in entries.items()} for e_type, entries in entity_types.items()},
+        "property_types": property_types,
+        "spaces": [f"SPACE_{i}" for i in range(8)],
+        "projects": [f"/SPACE_{i % 8}/PROJECT_{i}" for i in range(20)],
+        "plugins": [f"plugin_{i}.py" for i in range(12)],
+    }
+
+
+if __name__ == "__main__":
+    os.makedirs(os.path.dirname(FIXTURE), exist_ok=True)
+    with open(FIXTURE, "w", encoding="utf-8") as fixture_file:
+        json.dump(make_fixture(), fixture_file)
+        fixture_file.write("\n")
+    print(FIXTURE)
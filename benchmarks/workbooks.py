@@ -0,0 +1,240 @@
+"""
+Synthetic masterdata workbooks for the benchmarks.
+
+make_rows builds the rows of a SAMPLE_TYPE, EXPERIMENT_TYPE, DATASET_TYPE,
+PROPERTY_TYPE or VOCABULARY_TYPE sheet with any number of property rows (or
+terms). A "valid" sheet passes the content checks; a "broken" one has about
+1% of its rows damaged with the mistakes the checkers look for (bad codes,
+descriptions, booleans, data types, sections, repeated codes, misplaced notes),
+plus a wrong version and generated code prefix in the entity row.
+
+make_snapshot builds the matching offline masterdata snapshot (see
+myapp/offline.py), so that entity_checker can run without openBIS: the entity
+type exists with most of the properties of the sheet assigned, some of them
+changed, and a few similar entity types exist next to it.
+
+make_xls writes the same sheet as a legacy .xls workbook (needs xlwt, at most
+65536 rows).
+
+Usage (writes one workbook):
+    python benchmarks/workbooks.py SAMPLE_TYPE 1000 [valid|broken] [directory]
+"""
+
+import os
+import random
+import sys
+
+import openpyxl
+
+try:
+    import xlwt
+except ImportError:  # only needed for the .xls workbooks
+    xlwt = None
+
+XLS_MAX_ROWS = 65536
+
+KINDS = ("SAMPLE_TYPE", "EXPERIMENT_TYPE", "DATASET_TYPE", "PROPERTY_TYPE", "VOCABULARY_TYPE")
+VARIANTS = ("valid", "broken")
+
+# File name prefixes (name_checker does not accept the property_type one)
+FILE_PREFIXES = {
+    "SAMPLE_TYPE": "object_type",
+    "EXPERIMENT_TYPE": "collection_type",
+    "DATASET_TYPE": "dataset_type",
+    "VOCABULARY_TYPE": "vocabulary",
+    "PROPERTY_TYPE": "property_type",
+}
+
+CODE = "BENCH.TYPE"
+PREFIX = "BENCH"
+CODE_PREFIX = "BEN.TYP"
+
+ENTITY_HEADERS = {
+    "SAMPLE_TYPE": ("Version", "Code", "Description", "Validation script", "Generated code prefix", "Auto generate codes"),
+    "EXPERIMENT_TYPE": ("Version", "Code", "Description", "Validation script"),
+    "DATASET_TYPE": ("Version", "Code", "Description", "Validation script"),
+    "VOCABULARY_TYPE": ("Version", "Code", "Description"),
+}
+PROPERTY_HEADERS = (
+    "Version", "Code", "Description", "Mandatory", "Show in edit views",
+    "Section", "Property label", "Data type", "Vocabulary code", "Metadata", "Dynamic script",
+)
+PROPERTY_TYPE_HEADERS = PROPERTY_HEADERS[:9]
+TERM_HEADERS = ("Version", "Code", "Label", "Description")
+
+DATA_TYPES = ("VARCHAR", "INTEGER", "REAL", "BOOLEAN", "DATE", "CONTROLLEDVOCABULARY")
+
+# Broken cells: (header, value)
+PROPERTY_DEFECTS = (
+    ("Version", "one"),
+    ("Code", "bench.lower case"),
+    ("Description", "no translation"),
+    ("Mandatory", "maybe"),
+    ("Show in edit views", "yes"),
+    ("Section", "lower case section"),
+    ("Data type", "TEXT"),
+    ("Vocabulary code", "vocab"),
+)
+TERM_DEFECTS = (
+    ("Version", "one"),
+    ("Code", "term lower"),
+    ("Description", "no translation"),
+)
+
+
+def file_name(kind, code=CODE):
+    return f"{FILE_PREFIXES[kind]}_{code}_v1_S_bench.xlsx"
+
+
+def property_code(i):
+    return f"BENCH.PROP_{i}"
+
+
+def section(i, rows):
+    # General Information, then a user-defined section, and the last two rows in
+    # Additional Information and Comments (a predefined section cannot span several rows)
+    if i == rows - 1 and rows >= 4:
+        return "Comments"
+    if i == rows - 2 and rows >= 4:
+        return "Additional Information"
+    return "General Information" if i < rows // 2 else "Measurement Details"
+
+
+def _property_row(i, rows, data_type_values=DATA_TYPES):
+    # "Notes" only in the Additional Information section
+    section_value = section(i, rows)
+    label = "Notes" if section_value == "Additional Information" else f"Property {i}"
+    data_type = data_type_values[i % len(data_type_values)]
+    vocabulary = "BENCH.VOCABULARY" if data_type == "CONTROLLEDVOCABULARY" else None
+    return [1, property_code(i), f"Property {i}//Eigenschaft {i}", "FALSE" if i % 3 else "TRUE", "TRUE",
+            section_value, label, data_type, vocabulary, None, None]
+
+
+def _damage(generator, rows, first, headers, defects, repeat_code=True):
+    # About 1% of the rows get one broken cell, plus a repeated code and a misplaced note
+    for index in range(first, len(rows)):
+        if generator.random() < 0.01:
+            header, value = generator.choice(defects)
+            rows[index][headers.index(header)] = value
+    if len(rows) - first >= 2 and repeat_code:
+        rows[-1][headers.index("Code")] = rows[first][headers.index("Code")]
+    if "Property label" in headers and len(rows) - first >= 1:
+        rows[first][headers.index("Property label")] = "Notes"
+
+
+def make_rows(kind, rows, variant="valid", seed=0):
+    """
+    Rows of a sheet of the given kind with rows property rows (or terms), as
+    tuples like ParsedWorkbook reads them.
+    """
+    generator = random.Random(seed)
+    broken = variant == "broken"
+
+    if kind == "PROPERTY_TYPE":
+        sheet = [["PROPERTY_TYPE"], list(PROPERTY_TYPE_HEADERS)]
+        for i in range(rows):
+            row = _property_row(i, rows)[:len(PROPERTY_TYPE_HEADERS)]
+            # General Information, the last row in Additional Information, no notes
+            row[PROPERTY_TYPE_HEADERS.index("Section")] = "Additional Information" if i == rows - 1 and rows >= 2 else "General Information"
+            row[PROPERTY_TYPE_HEADERS.index("Property label")] = f"Property {i}"
+            sheet.append(row)
+        if broken:
+            _damage(generator, sheet, 2, PROPERTY_TYPE_HEADERS, PROPERTY_DEFECTS, repeat_code=False)
+        return [tuple(row) for row in sheet]
+
+    headers = ENTITY_HEADERS[kind]
+    entity = {"Version": 1, "Code": CODE, "Description": "Benchmark type//Benchmark Typ",
+              "Validation script": None, "Generated code prefix": CODE_PREFIX, "Auto generate codes": "TRUE"}
+    if broken:
+        entity.update({"Version": 2, "Generated code prefix": "BENCH"})
+    sheet = [[kind], list(headers), [entity[header] for header in headers]]
+
+    if kind == "VOCABULARY_TYPE":
+        sheet.append(list(TERM_HEADERS))
+        sheet.extend([1, f"TERM_{i}", f"Term {i}", f"Term {i}//Begriff {i}"] for i in range(rows))
+        if broken:
+            _damage(generator, sheet, 4, TERM_HEADERS, TERM_DEFECTS)
+    else:
+        sheet.append(list(PROPERTY_HEADERS))
+        sheet.extend(_property_row(i, rows) for i in range(rows))
+        if broken:
+            _damage(generator, sheet, 4, PROPERTY_HEADERS, PROPERTY_DEFECTS)
+    return [tuple(row) for row in sheet]
+
+
+def make_workbook(path, kind, rows, variant="valid", seed=0):
+    # Write-only mode keeps the 100k row workbooks fast to generate
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in make_rows(kind, rows, variant, seed):
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def make_xls(path, kind, rows, variant="valid", seed=0):
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet(kind)
+    for r, row in enumerate(make_rows(kind, rows, variant, seed)):
+        for c, value in enumerate(row):
+            if value is not None:
+                sheet.write(r, c, value)
+    workbook.save(path)
+    return path
+
+
+def _assignment(i, changed=False):
+    row = _property_row(i, 1)
+    return {"code": property_code(i), "permId": property_code(i), "label": f"Property {i}" + (" (old)" if changed else ""),
+            "description": row[2], "dataType": row[7], "vocabulary": row[8], "metaData": {}}
+
+
+def make_snapshot(kind, rows, similar=5):
+    """
+    Offline masterdata snapshot (myapp/offline.py format) for the sheets of make_rows:
+    the entity type exists with 95% of the properties assigned (every 50th one with a
+    changed label), the others exist as unassigned property types. Its prefix type
+    BENCH has the first five properties.
+    """
+    entity_types = {}
+    property_sets = {}
+    if kind in ("SAMPLE_TYPE", "EXPERIMENT_TYPE", "DATASET_TYPE"):
+        assigned = [i for i in range(rows) if i % 20]
+        assignments = [_assignment(i, changed=i % 50 == 1) for i in assigned]
+        records = [{"propertyType": property_code(i), "mandatory": "TRUE" if i % 3 == 0 else "FALSE",
+                    "section": section(i, rows), "plugin": None} for i in assigned]
+        records_by_code = {record["propertyType"]: record for record in records}
+        entity_types[CODE] = {
+            "attributes": {"code": CODE, "description": "Benchmark type//Benchmark Typ", "autoGeneratedCode": True,
+                           "validationPlugin": None, "generatedCodePrefix": CODE_PREFIX},
+            "assignments": assignments,
+            "assignments_df": records,
+        }
+        property_sets[CODE] = sorted(property_code(i) for i in assigned)
+        # The prefix type (BENCH of BENCH.TYPE) with the first properties, unchanged
+        inherited = range(min(rows, 5))
+        entity_types[PREFIX] = {
+            "attributes": {"code": PREFIX, "description": "Benchmark//Benchmark", "autoGeneratedCode": True,
+                           "validationPlugin": None, "generatedCodePrefix": "BEN"},
+            "assignments": [_assignment(i) for i in inherited],
+            "assignments_df": [records_by_code[property_code(i)] for i in inherited if property_code(i) in records_by_code],
+        }
+        property_sets[PREFIX] = sorted(property_code(i) for i in inherited)
+        # Existing types sharing most of the properties, for the similarity search of new types
+        for n in range(similar):
+            property_sets[f"BENCH.SIMILAR_{n}"] = sorted(property_code(i) for i in range(rows) if i % (n + 2))
+    return {
+        "version": 1,
+        "instance": "https://benchmark",
+        "created": "2024-01-01T00:00:00",
+        "entity_types": {kind: entity_types},
+        "property_sets": {kind: property_sets},
+        "property_types": {property_code(i): _assignment(i) for i in range(rows)},
+    }
+
+
+if __name__ == "__main__":
+    kind, count = sys.argv[1], int(sys.argv[2])
+    variant = sys.argv[3] if len(sys.argv) > 3 else "valid"
+    directory = sys.argv[4] if len(sys.argv) > 4 else "."
+    print(make_workbook(os.path.join(directory, file_name(kind)), kind, count, variant))
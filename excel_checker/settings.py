@@ -176,4 +176,87 @@ LOGGING = {
             'propagate': False,
         },
     },
-}
\ No newline at end of file
+}
+
+
+# Masterdata checker
+
+# Backend used to evaluate the column rules of the property rows: "python" (row by row),
+# "columnar" (vectorized with pandas) or "auto" (columnar from CHECKER_COLUMNAR_MIN_ROWS rows)
+CHECKER_RULE_BACKEND = "auto"
+CHECKER_COLUMNAR_MIN_ROWS = 10000
+
+# Reader of the .xlsx workbooks: "openpyxl" (read-only mode), "calamine" (native, needs python-calamine)
+# or "auto" (calamine when installed); .xls workbooks are read with xlrd
+CHECKER_READER = "auto"
+
+# openBIS server and the pool of authenticated sessions shared by the requests of a user
+OPENBIS_URL = "url"
+OPENBIS_POOL_MAX_SIZE = 32  # connections kept alive (least recently used evicted first)
+OPENBIS_POOL_IDLE_TIMEOUT = 900  # seconds before an unused connection is dropped
+OPENBIS_TOKEN_CHECK_INTERVAL = 60  # seconds between two token validity checks against openBIS
+
+# Seconds the masterdata of an instance (entity types, property assignments, property types,
+# vocabularies, plugins) is cached before it is fetched again from openBIS
+MASTERDATA_CACHE_TTL = 3600
+
+# openBIS users (besides Django staff) allowed to drop the cached masterdata snapshot, shared by all users
+MASTERDATA_ADMINS = ()
+
+# New entity types sharing at least this fraction (Jaccard) of their property types with an
+# existing type are reported, at most ENTITY_SIMILARITY_TOP_K of them
+ENTITY_SIMILARITY_THRESHOLD = 0.8
+ENTITY_SIMILARITY_TOP_K = 5
+
+# Independent openBIS calls (e.g. the instance snapshot) run on at most OPENBIS_FETCH_WORKERS
+# threads, and a single call running longer than OPENBIS_FETCH_TIMEOUT seconds is abandoned
+OPENBIS_FETCH_WORKERS = 8
+OPENBIS_FETCH_TIMEOUT = 60
+
+# Instance CSV snapshots are stored here (the session only keeps a handle) and removed
+# after INSTANCE_CSV_MAX_AGE seconds
+INSTANCE_CSV_DIR = BASE_DIR / "instance_csv"
+INSTANCE_CSV_MAX_AGE = SESSION_COOKIE_AGE
+
+# Threads running the blocking work (openBIS calls, parsing) of the async views
+CHECKER_ASYNC_WORKERS = 16
+
+# Background validation jobs: SQLite queue, spooled uploads, worker processes,
+# maximum number of queued or running jobs, and seconds the results are kept
+JOB_DB = BASE_DIR / "jobs.sqlite3"
+JOB_SPOOL_DIR = BASE_DIR / "job_spool"
+JOB_WORKERS = 2
+JOB_QUEUE_MAX = 50
+JOB_RESULT_TTL = 24 * 3600
+
+# Batch checks (several files or a zip): at most BATCH_MAX_FILES workbooks, parsed and checked
+# on BATCH_WORKERS processes (None: one per core)
+BATCH_MAX_FILES = 200
+BATCH_WORKERS = None
+
+# Results of the last RESULT_CACHE_SIZE checked workbooks (per process, keyed on the content
+# hash and file name) are reused for identical re-uploads; 0 disables the cache
+RESULT_CACHE_SIZE = 128
+
+# Row fingerprints of the last checked revision of at most INCREMENTAL_MAX_REVISIONS entity types
+# (per process): unchanged rows of a new revision are not checked again; 0 disables it
+INCREMENTAL_MAX_REVISIONS = 256
+
+# Clients allowed to read the timing metrics of the checks (Prometheus text format, /metrics/)
+METRICS_ALLOWED_ADDRESSES = ("127.0.0.1", "::1")
+
+# openBIS calls of one request: a pybis method called OPENBIS_N_PLUS_ONE_THRESHOLD times is logged
+# as a probable N+1 pattern, and a request making more than OPENBIS_CALL_BUDGET calls fails (None: no limit)
+OPENBIS_N_PLUS_ONE_THRESHOLD = 10
+OPENBIS_CALL_BUDGET = None
+
+# Uploads are spooled to UPLOAD_SPOOL_DIR (None: the system temporary directory) and rejected before
+# parsing when larger than UPLOAD_MAX_BYTES, when they unpack to more than UPLOAD_MAX_UNCOMPRESSED_BYTES
+# or a part is compressed more than UPLOAD_MAX_COMPRESSION_RATIO times, or when the sheet has more than
+# UPLOAD_MAX_ROWS rows or UPLOAD_MAX_COLUMNS columns
+UPLOAD_SPOOL_DIR = None
+UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+UPLOAD_MAX_UNCOMPRESSED_BYTES = 200 * 1024 * 1024
+UPLOAD_MAX_COMPRESSION_RATIO = 100
+UPLOAD_MAX_ROWS = 100000
+UPLOAD_MAX_COLUMNS = 200
@@ -24,6 +24,12 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path('', views.homepage, name='homepage'),
     path('check_instance/', views.check_instance, name='check_instance'),
+    path('api/check/', views.check_api, name='check_api'),
+    path('batch/', views.batch_check, name='batch_check'),
+    path('jobs/', views.submit_job, name='submit_job'),
+    path('jobs/<str:job_id>/', views.job_status, name='job_status'),
+    path('masterdata/invalidate/', views.invalidate_masterdata, name='invalidate_masterdata'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('download_csv/<str:filename>/', views.download_csv, name='download_csv'),
     path('login/', views.login, name='login'),
     path('logout/', views.logout_view, name='logout'),
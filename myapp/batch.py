@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of a set of workbooks (a zip or several files) in one request.
+
+Parsing a workbook and checking its name and content is CPU-bound, so the files
+are spread over a pool of BATCH_WORKERS processes (one per core by default).
+The entity checks wait on openBIS instead: they run on threads of the web
+process with one openBIS session and one masterdata snapshot for the whole set,
+so an entity type shared by several files is fetched only once.
+
+Every workbook is spooled to disk on its own and checked against the upload
+limits (see uploads) before it is parsed; the workers read it from there and
+send back only the part of the workbook the entity checks read.
+"""
+
+import logging
+import os
+import posixpath
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from django.conf import settings
+from myapp import masterdata, metrics, result_cache, uploads
+from myapp.jobs import process_pool
+
+logger = logging.getLogger('myapp')
+
+EXTENSIONS = ('.xls', '.xlsx')
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def read_uploads(uploaded_files):
+    """
+    Expands the uploaded files (workbooks and zips of workbooks) into
+    ([uploads.SpooledUpload], [(file name, reason)]) of the files to check and
+    the ones skipped, spooling the workbooks one by one. A workbook over the
+    upload limits is skipped; beyond BATCH_MAX_FILES workbooks BatchTooLarge is
+    raised. The caller closes the spooled uploads.
+    """
+    max_files = getattr(settings, "BATCH_MAX_FILES", 200)
+    files, skipped = [], []
+
+    def add(file_name, spool):
+        if not file_name.endswith(EXTENSIONS):
+            skipped.append((file_name, "Invalid file type. Only .xls and .xlsx files are allowed."))
+            return
+        if len(files) >= max_files:
+            raise BatchTooLarge(f"A batch can contain at most {max_files} files.")
+        try:
+            files.append(spool())
+        except uploads.UploadRejected as e:
+            skipped.append((file_name, f"File rejected: {str(e)}"))
+        except (zipfile.BadZipFile, RuntimeError) as e:
+            # A damaged or encrypted member of the zip
+            skipped.append((file_name, f"Invalid zip file: {str(e)}"))
+
+    try:
+        for uploaded_file in uploaded_files:
+            if uploaded_file.name.endswith(".zip"):
+                try:
+                    archive = zipfile.ZipFile(uploaded_file)
+                except zipfile.BadZipFile:
+                    skipped.append((uploaded_file.name, "Invalid zip file."))
+                    continue
+                with archive:
+                    for entry in archive.infolist():
+                        # Folders and the metadata added by macOS are not workbooks
+                        if entry.is_dir() or entry.filename.startswith("__MACOSX/"):
+                            continue
+                        file_name = posixpath.basename(entry.filename)
+                        add(file_name, partial(uploads.spool_entry, archive, entry, file_name))
+            else:
+                add(uploaded_file.name, partial(uploads.spool, uploaded_file))
+    except BaseException:
+        close(files)
+        raise
+    return files, skipped
+
+
+def close(files):
+    for upload in files:
+        upload.close()
+
+
+def check_file(path, file_name=None, entity=True):
+    # Runs in a worker process: parse once, then the name and content checks. Only what the
+    # entity checks read of the workbook is sent back to the web process. Without the entity
+    # checks (entity=False) the rows are streamed through the content checks and no workbook
+    # is sent back
+    from myapp.utils import ParsedWorkbook, name_checker, content_checker, stream_content_checker, entity_workbook
+
+    file_name = file_name or os.path.basename(path)
+    result_name, code, name_ok = name_checker(file_name)
+    with open(path, "rb") as workbook_file:
+        if not entity:
+            return None, result_name, code, name_ok, stream_content_checker(workbook_file, name_ok, file_name)
+        workbook = ParsedWorkbook.load(workbook_file, file_name, uploads.max_rows())
+    result_content = content_checker(workbook, name_ok)
+    return entity_workbook(workbook), result_name, code, name_ok, result_content
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, "BATCH_WORKERS", None) or os.cpu_count()
+            _executor = process_pool(workers)
+        return _executor
+
+
+def submit(path, file_name):
+    # check_file on the worker pool. A pool broken by a worker that died (e.g. out of memory on a
+    # large workbook) is replaced, instead of failing every later batch
+    pool = executor()
+    try:
+        future = pool.submit(check_file, path, file_name)
+    except BrokenProcessPool:
+        logger.warning("A batch worker died, starting new workers")
+        _discard(pool)
+        pool = executor()
+        future = pool.submit(check_file, path, file_name)
+    future.add_done_callback(partial(_discard_broken, pool))
+    return future
+
+
+def _discard(pool):
+    global _executor
+    with _executor_lock:
+        if _executor is pool:
+            _executor = None
+
+
+def _discard_broken(pool, future):
+    # The files parsed by the dead worker fail, the next ones get a new pool
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard(pool)
+
+
+def validate(files, o):
+    """
+    Checks [uploads.SpooledUpload] and returns one row per file, in the same order:
+    {"file_name", "code", "report", "error"}. A file that cannot be checked gets
+    an error (and no report) and does not stop the others.
+    """
+    from myapp.utils import entity_checker, build_report
+
+    lookups = masterdata.RequestLookups(o)
+    results = result_cache.cache()
+    rows = [{"file_name": upload.name, "code": "", "report": None, "error": ""} for upload in files]
+
+    def check_entity(row, cache_key, parsed):
+        workbook, result_name, code, name_ok, result_content = parsed
+        row["code"] = code
+        with metrics.stage("entity"):
+            result_entity = entity_checker(workbook, o, lookups)
+        results.put(cache_key, (result_name, code, name_ok), result_content, lookups.version, result_entity)
+        row["report"] = build_report(row["file_name"], code, result_name, result_content, result_entity)
+
+    # Files checked before against the same masterdata are not sent to the workers
+    parsing = {}
+    for row, upload in zip(rows, files):
+        cache_key = result_cache.upload_key(upload)
+        cached = results.get(cache_key)
+        result_entity = cached.entity(lookups.version) if cached is not None else None
+        if result_entity is not None:
+            (result_name, code, _), result_content = cached.name, cached.content
+            row["code"] = code
+            row["report"] = build_report(upload.name, code, result_name, result_content, result_entity)
+        else:
+            parsing[submit(upload.path, upload.name)] = (row, cache_key)
+
+    with ThreadPoolExecutor(max_workers=getattr(settings, "OPENBIS_FETCH_WORKERS", 8)) as threads:
+        # Entity checks start as soon as their file is parsed, while the others are still parsing
+        checking = []
+        for future in as_completed(parsing):
+            row, cache_key = parsing[future]
+            try:
+                checking.append((row, threads.submit(metrics.bind(check_entity), row, cache_key, future.result())))
+            except Exception as e:
+                row["error"] = f"Error processing file: {str(e)}"
+        for row, future in checking:
+            try:
+                future.result()
+            except Exception as e:
+                row["error"] = f"Error processing file: {str(e)}"
+
+    logger.info(f"Checked a batch of {len(files)} files ({len(files) - len(parsing)} cached), entity lookups: {dict(lookups.calls)}")
+    return rows
+
+
+def row_as_dict(row):
+    # JSON of a row of the batch table
+    report = row["report"].as_dict() if row["report"] is not None else {"code": row["code"], "passed": False, "issues": []}
+    return dict(report, file_name=row["file_name"], error=row["error"])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side storage of the instance CSV snapshots.
+
+The CSV is written once to INSTANCE_CSV_DIR and the session only keeps its handle
+(a random file name), so the session payload does not grow with the instance.
+Files older than INSTANCE_CSV_MAX_AGE seconds are removed when a new one is saved.
+"""
+
+import logging
+import os
+import re
+import time
+import uuid
+from django.conf import settings
+
+logger = logging.getLogger('myapp')
+
+HANDLE_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+CHUNK_SIZE = 64 * 1024
+
+
+def storage_dir():
+    directory = getattr(settings, "INSTANCE_CSV_DIR", None) or os.path.join(settings.BASE_DIR, "instance_csv")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def csv_path(handle):
+    # Handles come from the session, but never let them point outside of the storage
+    if not handle or not HANDLE_PATTERN.match(handle):
+        return None
+    return os.path.join(storage_dir(), f"{handle}.csv")
+
+
+def save_csv(content):
+    remove_expired()
+    handle = uuid.uuid4().hex
+    path = csv_path(handle)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as csv_file:
+        csv_file.write(content)
+    os.replace(tmp_path, path)
+    return handle
+
+
+def delete_csv(handle):
+    path = csv_path(handle)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def iter_csv(handle):
+    # Chunks of the stored CSV, or None if it does not exist (anymore)
+    path = csv_path(handle)
+    if path is None or not os.path.exists(path):
+        return None
+    csv_file = open(path, "rb")
+
+    def chunks():
+        with csv_file:
+            while True:
+                chunk = csv_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    return chunks()
+
+
+def remove_expired():
+    max_age = getattr(settings, "INSTANCE_CSV_MAX_AGE", getattr(settings, "SESSION_COOKIE_AGE", 3600))
+    now = time.time()
+    for entry in os.scandir(storage_dir()):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"Could not remove the expired CSV {entry.name}: {str(e)}")
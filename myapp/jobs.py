@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Background validation of uploads, without an external broker.
+
+An upload is spooled to JOB_SPOOL_DIR and recorded as "queued" in a SQLite table
+(JOB_DB), which is the queue: the JOB_WORKERS worker processes of a web process
+claim the queued rows, oldest first, mark them "running", run the name, content
+and entity checks and store the result ("done") or the error ("failed") in the
+same table. The status endpoint of any web process can answer for any job, and
+the workers of any web process can run it.
+
+Queued jobs survive a restart and are run once a web process starts its workers
+again (on its first job, or when a queued job is polled). A job left running by
+a worker that no longer exists is queued again, up to MAX_ATTEMPTS times. The
+session token and encrypted password of the user are kept in the row until the
+job is finished, for the worker to log into openBIS.
+
+At most JOB_QUEUE_MAX jobs are queued or running at a time; finished jobs are
+removed after JOB_RESULT_TTL seconds.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import partial
+from django.conf import settings
+from myapp import uploads
+
+logger = logging.getLogger('myapp')
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Runs of a job interrupted by the end of its worker before it fails for good
+MAX_ATTEMPTS = 2
+
+COLUMNS = (
+    ("id", "TEXT PRIMARY KEY"), ("status", "TEXT NOT NULL"), ("file_name", "TEXT"), ("username", "TEXT"),
+    ("owner", "INTEGER"), ("created", "REAL"), ("started", "REAL"), ("finished", "REAL"), ("result", "TEXT"),
+    ("error", "TEXT"), ("file_path", "TEXT"), ("digest", "TEXT"), ("token", "TEXT"), ("password", "TEXT"),
+    ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def db_path():
+    return str(_setting("JOB_DB", None) or os.path.join(settings.BASE_DIR, "jobs.sqlite3"))
+
+
+def spool_dir():
+    directory = str(_setting("JOB_SPOOL_DIR", None) or os.path.join(settings.BASE_DIR, "job_spool"))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+_created = set()  # databases whose table is up to date, in this process
+
+
+@contextmanager
+def _connect(path=None):
+    # One short-lived connection per operation: safe across threads and worker processes
+    path = path or db_path()
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        if path not in _created:
+            _create_table(connection)
+            _created.add(path)
+        yield connection
+    finally:
+        connection.close()
+
+
+def _create_table(connection):
+    # Tables of older versions get the columns they are missing
+    connection.execute(f"CREATE TABLE IF NOT EXISTS jobs ({', '.join(f'{name} {kind}' for name, kind in COLUMNS)})")
+    existing = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+    for name, kind in COLUMNS:
+        if name not in existing:
+            connection.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind.replace('PRIMARY KEY', '')}")
+
+
+def _update(job_id, path=None, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with _connect(path) as connection:
+        connection.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def setup_worker():
+    # Worker processes started with "spawn" need their own Django setup
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+
+
+def process_pool(workers, initializer=setup_worker):
+    # Started with "spawn": forking the threads (and locks) of a running web process is not safe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=initializer)
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            recover()
+            _executor = process_pool(_setting("JOB_WORKERS", 2))
+        return _executor
+
+
+def wake():
+    # A worker claims the queued jobs (the ones of other web processes as well) until none is left.
+    # A pool broken by a worker that died (e.g. out of memory on a large workbook) is replaced:
+    # the new one queues again the jobs the dead worker left running (see recover)
+    pool = executor()
+    try:
+        future = pool.submit(work, db_path())
+    except BrokenProcessPool:
+        logger.warning("A job worker died, starting new workers")
+        _discard(pool)
+        pool = executor()
+        future = pool.submit(work, db_path())
+    future.add_done_callback(partial(_discard_broken, pool))
+
+
+def _discard(pool):
+    # The next executor() starts a new pool (unless another thread did it already)
+    global _executor
+    with _executor_lock:
+        if _executor is pool:
+            _executor = None
+
+
+def _discard_broken(pool, future):
+    # Noticed when the work of the dead worker ends, before the next wake()
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard(pool)
+
+
+def recover():
+    # Jobs left running by a worker that no longer exists are queued again, or fail after MAX_ATTEMPTS runs
+    with _connect() as connection:
+        for row in connection.execute("SELECT id, owner, file_path, attempts FROM jobs WHERE status = ?", (RUNNING,)).fetchall():
+            if _alive(row["owner"]):
+                continue
+            if row["attempts"] < MAX_ATTEMPTS and row["file_path"] and os.path.exists(row["file_path"]):
+                connection.execute("UPDATE jobs SET status = ?, owner = NULL WHERE id = ? AND status = ?", (QUEUED, row["id"], RUNNING))
+            else:
+                connection.execute("UPDATE jobs SET status = ?, error = ?, finished = ?, token = NULL, password = NULL WHERE id = ?",
+                                   (FAILED, "The job was interrupted, please upload the file again.", time.time(), row["id"]))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+def purge_expired():
+    limit = time.time() - _setting("JOB_RESULT_TTL", 24 * 3600)
+    with _connect() as connection:
+        connection.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?", (DONE, FAILED, limit))
+
+
+def enqueue(uploaded_file, username, token, encrypted_password):
+    """
+    Spools the upload and queues its validation; returns the job id.
+    Raises uploads.UploadRejected when the upload is over the limits (see uploads),
+    and QueueFull when JOB_QUEUE_MAX jobs are already waiting or running.
+    """
+    purge_expired()
+    job_id = uuid.uuid4().hex
+
+    # Checked against the upload limits before it is queued
+    file_path = os.path.join(spool_dir(), job_id)
+    digest = uploads.save(uploaded_file, file_path)
+    try:
+        uploads.check_limits(file_path)
+        with _connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            pending = connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchone()[0]
+            if pending >= _setting("JOB_QUEUE_MAX", 50):
+                connection.execute("ROLLBACK")
+                raise QueueFull(f"{pending} validations are already queued, please try again later.")
+            connection.execute("INSERT INTO jobs (id, status, file_name, username, created, file_path, digest, token, password)"
+                               " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (job_id, QUEUED, uploaded_file.name, username, time.time(), file_path, digest, token, encrypted_password))
+            connection.execute("COMMIT")
+    except BaseException:
+        os.remove(file_path)
+        raise
+
+    try:
+        wake()
+    except Exception:
+        # The job is queued all the same: the next wake (another upload, or a poll of its status) runs it
+        logger.exception(f"No worker could be started for job {job_id}")
+    logger.info(f"Queued validation job {job_id} for {uploaded_file.name}")
+    return job_id
+
+
+PRIVATE = ("owner", "file_path", "digest", "token", "password", "attempts")
+
+
+def get_job(job_id):
+    with _connect() as connection:
+        row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = {name: value for name, value in dict(row).items() if name not in PRIVATE}
+    if job["status"] == QUEUED and _executor is None:
+        # Queued before a restart (or its workers died): this process has no workers running yet
+        try:
+            wake()
+        except Exception:
+            logger.exception(f"No worker could be started for job {job_id}")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def claim(path=None):
+    # Marks the oldest queued job as running in this process and returns its row, None if there is none
+    with _connect(path) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)).fetchone()
+        if row is None:
+            connection.execute("ROLLBACK")
+            return None
+        connection.execute("UPDATE jobs SET status = ?, owner = ?, started = ?, attempts = attempts + 1 WHERE id = ?",
+                           (RUNNING, os.getpid(), time.time(), row["id"]))
+        connection.execute("COMMIT")
+    return dict(row)
+
+
+def work(path):
+    # Runs in a worker process: the queued jobs, until none is left
+    while True:
+        job = claim(path)
+        if job is None:
+            return
+        run_job(job, path)
+
+
+def run_job(job, path):
+    # Runs in a worker process
+    from myapp import metrics, result_cache
+    from myapp.openbis_pool import pool
+    from myapp.utils import build_report, decrypt_password
+
+    file_name = job["file_name"]
+    try:
+        # The stage timings are logged by the worker (its metrics are not exported)
+        with metrics.request("job", file_name):
+            upload = uploads.SpooledUpload(job["file_path"], file_name, os.path.getsize(job["file_path"]), job["digest"], owned=True)
+            with metrics.stage("login"):
+                o = metrics.instrument(pool.get(job["username"], job["token"], lambda: decrypt_password(job["password"])))
+
+            # Re-uploads of a file checked before by this worker come from its result cache
+            result_name, code, result_content, result_entity = result_cache.check(upload, o)
+            result = build_report(file_name, code, result_name, result_content, result_entity).as_dict()
+        _update(job["id"], path, status=DONE, finished=time.time(), result=json.dumps(result, default=str), token=None, password=None)
+    except Exception as e:
+        logger.exception(f"Validation job {job['id']} failed")
+        _update(job["id"], path, status=FAILED, finished=time.time(), error=f"Error processing file: {str(e)}", token=None, password=None)
+    finally:
+        if job["file_path"] and os.path.exists(job["file_path"]):
+            os.remove(job["file_path"])
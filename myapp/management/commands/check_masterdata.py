@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Checks every masterdata file of a directory without the web interface:
+
+    python manage.py check_masterdata path/to/files --username me
+    python manage.py check_masterdata path/to/files --snapshot masterdata.json --format junit --output report.xml
+    python manage.py check_masterdata --username me --dump-snapshot masterdata.json
+
+The files are parsed and get their name and content checks on parallel worker
+processes; the entity checks use one openBIS session, or an offline snapshot of
+the masterdata saved before with --dump-snapshot. With --no-entity the rows are
+streamed through the content checks and no sheet is kept in memory. One result
+is written per file as soon as it is checked (JSON lines or JUnit XML), and the
+command exits with status 1 when a file does not pass.
+"""
+
+import getpass
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.sax.saxutils import escape, quoteattr
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from myapp import batch, masterdata, offline
+from myapp.jobs import process_pool, setup_worker
+
+PASSED = "passed"
+FAILED = "failed"
+ERROR = "error"
+
+
+def find_workbooks(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(batch.EXTENSIONS))
+    return sorted(paths)
+
+
+def setup_command_worker():
+    # The checkers print their progress: keep it out of the results written to stdout
+    setup_worker()
+    sys.stdout = sys.stderr
+
+
+class JsonLinesWriter:
+    # One JSON object per line, written as soon as the file is checked
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def start(self):
+        pass
+
+    def write(self, record):
+        self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
+
+    def finish(self, totals):
+        pass
+
+
+class JUnitWriter:
+    # One test case per file; the counts are only known at the end and are left out of the suite
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def start(self):
+        self.stream.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n<testsuite name="masterdata">\n')
+
+    def write(self, record):
+        report = "\n\n".join(f"[{issue['severity']}] {issue['message']}" for issue in record["issues"])
+        self.stream.write(f'<testcase classname="masterdata" name={quoteattr(record["file"])}>\n')
+        if record["status"] == FAILED:
+            self.stream.write(f'<failure message="Masterdata checks failed">{escape(report)}</failure>\n')
+        elif record["status"] == ERROR:
+            self.stream.write(f'<error message={quoteattr(record["error"])}/>\n')
+        if report:
+            self.stream.write(f'<system-out>{escape(report)}</system-out>\n')
+        self.stream.write('</testcase>\n')
+        self.stream.flush()
+
+    def finish(self, totals):
+        self.stream.write('</testsuite>\n</testsuites>\n')
+
+
+WRITERS = {"json": JsonLinesWriter, "junit": JUnitWriter}
+
+
+class Command(BaseCommand):
+    help = "Checks the name, content and entity of every masterdata file (.xls, .xlsx) of a directory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", nargs="?", help="Directory with the masterdata files (searched recursively).")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes parsing and checking the files.")
+        parser.add_argument("--format", choices=sorted(WRITERS), default="json", help="Output format: JSON lines or JUnit XML.")
+        parser.add_argument("--output", help="Output file (default: standard output).")
+        parser.add_argument("--snapshot", help="Offline masterdata snapshot to check the entities against, instead of openBIS.")
+        parser.add_argument("--dump-snapshot", help="Save the masterdata of openBIS to this file.")
+        parser.add_argument("--no-entity", action="store_true", help="Skip the entity checks (no openBIS or snapshot needed).")
+        parser.add_argument("--username", help="openBIS user; the password is read from OPENBIS_PASSWORD or asked for.")
+
+    def handle(self, *args, **options):
+        if not options["directory"] and not options["dump_snapshot"]:
+            raise CommandError("Give a directory to check and/or --dump-snapshot.")
+
+        o = None
+        if options["dump_snapshot"] or not (options["snapshot"] or options["no_entity"]):
+            o = self.connect(options["username"])
+
+        if options["dump_snapshot"]:
+            saved = offline.dump_snapshot(o, options["dump_snapshot"])
+            self.stderr.write(f"Saved {saved} entity types of {o.url} to {options['dump_snapshot']}")
+            if not options["directory"]:
+                return
+
+        if not os.path.isdir(options["directory"]):
+            raise CommandError(f"{options['directory']} is not a directory.")
+
+        lookups = None
+        if options["snapshot"]:
+            lookups = offline.OfflineLookups.load(options["snapshot"])
+        elif not options["no_entity"]:
+            # One session and one set of lookups for all the files
+            lookups = masterdata.RequestLookups(o)
+
+        stream = open(options["output"], "w", encoding="utf-8") if options["output"] else sys.stdout
+        try:
+            totals = self.check_directory(options["directory"], options["workers"], lookups, o, WRITERS[options["format"]](stream))
+        finally:
+            if options["output"]:
+                stream.close()
+
+        self.stderr.write(", ".join(f"{count} {status}" for status, count in totals.items()))
+        if totals[FAILED] or totals[ERROR]:
+            raise CommandError("Some files did not pass the checks.", returncode=1)
+
+    def connect(self, username):
+        from myapp.openbis_pool import pool
+
+        if not username:
+            raise CommandError("--username is needed to connect to openBIS.")
+        password = os.environ.get("OPENBIS_PASSWORD") or getpass.getpass(f"openBIS password of {username}: ")
+        try:
+            return pool.login(username, password)
+        except Exception as e:
+            raise CommandError(f"Login to {pool.url} failed: {str(e)}")
+
+    def check_directory(self, directory, workers, lookups, o, writer):
+        from myapp.utils import entity_checker, build_report
+
+        paths = find_workbooks(directory)
+        totals = {PASSED: 0, FAILED: 0, ERROR: 0}
+
+        def check_entity(path, parsed):
+            workbook, result_name, code, name_ok, result_content = parsed
+            result_entity = entity_checker(workbook, o, lookups) if lookups is not None else []
+            return self.record(path, directory, build_report(os.path.basename(path), code, result_name, result_content, result_entity))
+
+        def emit(record):
+            totals[record["status"]] += 1
+            writer.write(record)
+
+        writer.start()
+        # Spawned workers, like the ones of the web process: the thread pool below runs at the same time
+        with process_pool(max(1, workers), initializer=setup_command_worker) as processes, \
+                ThreadPoolExecutor(max_workers=getattr(settings, "OPENBIS_FETCH_WORKERS", 8)) as threads:
+            # Without the entity checks the workers stream the rows instead of keeping the workbook
+            parsing = {processes.submit(batch.check_file, path, None, lookups is not None): path for path in paths}
+            checking = {}
+            for future in as_completed(parsing):
+                path = parsing[future]
+                try:
+                    checking[threads.submit(check_entity, path, future.result())] = path
+                except Exception as e:
+                    emit(self.failure(path, directory, e))
+                # Write the files checked meanwhile, not only at the end
+                for done in [f for f in checking if f.done()]:
+                    emit(self.result(done, checking.pop(done), directory))
+            for done in as_completed(checking):
+                emit(self.result(done, checking[done], directory))
+        writer.finish(totals)
+        return totals
+
+    def result(self, future, path, directory):
+        try:
+            return future.result()
+        except Exception as e:
+            return self.failure(path, directory, e)
+
+    def record(self, path, directory, report):
+        # Files with errors fail; warnings and the notes about changed entity types do not
+        return dict(report.as_dict(), file=os.path.relpath(path, directory), status=PASSED if report.passed else FAILED, error="")
+
+    def failure(self, path, directory, error):
+        return {"file": os.path.relpath(path, directory), "code": "", "status": ERROR, "issues": [],
+                "error": f"Error processing file: {str(error)}"}
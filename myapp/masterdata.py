@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot of the masterdata of an openBIS instance, shared by all the checks.
+
+Masterdata (entity types with their property assignments, property types,
+vocabularies and plugins) changes a few times a week but is read on every check,
+so it is fetched from openBIS on first use and kept for MASTERDATA_CACHE_TTL
+seconds. The snapshot of an instance can also be dropped by hand (see the
+invalidate_masterdata view, for staff and the MASTERDATA_ADMINS) right after the
+masterdata has been changed.
+
+Missing entries are fetched with the connection of the user asking for them.
+Spaces and projects depend on the rights of the user and are never cached.
+
+The property assignments pybis returns only refer to their property type (by its
+permId, which is its code): the attributes of the property types they are
+compared with come from one search of all the property types of the instance,
+joined to the assignments (see Assignments), instead of a get_property_type call
+per assignment.
+An entry openBIS does not have ("no such ...") is remembered as missing. pybis
+raises the other errors (expired session, failed login, server error) as
+ValueError too: they are raised as MasterdataUnavailable instead, so that they
+are not taken for a missing entry, and are not kept: the next lookup asks
+openBIS again.
+"""
+
+import itertools
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from types import SimpleNamespace
+import pandas as pd
+from django.conf import settings
+from myapp import metrics
+from myapp.property_index import PropertySetIndex
+
+logger = logging.getLogger('myapp')
+
+# pybis methods returning one entity type by code, and all of them, for each sheet entity type
+ENTITY_METHODS = {
+    "EXPERIMENT_TYPE": ("get_collection_type", "get_collection_types"),
+    "SAMPLE_TYPE": ("get_object_type", "get_object_types"),
+    "DATASET_TYPE": ("get_dataset_type", "get_dataset_types"),
+    "VOCABULARY_TYPE": ("get_vocabulary", "get_vocabularies"),
+    "MATERIAL_TYPE": ("get_material_type", "get_material_types"),
+}
+
+# Attributes of the property types read by the entity checks
+PROPERTY_ATTRIBUTES = ["code", "permId", "label", "description", "dataType", "vocabulary", "metaData"]
+
+# How pybis answers a lookup of something that does not exist (a search without results),
+# e.g. "no such sampleType: X" or "no vocabulary found with identifier: X"
+NOT_FOUND = re.compile(r"^no (?:such \S+|\S+ found)", re.IGNORECASE)
+
+_versions = itertools.count(1)
+
+
+class MasterdataUnavailable(RuntimeError):
+    # openBIS could not answer a lookup; not a ValueError, which the checks take for "not found"
+    pass
+
+
+def not_found(error):
+    # True for the ValueError of a lookup without result, False for the other errors pybis raises as ValueError
+    return isinstance(error, ValueError) and NOT_FOUND.match(str(error)) is not None
+
+
+def answer(fetch):
+    # (value, None), or (None, error) when openBIS has no such entry; the other errors are raised
+    try:
+        return fetch(), None
+    except ValueError as e:
+        if not not_found(e):
+            raise MasterdataUnavailable(f"openBIS could not answer: {e}") from e
+        return None, e
+
+
+def plain(value):
+    # numpy scalars (from the data frames) and NaN to plain values
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class Assignments(list):
+    """
+    Property assignments of an entity type: every item has the attributes of its
+    property type (PROPERTY_ATTRIBUTES) and of the assignment (section, ordinal,
+    mandatory, plugin). df is the data frame of the assignment attributes, with the
+    code of the property type in "propertyType".
+    """
+
+    def __init__(self, assignments, records):
+        super().__init__(SimpleNamespace(**assignment) for assignment in assignments)
+        self._records = records
+
+    @property
+    def df(self):
+        return pd.DataFrame(self._records)
+
+    @classmethod
+    def join(cls, assignments, property_types):
+        # assignments as pybis returns them (only read through their data frame), property_types: see property_type_attributes
+        records = []
+        for record in assignments.df.to_dict("records"):
+            record = {name: plain(value) for name, value in record.items()}
+            # Recent pybis versions name the column "code"
+            record.setdefault("propertyType", record.get("code"))
+            records.append(record)
+        joined = []
+        for record in records:
+            code = record["propertyType"]
+            attributes = property_types.get(code) or dict.fromkeys(PROPERTY_ATTRIBUTES)
+            joined.append({**record, **attributes, "code": code, "permId": code})
+        return cls(joined, records)
+
+
+def property_type_attributes(property_types):
+    # {code: {attribute: value}} from the data frame of a search of property types (pybis Things)
+    attributes = {}
+    for record in property_types.df.to_dict("records"):
+        attributes[record["code"]] = {name: plain(record.get(name)) for name in PROPERTY_ATTRIBUTES}
+        # The permId of a property type is its code, the data frame has no column for it
+        attributes[record["code"]]["permId"] = record["code"]
+    return attributes
+
+
+class Memo:
+    """
+    (value, error) entries by key, fetched with answer: a key is fetched by one
+    thread at a time, the others asking for it meanwhile wait for its answer
+    instead of calling openBIS again. fetched counts the fetches by kind (first
+    part of the key).
+    """
+
+    def __init__(self):
+        self.fetched = Counter()
+        self._entries = {}
+        self._fetching = {}  # key -> lock held while it is fetched
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        # (entry, True) when the key was known, (entry, False) when this call fetched it
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, True
+            flight = self._fetching.setdefault(key, threading.Lock())
+        with flight:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    return entry, True
+                self.fetched[key[0]] += 1
+            # MasterdataUnavailable is not kept: the next caller fetches again
+            entry = answer(fetch)
+            with self._lock:
+                self._entries[key] = entry
+                self._fetching.pop(key, None)
+        return entry, False
+
+    def setdefault(self, key, entry):
+        with self._lock:
+            self._entries.setdefault(key, entry)
+
+
+class MasterdataSnapshot:
+
+    def __init__(self, instance, ttl):
+        self.instance = instance
+        # Changes with every new snapshot: results computed against an older one are stale
+        self.version = f"{instance}#{next(_versions)}"
+        self.created = time.monotonic()
+        self.expires = self.created + ttl
+        self._memo = Memo()
+
+    def expired(self, now=None):
+        return (now if now is not None else time.monotonic()) >= self.expires
+
+    def _get(self, key, fetch):
+        try:
+            # Only "not found" is an answer to remember, the other errors are tried again next time
+            entry, known = self._memo.get(key, fetch)
+        except MasterdataUnavailable:
+            _count("misses")
+            _count("errors")
+            raise
+        _count("hits" if known else "misses")
+        value, error = entry
+        if error is not None:
+            raise error
+        return value
+
+    def entity(self, o, e_type, code):
+        # Entity type (with its property assignments); raises ValueError if it does not exist
+        if e_type not in ENTITY_METHODS:
+            return None
+        return self._get(("entity", e_type, code), lambda: getattr(o, ENTITY_METHODS[e_type][0])(code))
+
+    def entities(self, o, e_type):
+        # All the entity types of a kind, as a list
+        if e_type not in ENTITY_METHODS:
+            return None
+        entities = self._get(("entities", e_type), lambda: materialize(getattr(o, ENTITY_METHODS[e_type][1])()))
+        for entity in entities:
+            self._memo.setdefault(("entity", e_type, entity.code), (entity, None))
+        return entities
+
+    def property_assignments(self, o, e_type, code):
+        # Built once per entity type instead of on every call, with the attributes of their property types
+        return self._get(("assignments", e_type, code),
+                         lambda: Assignments.join(self.entity(o, e_type, code).get_property_assignments(), self.property_types(o)))
+
+    def property_types(self, o):
+        # Attributes of all the property types, from one search: {code: {attribute: value}}
+        return self._get(("property_types",), lambda: property_type_attributes(o.get_property_types()))
+
+    def property_sets(self, o, e_type):
+        # Codes of the property types assigned to every entity type of a kind: {code: frozenset}
+        if e_type not in ENTITY_METHODS:
+            return None
+        return self._get(("property_sets", e_type), lambda: assigned_property_codes(getattr(o, ENTITY_METHODS[e_type][1])()))
+
+    def property_index(self, o, e_type):
+        # Exact and near-duplicate lookups over the property sets, built once per snapshot
+        if e_type not in ENTITY_METHODS:
+            return None
+        return self._get(("property_index", e_type), lambda: PropertySetIndex(self.property_sets(o, e_type)))
+
+    def property_type(self, o, code):
+        return self._get(("property_type", code), lambda: o.get_property_type(code))
+
+    def plugins(self, o):
+        return self._get(("plugins",), lambda: materialize(o.get_plugins()))
+
+
+def fetch_concurrently(calls, workers=None, timeout=None):
+    """
+    Runs independent openBIS calls ({name: callable}) on a bounded thread pool of
+    OPENBIS_FETCH_WORKERS threads and returns {name: result}. The error of a call is
+    raised again, and a call running longer than OPENBIS_FETCH_TIMEOUT seconds raises
+    a TimeoutError (the thread cannot be stopped, its result is dropped).
+    """
+    if workers is None:
+        workers = getattr(settings, "OPENBIS_FETCH_WORKERS", 8)
+    if timeout is None:
+        timeout = getattr(settings, "OPENBIS_FETCH_TIMEOUT", 60)
+    if not calls:
+        return {}
+
+    started = {}
+
+    def timed(name, call):
+        started[name] = time.monotonic()
+        return call()
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(calls))))
+    futures = {executor.submit(metrics.bind(timed), name, call): name for name, call in calls.items()}
+    results = {}
+    try:
+        pending = set(futures)
+        while pending:
+            # Wake up when a call finishes or when the oldest running call reaches the timeout
+            running = [started[futures[future]] for future in pending if futures[future] in started]
+            wait_for = max(0, min(running) + timeout - time.monotonic()) if timeout and running else (timeout or None)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = future.result()
+            now = time.monotonic()
+            for future in pending:
+                name = futures[future]
+                if timeout and name in started and now - started[name] >= timeout:
+                    raise TimeoutError(f"openBIS call '{name}' took more than {timeout} seconds")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return {name: results[name] for name in calls}
+
+
+def materialize(things):
+    # Iterating pybis Things fetches every item again, one after the other: fetch them concurrently
+    if things.objects:
+        return list(things.objects)
+    get_item = things.single_item_method or getattr(things.openbis, "get_" + things.entity)
+    identifiers = things.df[things.identifier_name].tolist()
+    items = fetch_concurrently({i: partial(get_item, identifier) for i, identifier in enumerate(identifiers)})
+    return [items[i] for i in range(len(identifiers))]
+
+
+class RequestLookups:
+    """
+    Lookups of one request (upload), memoized by (type, code) on top of the snapshot.
+
+    The snapshot in use is pinned when the request starts, and every entity type or
+    assignment list is asked for at most once, even with the cache disabled (TTL 0)
+    or invalidated meanwhile, and by several threads at the same time (e.g. the
+    entity checks of a batch). calls counts the lookups that went past the memo.
+    """
+
+    def __init__(self, o):
+        self.o = o
+        self.snapshot = snapshot(o)
+        self.version = self.snapshot.version
+        self._memo = Memo()
+        self.calls = self._memo.fetched
+
+    def _memoized(self, key, fetch):
+        value, error = self._memo.get(key, fetch)[0]
+        if error is not None:
+            raise error
+        return value
+
+    def entity(self, e_type, code):
+        return self._memoized(("entity", e_type, code), lambda: self.snapshot.entity(self.o, e_type, code))
+
+    def assignments(self, e_type, code):
+        return self._memoized(("assignments", e_type, code), lambda: self.snapshot.property_assignments(self.o, e_type, code))
+
+    def property_type(self, code):
+        return self._memoized(("property_type", code), lambda: self.snapshot.property_type(self.o, code))
+
+    def property_index(self, e_type):
+        return self._memoized(("property_index", e_type), lambda: self.snapshot.property_index(self.o, e_type))
+
+
+def assigned_property_codes(entity_types):
+    # The search of entity types already returns their property assignments: read them
+    # from that single response instead of fetching every entity type again
+    entity_types.df  # resolves the shared (jackson) references of the response
+    property_sets = {}
+    for entity_type in entity_types.response["objects"]:
+        if entity_type["code"] == "UNKNOWN":
+            property_sets[entity_type["code"]] = frozenset()
+            continue
+        assignments = entity_type.get("propertyAssignments") or []
+        property_sets[entity_type["code"]] = frozenset(assignment["propertyType"]["code"] for assignment in assignments)
+    return property_sets
+
+
+_snapshots = {}  # instance url -> MasterdataSnapshot
+_stats = {"hits": 0, "misses": 0, "errors": 0, "invalidations": 0}
+_lock = threading.Lock()
+
+
+def _count(counter):
+    with _lock:
+        _stats[counter] += 1
+
+
+def snapshot(o):
+    # Current snapshot of the instance o is connected to, a new (empty) one once expired
+    ttl = getattr(settings, "MASTERDATA_CACHE_TTL", 3600)
+    with _lock:
+        current = _snapshots.get(o.url)
+        if current is None or current.expired():
+            current = _snapshots[o.url] = MasterdataSnapshot(o.url, ttl)
+        return current
+
+
+def invalidate(instance=None):
+    # Drops the snapshot of one instance (url), or all of them
+    with _lock:
+        if instance is None:
+            dropped = len(_snapshots)
+            _snapshots.clear()
+        else:
+            dropped = 1 if _snapshots.pop(instance, None) is not None else 0
+        _stats["invalidations"] += 1
+    logger.info(f"Masterdata snapshot invalidated ({instance or 'all instances'})")
+    return dropped
+
+
+def may_invalidate(request):
+    # Staff, and the openBIS users listed in MASTERDATA_ADMINS
+    user = getattr(request, "user", None)
+    if user is not None and user.is_staff:
+        return True
+    return request.session.get("openbis_username") in getattr(settings, "MASTERDATA_ADMINS", ())
+
+
+def cache_stats():
+    with _lock:
+        now = time.monotonic()
+        return dict(_stats, instances={url: round(now - s.created) for url, s in _snapshots.items() if not s.expired(now)})
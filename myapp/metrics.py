@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Timings of the checks: where the time of a slow upload went.
+
+Every stage of a request (openBIS login, workbook load, name, content and entity
+checks, the entity sub-checks) and every openBIS call (by pybis method) is timed
+into duration histograms, exposed with the request counters in the Prometheus
+text format by the metrics view (only to METRICS_ALLOWED_ADDRESSES).
+
+The stages of one request are also added up into its breakdown, written to the
+'myapp' logger when the request ends:
+    Timings of upload object_type_X_v1_S.xlsx: 1.532s | login 0.012s | load 0.210s | ...
+The breakdown follows the request into the worker threads that run its blocking
+work (see bind). It also counts the openBIS calls of the request, and flags the
+probable N+1 patterns (see openbis_calls).
+
+Usage:
+    with metrics.request("upload", file_name):
+        with metrics.stage("load"):
+            ...
+    o = metrics.instrument(o)  # times and counts every pybis call made through o
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+from myapp.openbis_calls import CallTracker
+
+logger = logging.getLogger('myapp')
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += seconds
+        self.count += 1
+
+
+class Registry:
+    """
+    Histograms and counters by (metric name, labels), where labels is a tuple of
+    (label, value) pairs.
+    """
+
+    HELP = {
+        "checker_request_seconds": ("histogram", "Duration of the requests, by kind."),
+        "checker_stage_seconds": ("histogram", "Duration of the stages of the checks."),
+        "checker_openbis_call_seconds": ("histogram", "Duration of the openBIS calls, by pybis method."),
+        "checker_requests_total": ("counter", "Requests, by kind."),
+        "checker_errors_total": ("counter", "Stages and openBIS calls that raised an error."),
+        "checker_n_plus_one_total": ("counter", "Requests calling a pybis method at least OPENBIS_N_PLUS_ONE_THRESHOLD times."),
+    }
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        for name, (kind, text) in self.HELP.items():
+            if kind == "histogram":
+                series = sorted((labels, values) for (metric, labels), values in histograms.items() if metric == name)
+            else:
+                series = sorted((labels, value) for (metric, labels), value in counters.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, values in series:
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(labels)} {values}")
+                    continue
+                counts, total, count = values
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, counts):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+registry = Registry()
+
+
+class Breakdown:
+    # Time spent in every stage of one request: {stage: [count, seconds]}, in order of first use
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.calls = CallTracker.from_settings()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        with self._lock:
+            stages = [f"{stage} {count}x {seconds:.3f}s" if count > 1 else f"{stage} {seconds:.3f}s"
+                      for stage, (count, seconds) in self.stages.items()]
+        if self.calls.total:
+            stages.append(f"openbis calls {self.calls}")
+        return " | ".join([f"{self.elapsed():.3f}s"] + stages)
+
+
+_current = contextvars.ContextVar("checker_breakdown", default=None)
+_stage = contextvars.ContextVar("checker_stage", default=None)
+
+
+def current():
+    # Breakdown of the request running in this context, or None
+    return _current.get()
+
+
+@contextmanager
+def request(kind, name=""):
+    """
+    Times a whole request and collects the breakdown of its stages, logged to the
+    'myapp' logger when it ends.
+    """
+    breakdown = Breakdown(kind, name)
+    token = _current.set(breakdown)
+    registry.inc("checker_requests_total", (("kind", kind),))
+    try:
+        yield breakdown
+    finally:
+        _current.reset(token)
+        registry.observe("checker_request_seconds", (("kind", kind),), breakdown.elapsed())
+        logger.info(f"Timings of {kind} {name}: {breakdown}")
+        for method, count, stages in breakdown.calls.suspects():
+            where = ", ".join(f"{stage} {calls}" for stage, calls in stages.items())
+            logger.warning(f"Probable N+1 openBIS calls in {kind} {name}: {method} called {count} times ({where})")
+
+
+def _record(metric, label, stage, seconds, failed):
+    registry.observe(metric, ((label, stage),), seconds)
+    if failed:
+        registry.inc("checker_errors_total", ((label, stage),))
+    breakdown = _current.get()
+    if breakdown is not None:
+        breakdown.add(stage if metric == "checker_stage_seconds" else f"openbis.{stage}", seconds)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    token = _stage.set(name)
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        _stage.reset(token)
+        _record("checker_stage_seconds", "stage", name, time.perf_counter() - start, failed)
+
+
+@contextmanager
+def openbis_call(method):
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        _record("checker_openbis_call_seconds", "method", method, time.perf_counter() - start, failed)
+
+
+def timed(name, function=None):
+    # function, run as the stage name (or a decorator doing so)
+    if function is None:
+        return lambda function: timed(name, function)
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        with stage(name):
+            return function(*args, **kwargs)
+    return run
+
+
+def bind(function):
+    # function, run in the context (and so the request breakdown) of the caller, e.g. on a worker thread
+    context = contextvars.copy_context()
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+    return run
+
+
+def _track(method):
+    # Counts the call in the request, raises CallBudgetExceeded before it is made past the budget
+    breakdown = _current.get()
+    if breakdown is not None and breakdown.calls.record(method, _stage.get()):
+        registry.inc("checker_n_plus_one_total", (("method", method),))
+
+
+class InstrumentedOpenbis:
+    """
+    Proxy of a pybis Openbis connection timing and counting every method call (by
+    method name) in the request it is used by. The lists it returns (pybis Things)
+    fetch their items through it as well.
+    """
+
+    def __init__(self, openbis):
+        self._openbis = openbis
+
+    def __getattr__(self, name):
+        value = getattr(self._openbis, name)
+        if name.startswith("_") or not callable(value):
+            return value
+
+        @wraps(value)
+        def call(*args, **kwargs):
+            _track(name)
+            with openbis_call(name):
+                result = value(*args, **kwargs)
+            single_item_method = getattr(result, "single_item_method", None)
+            if single_item_method is not None:
+                result.single_item_method = getattr(self, getattr(single_item_method, "__name__", ""), single_item_method)
+            return result
+        return call
+
+
+def instrument(o):
+    if o is None or isinstance(o, InstrumentedOpenbis):
+        return o
+    return InstrumentedOpenbis(o)
+
+
+def allowed(request):
+    return request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_ADDRESSES", ("127.0.0.1", "::1"))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Offline masterdata snapshot: the entity types, property assignments and property
+types of an instance saved to a JSON file, so that the entity checks can run
+without openBIS (e.g. on a build machine, see the check_masterdata command).
+
+OfflineLookups answers the same lookups as masterdata.RequestLookups from the file.
+"""
+
+import json
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+from myapp import masterdata
+from myapp.masterdata import PROPERTY_ATTRIBUTES, Assignments, plain
+from myapp.property_index import PropertySetIndex
+
+FORMAT_VERSION = 1
+
+# Attributes read by the entity checks
+ENTITY_ATTRIBUTES = ["code", "description", "autoGeneratedCode", "validationPlugin", "generatedCodePrefix"]
+
+
+def _attributes(item, names):
+    return {name: plain(getattr(item, name, None)) for name in names}
+
+
+def dump_snapshot(o, path):
+    """
+    Saves the masterdata of the instance o is connected to in path.
+    Returns the number of entity types saved.
+    """
+    current = masterdata.snapshot(o)
+    data = {"version": FORMAT_VERSION, "instance": o.url, "created": datetime.now().isoformat(timespec="seconds"),
+            "entity_types": {}, "property_sets": {}, "property_types": {}}
+    saved = 0
+    for e_type in masterdata.ENTITY_METHODS:
+        entity_types = {}
+        for entity in current.entities(o, e_type):
+            assignments = current.property_assignments(o, e_type, entity.code)
+            entity_types[entity.code] = {
+                "attributes": _attributes(entity, ENTITY_ATTRIBUTES),
+                "assignments": [_attributes(prop, PROPERTY_ATTRIBUTES) for prop in assignments],
+                "assignments_df": [{k: plain(v) for k, v in record.items()} for record in assignments.df.to_dict("records")],
+            }
+        data["entity_types"][e_type] = entity_types
+        data["property_sets"][e_type] = {code: sorted(properties) for code, properties in current.property_sets(o, e_type).items()}
+        saved += len(entity_types)
+
+    # All the property types, from the search the assignments were joined with
+    data["property_types"] = current.property_types(o)
+
+    with open(path, "w", encoding="utf-8") as snapshot_file:
+        json.dump(data, snapshot_file, default=str)
+    return saved
+
+
+def load_snapshot(path):
+    with open(path, encoding="utf-8") as snapshot_file:
+        data = json.load(snapshot_file)
+    if data.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported masterdata snapshot format: {data.get('version')}")
+    return data
+
+
+class OfflineLookups:
+    """
+    Lookups of the entity checks (see masterdata.RequestLookups) answered from a
+    snapshot file; a missing entity or property type raises ValueError like openBIS.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.instance = data["instance"]
+        self.version = f"{data['instance']}@{data['created']}"
+        self.calls = Counter()
+        self._indexes = {}
+
+    @classmethod
+    def load(cls, path):
+        return cls(load_snapshot(path))
+
+    def _entry(self, kind, e_type, code):
+        self.calls[kind] += 1
+        entry = self.data["entity_types"].get(e_type, {}).get(code)
+        if entry is None:
+            raise ValueError(f"No {e_type} found with code {code} in the masterdata snapshot")
+        return entry
+
+    def entity(self, e_type, code):
+        if e_type not in masterdata.ENTITY_METHODS:
+            return None
+        return SimpleNamespace(**self._entry("entity", e_type, code)["attributes"])
+
+    def assignments(self, e_type, code):
+        entry = self._entry("assignments", e_type, code)
+        return Assignments(entry["assignments"], entry["assignments_df"])
+
+    def property_type(self, code):
+        self.calls["property_type"] += 1
+        if code not in self.data["property_types"]:
+            raise ValueError(f"No property type found with code {code} in the masterdata snapshot")
+        return SimpleNamespace(**self.data["property_types"][code])
+
+    def property_index(self, e_type):
+        if e_type not in masterdata.ENTITY_METHODS:
+            return None
+        if e_type not in self._indexes:
+            property_sets = self.data["property_sets"].get(e_type, {})
+            self._indexes[e_type] = PropertySetIndex({code: frozenset(properties) for code, properties in property_sets.items()})
+        return self._indexes[e_type]
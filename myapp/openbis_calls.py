@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+openBIS calls of one request, by pybis method.
+
+Every call made through the connection of a request (metrics.InstrumentedOpenbis)
+is counted here, with the stage it was made in. A method called at least
+OPENBIS_N_PLUS_ONE_THRESHOLD times in a request is reported as a probable N+1
+pattern (one call per item of a loop), in the logs and the metrics. With
+OPENBIS_CALL_BUDGET set, the call that would go past that many calls in a
+request raises CallBudgetExceeded instead of reaching openBIS.
+"""
+
+import threading
+from collections import Counter
+from django.conf import settings
+
+
+class CallBudgetExceeded(RuntimeError):
+    # Not a ValueError: that is how openBIS answers "not found", and it is remembered as such
+    pass
+
+
+class CallTracker:
+
+    def __init__(self, budget=None, threshold=10):
+        self.budget = budget
+        self.threshold = threshold
+        self.calls = Counter()
+        self.stages = {}  # method -> Counter of the stages it was called in
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(getattr(settings, "OPENBIS_CALL_BUDGET", None), getattr(settings, "OPENBIS_N_PLUS_ONE_THRESHOLD", 10))
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+    def record(self, method, stage=None):
+        # Counts a call about to be made; raises CallBudgetExceeded past the budget
+        with self._lock:
+            if self.budget is not None and sum(self.calls.values()) >= self.budget:
+                raise CallBudgetExceeded(
+                    f"More than {self.budget} openBIS calls in one request ({self._summary()}), "
+                    f"{method} was not called")
+            self.calls[method] += 1
+            self.stages.setdefault(method, Counter())[stage or "-"] += 1
+            # True once, when the method reaches the threshold
+            return self.threshold is not None and self.calls[method] == self.threshold
+
+    def suspects(self):
+        # [(method, calls, {stage: calls})] of the methods called at least threshold times
+        if self.threshold is None:
+            return []
+        with self._lock:
+            return [(method, count, dict(self.stages[method])) for method, count in self.calls.most_common()
+                    if count >= self.threshold]
+
+    def _summary(self):
+        return ", ".join(f"{method} {count}" for method, count in self.calls.most_common())
+
+    def __str__(self):
+        with self._lock:
+            return f"{sum(self.calls.values())} ({self._summary()})" if self.calls else "0"
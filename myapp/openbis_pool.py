@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of authenticated openBIS connections, shared by the requests of a user.
+
+Logging into openBIS costs a full round trip, so the connections are kept alive
+per (username, session token) and reused by the following requests. A token is
+checked against the server at most every OPENBIS_TOKEN_CHECK_INTERVAL seconds,
+and the user is logged in again only when it has expired. Connections idle for
+more than OPENBIS_POOL_IDLE_TIMEOUT seconds are dropped, and the pool never
+holds more than OPENBIS_POOL_MAX_SIZE of them (least recently used first out).
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from pybis import Openbis
+from myapp import metrics
+
+logger = logging.getLogger('myapp')
+
+
+class PooledConnection:
+    __slots__ = ("openbis", "last_used", "last_checked")
+
+    def __init__(self, openbis, now):
+        self.openbis = openbis
+        self.last_used = now
+        self.last_checked = now
+
+
+class OpenbisPool:
+
+    def __init__(self, url, max_size=32, idle_timeout=900, check_interval=60):
+        self.url = url
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._connections = OrderedDict()  # (username, token) -> PooledConnection
+        self._lock = threading.Lock()
+
+    def login(self, username, password):
+        # Full login, the connection is pooled under its new token
+        o = Openbis(self.url, use_cache=False)
+        with metrics.openbis_call("login"):
+            o.login(username, password)
+        self._add(username, o)
+        return o
+
+    def get(self, username, token, password):
+        """
+        Returns an authenticated connection for the user, reusing the pooled one when
+        its token is still valid. password is a callable, only called if a new login is needed.
+        """
+        now = time.monotonic()
+        key = (username, token)
+        with self._lock:
+            self._evict_idle(now)
+            connection = self._connections.get(key)
+            if connection is not None:
+                self._connections.move_to_end(key)
+                connection.last_used = now
+
+        if connection is not None and now - connection.last_checked < self.check_interval:
+            return connection.openbis
+
+        if connection is not None:
+            if self._is_active(connection.openbis):
+                connection.last_checked = time.monotonic()
+                return connection.openbis
+            self.discard(username, token)
+        elif token:
+            # Not pooled in this process yet (or evicted): reuse the token if openBIS still accepts it
+            try:
+                o = Openbis(self.url, token=token, use_cache=False)
+            except ValueError:
+                pass
+            else:
+                self._add(username, o)
+                return o
+
+        logger.info(f"openBIS session of {username} expired, logging in again")
+        return self.login(username, password())
+
+    def discard(self, username, token, logout=False):
+        with self._lock:
+            connection = self._connections.pop((username, token), None)
+        if connection is not None and logout:
+            self._logout(connection.openbis)
+
+    def __len__(self):
+        return len(self._connections)
+
+    def _add(self, username, o):
+        now = time.monotonic()
+        with self._lock:
+            self._connections[(username, o.token)] = PooledConnection(o, now)
+            self._connections.move_to_end((username, o.token))
+            self._evict_idle(now)
+            while len(self._connections) > self.max_size:
+                self._connections.popitem(last=False)
+
+    def _evict_idle(self, now):
+        # The least recently used connections are at the front. Evicted sessions are not
+        # logged out: other worker processes may still use the token, openBIS expires it
+        while self._connections:
+            key, connection = next(iter(self._connections.items()))
+            if now - connection.last_used < self.idle_timeout:
+                break
+            del self._connections[key]
+
+    def _is_active(self, o):
+        try:
+            with metrics.openbis_call("is_session_active"):
+                return bool(o.is_session_active())
+        except Exception as e:
+            logger.warning(f"Could not check the openBIS session: {str(e)}")
+            return False
+
+    def _logout(self, o):
+        try:
+            with metrics.openbis_call("logout"):
+                o.logout()
+        except Exception as e:
+            logger.warning(f"openBIS logout failed: {str(e)}")
+
+
+pool = OpenbisPool(
+    getattr(settings, "OPENBIS_URL", "url"),
+    max_size=getattr(settings, "OPENBIS_POOL_MAX_SIZE", 32),
+    idle_timeout=getattr(settings, "OPENBIS_POOL_IDLE_TIMEOUT", 900),
+    check_interval=getattr(settings, "OPENBIS_TOKEN_CHECK_INTERVAL", 60),
+)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Index of the property sets of the entity types of an instance.
+
+Exact matches are found through the hash of the frozenset of property codes.
+Near matches (Jaccard similarity above a threshold) are found with MinHash
+signatures split into LSH bands: only the types sharing a band bucket with the
+uploaded set are compared, so a lookup does not scan every type of the instance.
+"""
+
+import random
+import zlib
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class PropertySetIndex:
+
+    def __init__(self, property_sets, num_perm=64, bands=16, seed=1):
+        # property_sets: {entity type code: frozenset of property codes}
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.rows = num_perm // bands
+        generator = random.Random(seed)
+        self._permutations = [(generator.randint(1, MERSENNE_PRIME - 1), generator.randint(0, MERSENNE_PRIME - 1)) for _ in range(num_perm)]
+        self.property_sets = dict(property_sets)
+        self._exact = {}  # frozenset -> [codes]
+        self._buckets = {}  # (band, signature slice) -> [codes]
+        for code, properties in self.property_sets.items():
+            self._exact.setdefault(properties, []).append(code)
+            if properties:
+                for key in self._band_keys(self.signature(properties)):
+                    self._buckets.setdefault(key, []).append(code)
+
+    def signature(self, properties):
+        # MinHash: the minimum of every hash permutation over the (stable) crc32 of the codes
+        hashes = [zlib.crc32(str(code).encode("utf-8")) & MAX_HASH for code in properties]
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self._permutations]
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(len(signature) // rows)]
+
+    def exact(self, properties):
+        # Entity types with exactly the same properties, in the order of the instance
+        return list(self._exact.get(frozenset(properties), []))
+
+    def similar(self, properties, threshold=0.8, k=5):
+        """
+        Top-k entity types whose property sets have a Jaccard similarity of at least
+        threshold with properties, as [(code, score)] from the most similar.
+        """
+        properties = frozenset(properties)
+        candidates = set(self._exact.get(properties, []))
+        if properties:
+            for key in self._band_keys(self.signature(properties)):
+                candidates.update(self._buckets.get(key, ()))
+        scores = [(code, jaccard(properties, self.property_sets[code])) for code in candidates]
+        scores = [(code, score) for code, score in scores if score >= threshold]
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores[:k]
+
+    def __len__(self):
+        return len(self.property_sets)
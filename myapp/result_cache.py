@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Results of the recently checked workbooks, so that an upload checked before is
+answered without parsing it or asking openBIS again.
+
+Entries are keyed on the SHA-256 of the uploaded bytes and the file name (the
+name checks, and the content checks through them, depend on it). The entity
+results also depend on the masterdata: they are kept with the version of the
+masterdata snapshot they were computed against (see masterdata.RequestLookups)
+and are only reused while that snapshot is current.
+
+At most RESULT_CACHE_SIZE entries are kept per process, the least recently
+used are evicted first; 0 disables the cache.
+"""
+
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from myapp import masterdata, metrics, uploads
+
+
+def upload_key(upload):
+    # Key of a spooled upload (uploads.SpooledUpload), from the digest computed while spooling
+    return (upload.digest, upload.name)
+
+
+class CachedResult:
+    __slots__ = ("name", "content", "version", "_entity")
+
+    def __init__(self, name, content, version, entity):
+        self.name = tuple(name)  # (name issues, code, name_ok)
+        self.content = list(content)
+        self.version = version
+        self._entity = list(entity)
+
+    def entity(self, version):
+        # Entity issues, None if they were computed against another masterdata snapshot
+        return list(self._entity) if version == self.version else None
+
+
+class ResultCache:
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, name, content, version, entity):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and previous.version != version:
+                # Entity results computed again after a masterdata change
+                self._stats["stale"] += 1
+            self._entries[key] = CachedResult(name, content, version, entity)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(getattr(settings, "RESULT_CACHE_SIZE", 128))
+        return _cache
+
+
+def check(upload, o, lookups=None):
+    """
+    Name, content and entity checks of a spooled workbook (uploads.SpooledUpload),
+    from the cache when it was checked before: returns (result_name, code,
+    result_content, result_entity). Only the entity checks run again when the
+    masterdata snapshot changed meanwhile.
+    """
+    from myapp.utils import ParsedWorkbook, name_checker, content_checker, entity_checker
+
+    file_name = upload.name
+    if lookups is None:
+        lookups = masterdata.RequestLookups(o)
+    cache_key = upload_key(upload)
+    cached = cache().get(cache_key)
+
+    if cached is not None:
+        (result_name, code, name_ok), result_content = cached.name, cached.content
+        result_entity = cached.entity(lookups.version)
+        if result_entity is not None:
+            return result_name, code, result_content, result_entity
+    with metrics.stage("load"), open(upload.path, "rb") as spooled:
+        workbook = ParsedWorkbook.load(spooled, file_name, uploads.max_rows())
+    if cached is None:
+        with metrics.stage("name"):
+            result_name, code, name_ok = name_checker(file_name)
+        with metrics.stage("content"):
+            result_content = content_checker(workbook, name_ok)
+
+    with metrics.stage("entity"):
+        result_entity = entity_checker(workbook, o, lookups)
+    cache().put(cache_key, (result_name, code, name_ok), result_content, lookups.version, result_entity)
+    return result_name, code, result_content, result_entity
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Structured results of the checks.
+
+Every problem found is an Issue: severity, check, message key, row, column and
+the parameters of the message. The message itself is only formatted from
+MESSAGES when it is displayed (html() in the templates, text() in the JSON API),
+so issues that are counted, filtered or cached never pay for it.
+
+A Report gathers the issues of the name, content and entity checks of one file.
+"""
+
+from html import unescape
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+ERROR = "error"
+WARNING = "warning"
+INFO = "info"
+SEVERITIES = (ERROR, WARNING, INFO)
+
+# Checks, in the order of the report, with the message shown when they find nothing
+CHECKS = {
+    "name": "<strong>File name: OK!</strong>",
+    "content": "File content: OK!",
+    "entity": "",
+}
+
+MESSAGES = {
+    # File name
+    "name.format": "<strong>Invalid name format</strong>. The name should contain different fields separated by underscores (_). Consult the wiki to see which ones.",
+    "name.entity_type": "<strong>Invalid entity type</strong> at position 1.",
+    "name.entity_name": "<strong>Invalid entity name</strong> at position 2.",
+    "name.version": "<strong>Invalid version</strong> at position 3.",
+    "name.division": "<strong>Invalid division</strong> at position 4.",
+    "name.contact_person": "<strong>Invalid contact person</strong> at position 5.",
+
+    # Entity rows (1 to 3) of the sheet
+    "content.entity_type": "The entity type (cell A1) should be one of the following: SAMPLE_TYPE, EXPERIMENT_TYPE, DATASET_TYPE, PROPERTY_TYPE, VOCABULARY_TYPE",
+    "content.missing_entity_header": "<strong>Error</strong>: '{column}' not found in the entity headers.",
+    "content.missing_second_row_header": "<strong>Error</strong>: '{column}' not found in the second row.",
+    "content.version_mismatch": "<strong>Error</strong>: The version should be the same one indicated in the file name",
+    "content.version_mismatch_value": "<strong>Error</strong>: The version should be the same one indicated in the file name. Value found: {value}",
+    "content.code_mismatch": "<strong>Error</strong>: The code should be the same one indicated in the file name",
+    "content.code_mismatch_value": "<strong>Error</strong>: The code should be the same one indicated in the file name. Value found: {value}",
+    "content.description_schema": "<strong>Error</strong>: Description should follow the schema: English Description + '//' + German Description.",
+    "content.description_schema_value": "<strong>Error</strong>: Description should follow the schema: English Description + '//' + German Description. Value found: {value}",
+    "content.code_prefix": "<em>Warning</em>: It is recommended that the value of 'Generated code prefix' be the first three letters of each part of the 'Code' separated by dots ['.'].",
+    "content.validation_script": "<strong>Error</strong>: Validation script should follow the schema: Words and/or numbers separated by '_' and ending in '.py'",
+    "content.auto_generate_codes": "<strong>Error</strong>: Value below 'Auto generate codes' should be 'TRUE' or 'FALSE'.",
+
+    # Rows of the sheet (see rules.py)
+    "rows.missing_property_header": "<strong>Error</strong>: '{column}' not found in the properties headers.",
+    "rows.optional_property_header": "<em>Warning</em>: '{column}' not found in the properties headers.",
+    "rows.missing_term_header": "<strong>Error</strong>: '{column}' not found in the vocabulary term headers.",
+    "rows.missing_second_row_header": "<strong>Error</strong>: '{column}' not found in the second row.",
+    "rows.version": "<strong>Error</strong>: Values not valid found in the 'Version' column (they should be Integers) at row(s): {rows}",
+    "rows.version_values": "<strong>Error</strong>: Values not valid found in the 'Version' column (they should be Integers) at row(s): {rows}. Value(s) found: {values}",
+    "rows.code": "<strong>Error</strong>: Invalid code found in the '{column}' column at row(s): {rows}",
+    "rows.code_values": "<strong>Error</strong>: Invalid code found in the '{column}' column at row(s): {rows}. Value(s) found: {values}",
+    "rows.repeated_properties": "<strong>Error</strong>: The following properties are repeated: {repeated}. Please, delete the duplicates, and leave just one occurence",
+    "rows.repeated_terms": "<strong>Error</strong>: The following vocabulary terms are repeated: {repeated}. Please, delete the duplicates, and leave just one occurence",
+    "rows.description": "<strong>Error</strong>: Invalid value(s) found in the '{column}' column at row(s): {rows}. Description should follow the schema: English Description + '//' + German Description.",
+    "rows.description_values": "<strong>Error</strong>: Invalid value(s) found in the '{column}' column at row(s): {rows}. Description should follow the schema: English Description + '//' + German Description. Value(s) found: {values}",
+    "rows.boolean": "<strong>Error</strong>: Invalid value found in the '{column}' column at row(s): {rows}. Accepted values: TRUE, FALSE",
+    "rows.boolean_values": "<strong>Error</strong>: Invalid value found in the '{column}' column at row(s): {rows}. Accepted values: TRUE, FALSE. Value(s) found: {values}",
+    "rows.section": "<strong>Error</strong>: Invalid value found in the '{column}' column at row(s): {rows}. Each word in the Section should start with a capital letter.",
+    "rows.section_values": "<strong>Error</strong>: Invalid value found in the '{column}' column at row(s): {rows}. Each word should start with a capital letter. Value(s) found: {values}",
+    "rows.data_type": "<strong>Error</strong>: Invalid value found in the '{column}' column at row(s): {rows}. Accepted types: {accepted}",
+    "rows.data_type_values": "<strong>Error</strong>: Invalid value found in the '{column}' column at row(s): {rows}. Accepted types: {accepted}. Value(s) found: {values}",
+    "rows.vocabulary_code": "<strong>Error</strong>: Invalid vocabulary code found in the '{column}' column at row(s): {rows}",
+    "rows.vocabulary_code_values": "<strong>Error</strong>: Invalid vocabulary code found in the '{column}' column at row(s): {rows}. Value(s) found: {values}",
+    "rows.notes_section": "<strong>Error</strong>: 'Notes' found in the 'Property label' column at row {row}, but corresponding 'Section' column does not contain 'Additional Information'. Value found: {value}",
+    "rows.section_not_contiguous": "<strong>Error</strong>: Non-contiguous rows found for the same 'Section' value at row(s): {rows}. Ensure that all properties within the same Section are grouped together.",
+    "rows.general_information_first": "<strong>Error</strong> at row {row}: 'General Information' should only appear at the beginning.",
+    "rows.additional_information_order": "<strong>Error</strong> at row {row}: 'Additional Information' should appear after 'General Information' and any user-defined sections.",
+    "rows.comments_order": "<strong>Error</strong> at row {row}: 'Comments' should appear after 'Additional Information'.",
+    "rows.section_after_comments": "<strong>Error</strong> at row {row}: User-defined section '{section}' cannot appear after 'Comments'.",
+    "rows.section_before_comments": "<strong>Error</strong> at row {row}: User-defined section '{section}' cannot appear after 'Additional Information' but before 'Comments'.",
+
+    # Entity type compared to the instance
+    "entity.new": "Entity type '{code}' is a new entity type (not present in the system) to be registered.",
+    "entity.exists": "Entity type '{code}' already exists.",
+    "entity.description_changed": "The Description of ('{entity_type}') '{code}' has been changed compared to the previous version.",
+    "entity.description_schema": "<strong>ERROR</strong>: The Description of ('{entity_type}') '{code}' should follow the schema: English Description + '//' + German Description.",
+    "entity.auto_generate_codes_changed": "The value of “Auto generate codes” of ('{entity_type}') '{code}' has been changed from '{old}' to '{new}'.",
+    "entity.validation_script_deleted": "The validation script '{old}' has been deleted from ('{entity_type}') '{code}'.",
+    "entity.validation_script_added": "A validation script '{new}' has been added to ('{entity_type}') '{code}'.",
+    "entity.validation_script_changed": "The validation script of ('{entity_type}') '{code}' has been changed from '{old}' to '{new}'.",
+    "entity.code_prefix_changed": "The Code Prefix of ('{entity_type}') '{code}' has been changed from '{old}' to '{new}'.",
+    "entity.assignments_changed": "The set of Property Types assigned to the ('{entity_type}') '{code}' has been changed compared to the previous version.",
+    "entity.assignment_removed": "The Property type assignment '{property}' has been removed.",
+    "entity.assignment_added": "The Property type assignment '{property}' has been added.",
+    "entity.mandatory_set": "The value of the attribute 'Mandatory' of Property type {property} has been changed compared to the previous version from FALSE to TRUE.",
+    "entity.mandatory_unset": "<strong>ERROR</strong>: The value of the attribute 'Mandatory' of Property type {property} has been changed compared to the previous version from TRUE to FALSE. This is NOT allowed",
+    "entity.section_changed": "The section of Property type {property} has been changed compared to the previous version from {old} to {new}.",
+    "entity.dynamic_script_added": "<em>WARNING</em>: A dynamic property script ({new}) has been added retrospectively to the Property type {property}.",
+    "entity.dynamic_script_changed": "<strong>ERROR</strong>: The dynamic property script of Property type {property} has been changed or deleted compared to the previous version. This is NOT allowed",
+    "entity.label_changed": "The label of Property type {property} has been changed compared to the previous version from {old} to {new}.",
+    "entity.property_description_changed": "The description of Property type {property} has been changed compared to the previous version from {old} to {new}.",
+    "entity.data_type_changed": "<em>WARNING</em>: The data type of Property type {property} has been changed compared to the previous version from from {old} to {new}. This is only permissible for some cases, e.g., 'CONTROLLEDVOCABULARY' to 'VARCHAR'!",
+    "entity.vocabulary_changed": "<strong>ERROR</strong>: The vocabulary code of Property type {property} has been changed compared to the previous version from from {old} to {new}. This is not allowed.",
+    "entity.metadata_changed": "<strong>ERROR</strong>: The metadata of Property type {property} has been changed compared to the previous version from from {old} to {new}. This is not allowed.",
+    "entity.property_type_label_changed": "The label of Property type {property} has been changed compared to the previous version from {old} to {new}.",
+    "entity.property_type_description_changed": "The description of Property type {property} has been changed compared to the previous version from {old} to {new}.",
+    "entity.property_type_data_type_changed": "The data type of Property type {property} has been changed compared to the previous version from {old} to {new}. This is only permissible for some cases, e.g., 'CONTROLLEDVOCABULARY' to 'VARCHAR'!",
+    "entity.property_type_vocabulary_changed": "The vocabulary code of Property type {property} has been changed compared to the previous version from {old} to {new}. This is not allowed.",
+    "entity.property_type_metadata_changed": "The metadata of Property type {property} has been changed compared to the previous version from {old} to {new}. This is not allowed.",
+    "entity.same_properties": "The {entity_type} '{code}' is very similar to the existing {entity_type} '{other}'. Please consider whether you need to create a new entity type or whether you can re-use '{other}'",
+    "entity.similar_properties": "The {entity_type} '{code}' is {score:.0%} similar to the existing {entity_type} '{other}' (shared Property types). Please consider whether you can re-use or extend '{other}'",
+    "entity.prefix_missing": "Entity type '{prefix}' is not present in the system, and cannot be the prefix of a new entity to be registered.",
+    "entity.prefix_incomplete": "As a specification of the entity type {prefix}, the entity type {code} must include all Property types of {prefix} without any changes.\nThe missing properties are: {missing}\nThe changed property attributes are: {changes}",
+    "entity.prefix_changed": "As a specification of the entity type {prefix}, the entity type {code} must include all Property types of {prefix} without any changes.\nThere are no missing properties\nThe changed property attributes are: {changes}",
+}
+
+
+def _display(value):
+    # Parameters are escaped (they come from the uploaded sheet), lists are shown comma-separated
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return escape(", ".join(str(item) for item in value))
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return escape(str(value))
+
+
+class Issue:
+    # reused: carried over from the last checked revision of the entity type (see revisions.py)
+    __slots__ = ("severity", "check", "key", "row", "column", "params", "reused")
+
+    def __init__(self, severity, check, key, row=None, column=None, **params):
+        self.severity = severity
+        self.check = check
+        self.key = key
+        self.row = row
+        self.column = column
+        self.params = params
+        self.reused = False
+
+    def html(self):
+        values = {name: _display(value) for name, value in self.params.items()}
+        values.setdefault("row", self.row)
+        values.setdefault("column", _display(self.column))
+        return mark_safe(MESSAGES[self.key].format(**values))
+
+    def text(self):
+        # Plain text: the values of the sheet as they were, not as HTML entities
+        return unescape(strip_tags(self.html()))
+
+    def as_dict(self):
+        return {
+            "severity": self.severity,
+            "check": self.check,
+            "key": self.key,
+            "row": self.row,
+            "column": self.column,
+            "params": self.params,
+            "reused": self.reused,
+            "message": self.text(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        issue = cls(data["severity"], data["check"], data["key"], data["row"], data["column"], **data["params"])
+        issue.reused = data.get("reused", False)
+        return issue
+
+    def as_reused(self):
+        # Copy marked as reused, the issues of the previous revision are shared and never modified
+        issue = Issue(self.severity, self.check, self.key, self.row, self.column, **self.params)
+        issue.reused = True
+        return issue
+
+    def _fields(self):
+        return (self.severity, self.check, self.key, self.row, self.column, self.params)
+
+    def __eq__(self, other):
+        if not isinstance(other, Issue):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self):
+        return f"Issue({self.severity!r}, {self.check!r}, {self.key!r}, row={self.row!r}, column={self.column!r})"
+
+
+class Report:
+    """Issues of the checks of one file, in the order they were found."""
+
+    __slots__ = ("file_name", "code", "issues")
+
+    def __init__(self, file_name="", code="", issues=()):
+        self.file_name = file_name
+        self.code = code
+        self.issues = list(issues)
+
+    def extend(self, issues):
+        self.issues.extend(issues)
+
+    def filter(self, severity=None, check=None):
+        return [issue for issue in self.issues
+                if (severity is None or issue.severity == severity) and (check is None or issue.check == check)]
+
+    def counts(self):
+        counts = dict.fromkeys(SEVERITIES, 0)
+        for issue in self.issues:
+            counts[issue.severity] += 1
+        return counts
+
+    @property
+    def passed(self):
+        return not any(issue.severity == ERROR for issue in self.issues)
+
+    def sections(self):
+        # (check, issues, message shown when there are none) for the templates
+        return [(check, self.filter(check=check), ok) for check, ok in CHECKS.items()]
+
+    def as_dict(self, severity=None, check=None, offset=0, limit=None):
+        issues = self.filter(severity, check)
+        page = issues[offset:offset + limit] if limit is not None else issues[offset:]
+        return {
+            "file_name": self.file_name,
+            "code": self.code,
+            "passed": self.passed,
+            "counts": self.counts(),
+            "total": len(issues),
+            "issues": [issue.as_dict() for issue in page],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["file_name"], data["code"], [Issue.from_dict(issue) for issue in data["issues"]])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprints of the last checked revision of every entity type, so that a new
+revision of a workbook (object_type_X_v3 after object_type_X_v2) only re-checks
+the rows that changed.
+
+For every entity type (sheet type and code) the store keeps:
+    rows: {row fingerprint: failures of the row-level content rules}, see rules.RuleSet
+    properties: {property row fingerprint: issues of its openBIS comparisons}, only
+        valid for the masterdata snapshot version they were computed against
+
+Rows are matched by content, not by position, so inserting or moving rows does
+not invalidate the others. The sheet-level rules (Section order, repeated codes)
+and the attributes of the entity type are always checked in full. Issues taken
+from the previous revision are marked as reused (results.Issue.reused).
+
+At most INCREMENTAL_MAX_REVISIONS entity types are kept per process, the least
+recently checked are dropped first; 0 disables the incremental checks.
+"""
+
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+
+class Revision:
+    __slots__ = ("rows", "version", "properties")
+
+    def __init__(self, rows=None, version=None, properties=None):
+        self.rows = rows or {}
+        self.version = version
+        self.properties = properties or {}
+
+
+class RevisionStore:
+
+    def __init__(self, max_revisions):
+        self.max_revisions = max_revisions
+        self._revisions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"rows_reused": 0, "rows_checked": 0, "properties_reused": 0, "properties_checked": 0}
+
+    @property
+    def enabled(self):
+        return self.max_revisions > 0
+
+    def get(self, key):
+        # Last checked revision of key, never modified (a new revision replaces it)
+        with self._lock:
+            revision = self._revisions.get(key)
+            if revision is not None:
+                self._revisions.move_to_end(key)
+            return revision
+
+    def save_rows(self, key, rows, reused):
+        self._save(key, rows=rows)
+        self._count(rows_reused=reused, rows_checked=len(rows) - reused)
+
+    def save_properties(self, key, version, properties, reused):
+        self._save(key, version=version, properties=properties)
+        self._count(properties_reused=reused, properties_checked=len(properties) - reused)
+
+    def _save(self, key, **parts):
+        if not self.enabled:
+            return
+        with self._lock:
+            last = self._revisions.get(key) or Revision()
+            fields = {"rows": last.rows, "version": last.version, "properties": last.properties}
+            fields.update(parts)
+            self._revisions[key] = Revision(**fields)
+            self._revisions.move_to_end(key)
+            while len(self._revisions) > self.max_revisions:
+                self._revisions.popitem(last=False)
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                self._stats[name] += count
+
+    def clear(self):
+        with self._lock:
+            self._revisions.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, revisions=len(self._revisions), max_revisions=self.max_revisions)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RevisionStore(getattr(settings, "INCREMENTAL_MAX_REVISIONS", 256))
+        return _store
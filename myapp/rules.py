@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative rules for the columns of the masterdata sheets.
+
+Every rule (pattern, allowed set, cross-column constraint) is compiled once at
+import time. A RuleSet walks the rows of a sheet a single time and hands each
+rule the cells it needs, so adding a rule does not add another scan of the sheet.
+
+For very large sheets the same rules can be evaluated on pandas columns as
+vectorized masks (backend="columnar"). Both backends report the same rows.
+
+The row-level rules (a cell, or the cells of one row) only depend on the row
+they check: with the python backend, their results can be reused for the rows
+whose fingerprint was already checked in the previous revision of a sheet (see
+revisions.py). The sheet-level rules (unique values, Section order) always run.
+
+The problems are reported as results.Issue records (check "content"), the
+messages are only formatted when they are displayed.
+"""
+
+import hashlib
+import re
+from myapp.results import Issue, ERROR, WARNING
+
+try:
+    import pandas as pd
+except ImportError:  # the columnar backend is optional
+    pd = None
+
+# Patterns and accepted values shared by the rules and the entity checks
+CODE_PATTERN = re.compile(r'^\$?[A-Z0-9_.]+$')
+VOCABULARY_CODE_PATTERN = re.compile(r'^\$?[A-Z0-9_.]')
+DESCRIPTION_PATTERN = re.compile(r'.*//.*')
+VALIDATION_SCRIPT_PATTERN = re.compile(r'^[A-Za-z0-9_]+\.py$')
+SECTION_PATTERN = re.compile(r'^[A-Z][A-Za-z]*(?:\s[A-Z][A-Za-z]*)*$')
+PROPERTY_TYPE_SECTION_PATTERN = re.compile(r'^[A-Z][a-z]*(?:\s[A-Z][a-z]*)*$')
+
+BOOLEAN_VALUES = ("TRUE", "FALSE")
+DATA_TYPES = ("INTEGER", "REAL", "VARCHAR", "MULTILINE_VARCHAR", "HYPERLINK", "BOOLEAN", "CONTROLLEDVOCABULARY", "XML", "TIMESTAMP", "DATE", "SAMPLE")
+
+# Predefined section order (fixed order)
+PREDEFINED_SECTION_ORDER = ("General Information", "Additional Information", "Comments")
+
+
+def fingerprint(*values):
+    # Digest of the values of a row: the type matters to the rules (1, 1.0 and "1" differ)
+    return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).digest()
+
+
+# Every test and normalizer has a "vector" counterpart taking a pandas Series
+def vectorized(vector):
+    def decorate(function):
+        function.vector = vector
+        return function
+    return decorate
+
+
+def text(values):
+    # str() of every value, like the row-by-row tests (None -> "None")
+    return values.map(str).astype(object)
+
+
+def on_text(values, function):
+    # The string tests only depend on str(value): run them once per distinct string
+    codes, uniques = pd.factorize(text(values))
+    results = function(pd.Series(uniques, dtype=object)).to_numpy()
+    return pd.Series(results[codes], index=values.index)
+
+
+def matches(pattern):
+    @vectorized(lambda values: on_text(values, lambda texts: texts.str.match(pattern.pattern, flags=pattern.flags)))
+    def test(value):
+        return pattern.match(str(value)) is not None
+    return test
+
+
+def one_of(allowed, upper=False):
+    allowed = frozenset(allowed)
+    if upper:
+        @vectorized(lambda values: on_text(values, lambda texts: texts.str.upper().isin(allowed)))
+        def test(value):
+            return str(value).upper() in allowed
+    else:
+        @vectorized(lambda values: values.isin(allowed))
+        def test(value):
+            return value in allowed
+    return test
+
+
+@vectorized(lambda values: on_text(values, lambda texts: texts.str.isnumeric()))
+def is_numeric(value):
+    return str(value).isnumeric()
+
+
+@vectorized(lambda values: values.map(is_integer).astype(bool))
+def is_integer(value):
+    return isinstance(value, int)
+
+
+@vectorized(lambda values: values.isna())
+def is_none(value):
+    return value is None
+
+
+@vectorized(lambda values: values.isna() | values.isin(["", 0]))
+def is_blank(value):
+    return not value
+
+
+@vectorized(lambda values: text(values).str.replace("$", "", regex=False))
+def strip_placeholder(value):
+    return str(value).replace("$", "")
+
+
+class CellRule:
+    """
+    Checks the cell of one column in every row and reports the rows that fail.
+
+    key: message of the issue (see results.MESSAGES), params: its other parameters
+    skip: predicate for the cells that are not checked (e.g. empty cells)
+    placeholders: cells containing a "$" placeholder are accepted
+    normalize: applied to the value before the test
+    """
+
+    row_level = True
+
+    def __init__(self, term, test, key, skip=None, placeholders=False, normalize=None, params=None):
+        self.term = term
+        self.terms = (term,)
+        self.test = test
+        self.key = key
+        self.params = params or {}
+        self.skip = skip
+        self.placeholders = placeholders
+        self.normalize = normalize
+
+    def start(self):
+        return []
+
+    def check(self, invalid, row_number, cells):
+        self.add(invalid, row_number, self.check_row(cells))
+
+    def check_row(self, cells):
+        # Failures of one row, independent of its position: the invalid value, or nothing
+        value = cells[self.term]
+        if self.skip is not None and self.skip(value):
+            return ()
+        if self.normalize is not None:
+            value = self.normalize(value)
+        if self.placeholders and "$" in str(value):
+            return ()
+        if not self.test(value):
+            return (value,)
+        return ()
+
+    def add(self, invalid, row_number, failures):
+        invalid.extend((row_number, value) for value in failures)
+
+    def vector_check(self, columns):
+        values = columns[self.term]
+        if self.skip is not None:
+            values = values[~self.skip.vector(values)]
+        if self.normalize is not None:
+            values = self.normalize.vector(values)
+        if self.placeholders:
+            values = values[~on_text(values, lambda texts: texts.str.contains("$", regex=False)).astype(bool)]
+        invalid = values[~self.test.vector(values).astype(bool)]
+        return list(zip(invalid.index.tolist(), invalid.tolist()))
+
+    def report(self, invalid):
+        if not invalid:
+            return []
+        rows = [row for row, _ in invalid]
+        values = [value for _, value in invalid]
+        return [Issue(ERROR, "content", self.key, column=self.term, rows=rows, values=values, **self.params)]
+
+
+class UniqueRule:
+    """Reports the values repeated in one column."""
+
+    row_level = False
+
+    def __init__(self, term, key):
+        self.term = term
+        self.terms = (term,)
+        self.key = key
+
+    def start(self):
+        return {"seen": set(), "repeated": set()}
+
+    def check(self, state, row_number, cells):
+        value = cells[self.term]
+        if value is None:
+            return
+        if value in state["seen"]:
+            state["repeated"].add(value)
+        else:
+            state["seen"].add(value)
+
+    def vector_check(self, columns):
+        values = columns[self.term]
+        values = values[values.notna()]
+        return {"seen": set(values), "repeated": set(values[values.duplicated()])}
+
+    def report(self, state):
+        if not state["repeated"]:
+            return []
+        repeated = sorted(state["repeated"], key=str)
+        return [Issue(ERROR, "content", self.key, column=self.term, repeated=repeated)]
+
+
+class SectionRule:
+    """
+    Checks that all the properties of a Section are grouped together and that
+    the predefined sections keep their order around the user-defined ones.
+    """
+
+    row_level = False
+
+    def __init__(self, term, normalize=None):
+        self.term = term
+        self.terms = (term,)
+        self.normalize = normalize
+
+    def start(self):
+        return {
+            "last_seen": {},  # Last position of every section value
+            "position": 0,
+            "non_contiguous_rows": [],
+            "errors": [],
+            "previous_section_type": None,
+            "additional_info_seen": False,
+            "comments_seen": False,
+        }
+
+    def check(self, state, row_number, cells):
+        section = cells[self.term]
+        if section is None:
+            return
+        if self.normalize is not None:
+            section = self.normalize(section)
+
+        # Group Check: the value has been seen before but not in the previous row
+        position = state["position"]
+        if section in state["last_seen"] and state["last_seen"][section] != position - 1:
+            state["non_contiguous_rows"].append(row_number)
+        state["last_seen"][section] = position
+        state["position"] = position + 1
+
+        errors = state["errors"]
+        previous_section_type = state["previous_section_type"]
+        if section in PREDEFINED_SECTION_ORDER:
+            if section == "General Information":
+                if previous_section_type not in [None, "General Information"]:
+                    errors.append(Issue(ERROR, "content", "rows.general_information_first", row=row_number, column=self.term))
+            elif section == "Additional Information":
+                if previous_section_type not in ["General Information", "user-defined"]:
+                    errors.append(Issue(ERROR, "content", "rows.additional_information_order", row=row_number, column=self.term))
+                state["additional_info_seen"] = True
+            elif section == "Comments":
+                if previous_section_type not in ["General Information", "user-defined", "Additional Information"]:
+                    errors.append(Issue(ERROR, "content", "rows.comments_order", row=row_number, column=self.term))
+                state["comments_seen"] = True
+            state["previous_section_type"] = section
+        else:
+            # User-defined section
+            if state["comments_seen"]:
+                errors.append(Issue(ERROR, "content", "rows.section_after_comments", row=row_number, column=self.term, section=section))
+            if state["additional_info_seen"] and not state["comments_seen"]:
+                errors.append(Issue(ERROR, "content", "rows.section_before_comments", row=row_number, column=self.term, section=section))
+            state["previous_section_type"] = "user-defined"
+
+    def vector_check(self, columns):
+        sections = columns[self.term]
+        sections = sections[sections.notna()]
+        if self.normalize is not None:
+            sections = self.normalize.vector(sections)
+
+        # Group Check: seen before, but the previous section is a different one
+        non_contiguous = sections.duplicated() & (sections != sections.shift())
+
+        # The section type of the previous row, and whether the predefined sections were already seen
+        section_types = sections.where(sections.isin(PREDEFINED_SECTION_ORDER), "user-defined")
+        previous_types = section_types.shift()
+        additional_info_seen = (section_types == "Additional Information").cummax()
+        comments_seen = (section_types == "Comments").cummax()
+
+        general_errors = (section_types == "General Information") & previous_types.notna() & (previous_types != "General Information")
+        additional_errors = (section_types == "Additional Information") & ~previous_types.isin(["General Information", "user-defined"])
+        comments_errors = (section_types == "Comments") & ~previous_types.isin(["General Information", "user-defined", "Additional Information"])
+        user_defined = section_types == "user-defined"
+        after_comments_errors = user_defined & comments_seen
+        before_comments_errors = user_defined & additional_info_seen & ~comments_seen
+
+        errors = []
+        flagged = general_errors | additional_errors | comments_errors | after_comments_errors | before_comments_errors
+        flagged = flagged.to_numpy()
+        kinds = zip(
+            general_errors.to_numpy()[flagged].tolist(),
+            additional_errors.to_numpy()[flagged].tolist(),
+            comments_errors.to_numpy()[flagged].tolist(),
+            after_comments_errors.to_numpy()[flagged].tolist(),
+        )
+        for row_number, section, (general, additional, comments, after_comments) in zip(sections.index[flagged].tolist(), sections[flagged].tolist(), kinds):
+            if general:
+                errors.append(Issue(ERROR, "content", "rows.general_information_first", row=row_number, column=self.term))
+            elif additional:
+                errors.append(Issue(ERROR, "content", "rows.additional_information_order", row=row_number, column=self.term))
+            elif comments:
+                errors.append(Issue(ERROR, "content", "rows.comments_order", row=row_number, column=self.term))
+            elif after_comments:
+                errors.append(Issue(ERROR, "content", "rows.section_after_comments", row=row_number, column=self.term, section=section))
+            else:
+                errors.append(Issue(ERROR, "content", "rows.section_before_comments", row=row_number, column=self.term, section=section))
+
+        return {"non_contiguous_rows": sections.index[non_contiguous.to_numpy()].tolist(), "errors": errors}
+
+    def report(self, state):
+        errors = []
+        if state["non_contiguous_rows"]:
+            errors.append(Issue(ERROR, "content", "rows.section_not_contiguous", column=self.term, rows=state["non_contiguous_rows"]))
+        return errors + state["errors"]
+
+
+class CrossColumnRule:
+    """When the cell of term equals a value, the cell of another column must hold the expected value."""
+
+    row_level = True
+
+    def __init__(self, term, value, other, expected, key):
+        self.term = term
+        self.terms = (term, other)
+        self.value = value
+        self.other = other
+        self.expected = expected
+        self.key = key
+
+    def start(self):
+        return []
+
+    def check(self, errors, row_number, cells):
+        self.add(errors, row_number, self.check_row(cells))
+
+    def check_row(self, cells):
+        if cells[self.term] == self.value and cells[self.other] != self.expected:
+            return (cells[self.other],)
+        return ()
+
+    def add(self, errors, row_number, failures):
+        errors.extend(Issue(ERROR, "content", self.key, row=row_number, column=self.other, value=value) for value in failures)
+
+    def vector_check(self, columns):
+        failing = (columns[self.term] == self.value) & (columns[self.other] != self.expected)
+        others = columns[self.other][failing.to_numpy()]
+        return [Issue(ERROR, "content", self.key, row=row_number, column=self.other, value=value) for row_number, value in zip(others.index.tolist(), others.tolist())]
+
+    def report(self, errors):
+        return errors
+
+
+class RuleSet:
+    """
+    The expected headers of a sheet and the rules checked below them.
+
+    Missing headers are reported as errors with missing_key, or as warnings with
+    optional_key for the optional terms. Rules whose columns are missing are not run.
+
+    previous: {row fingerprint: failures} of the row-level rules in the last checked
+    revision of the sheet; the rows found there are not checked again and their
+    issues are marked as reused. current: filled with the fingerprints of this revision.
+    """
+
+    def __init__(self, terms, rules, missing_key, optional_terms=(), optional_key=None):
+        self.terms = terms
+        self.rules = rules
+        self.missing_key = missing_key
+        self.optional_terms = optional_terms
+        self.optional_key = optional_key
+
+    def run(self, headers, rows, first_row=5, backend="python", previous=None, current=None):
+        positions = {}
+        for i, header in enumerate(headers):
+            positions.setdefault(header, i)
+
+        active = [rule for rule in self.rules if all(term in positions for term in rule.terms)]
+        columns = {term: positions[term] for rule in active for term in rule.terms}
+        reused_rows = set()
+
+        if backend == "columnar" and pd is not None:
+            # The whole columns are evaluated at once, there is nothing to reuse
+            states = self.run_columnar(active, columns, rows, first_row)
+        elif current is not None:
+            states = self.run_incremental(active, columns, rows, first_row, previous or {}, current, reused_rows)
+        else:
+            states = [rule.start() for rule in active]
+
+            # Walk the rows once, every rule gets the cells of its columns
+            for row_number, row in enumerate(rows, start=first_row):
+                if all(value is None for value in row):
+                    continue
+                cells = {term: row[position] if position < len(row) else None for term, position in columns.items()}
+                for rule, state in zip(active, states):
+                    rule.check(state, row_number, cells)
+
+        # Report in the order of the expected terms
+        errors = []
+        for term in self.terms:
+            if term not in positions:
+                if term in self.optional_terms:
+                    errors.append(Issue(WARNING, "content", self.optional_key, column=term))
+                else:
+                    errors.append(Issue(ERROR, "content", self.missing_key, column=term))
+                continue
+            for rule, state in zip(active, states):
+                if rule.term == term:
+                    issues = rule.report(state)
+                    if rule.row_level and reused_rows:
+                        for issue in issues:
+                            issue.reused = all(row in reused_rows for row in issue.params.get("rows", [issue.row]))
+                    errors.extend(issues)
+        return errors
+
+    def run_incremental(self, active, columns, rows, first_row, previous, current, reused_rows):
+        # Like the python backend, but the row-level rules of a row already checked in the
+        # previous revision (same cells, wherever the row is now) are replayed from it
+        states = [rule.start() for rule in active]
+        row_rules = [(rule, state) for rule, state in zip(active, states) if rule.row_level]
+        sheet_rules = [(rule, state) for rule, state in zip(active, states) if not rule.row_level]
+
+        for row_number, row in enumerate(rows, start=first_row):
+            if all(value is None for value in row):
+                continue
+            cells = {term: row[position] if position < len(row) else None for term, position in columns.items()}
+            for rule, state in sheet_rules:
+                rule.check(state, row_number, cells)
+
+            key = fingerprint(*cells.items())
+            failures = previous.get(key)
+            if failures is None:
+                failures = tuple(rule.check_row(cells) for rule, _ in row_rules)
+            elif any(failures):
+                reused_rows.add(row_number)
+            current[key] = failures
+            for (rule, state), row_failures in zip(row_rules, failures):
+                if row_failures:
+                    rule.add(state, row_number, row_failures)
+        return states
+
+    def run_columnar(self, active, columns, rows, first_row):
+        # Load the rows into object columns indexed by row number and evaluate every rule as masks
+        frame = pd.DataFrame(list(rows), dtype=object)
+        frame.index = range(first_row, first_row + len(frame))
+        frame = frame[frame.notna().any(axis=1)]
+        series = {
+            term: frame[position] if position in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+            for term, position in columns.items()
+        }
+        return [rule.vector_check(series) for rule in active]
+
+
+ACCEPTED_TYPES = {"accepted": ", ".join(DATA_TYPES)}
+
+# Property assignments of SAMPLE_TYPE, EXPERIMENT_TYPE and DATASET_TYPE sheets (headers in row 4)
+PROPERTY_RULES = RuleSet(
+    terms=("Version", "Code", "Description", "Mandatory", "Show in edit views", "Section", "Property label", "Data type", "Vocabulary code"),
+    rules=[
+        CellRule("Version", is_numeric, "rows.version", skip=is_none, placeholders=True),
+        CellRule("Code", matches(CODE_PATTERN), "rows.code", skip=is_none, placeholders=True),
+        UniqueRule("Code", "rows.repeated_properties"),
+        CellRule("Description", matches(DESCRIPTION_PATTERN), "rows.description", skip=is_none, placeholders=True),
+        CellRule("Mandatory", one_of(BOOLEAN_VALUES, upper=True), "rows.boolean", skip=is_none, placeholders=True),
+        CellRule("Show in edit views", one_of(BOOLEAN_VALUES, upper=True), "rows.boolean", skip=is_none, placeholders=True),
+        CellRule("Section", matches(SECTION_PATTERN), "rows.section", skip=is_none, normalize=strip_placeholder),
+        SectionRule("Section", normalize=strip_placeholder),
+        CrossColumnRule("Property label", "Notes", "Section", "Additional Information", "rows.notes_section"),
+        CellRule("Data type", one_of(DATA_TYPES, upper=True), "rows.data_type", skip=is_none, placeholders=True, params=ACCEPTED_TYPES),
+        CellRule("Vocabulary code", matches(VOCABULARY_CODE_PATTERN), "rows.vocabulary_code", skip=is_blank, placeholders=True),
+    ],
+    missing_key="rows.missing_property_header",
+    optional_terms=("Mandatory", "Show in edit views", "Section"),
+    optional_key="rows.optional_property_header",
+)
+
+# Terms of VOCABULARY_TYPE sheets (headers in row 4)
+VOCABULARY_TERM_RULES = RuleSet(
+    terms=("Version", "Code", "Label", "Description"),
+    rules=[
+        CellRule("Version", is_numeric, "rows.version", skip=is_none),
+        CellRule("Code", matches(CODE_PATTERN), "rows.code", skip=is_none),
+        UniqueRule("Code", "rows.repeated_terms"),
+        CellRule("Description", matches(DESCRIPTION_PATTERN), "rows.description", skip=is_blank),
+    ],
+    missing_key="rows.missing_term_header",
+)
+
+# PROPERTY_TYPE sheets (headers in row 2, one property type per row from row 3)
+PROPERTY_TYPE_RULES = RuleSet(
+    terms=("Version", "Code", "Description", "Mandatory", "Show in edit views", "Section", "Property label", "Data type", "Vocabulary code"),
+    rules=[
+        CellRule("Version", is_integer, "rows.version_values"),
+        CellRule("Code", matches(CODE_PATTERN), "rows.code_values"),
+        CellRule("Description", matches(DESCRIPTION_PATTERN), "rows.description_values"),
+        CellRule("Mandatory", one_of(BOOLEAN_VALUES, upper=True), "rows.boolean_values"),
+        CellRule("Show in edit views", one_of(BOOLEAN_VALUES, upper=True), "rows.boolean_values"),
+        CellRule("Section", matches(PROPERTY_TYPE_SECTION_PATTERN), "rows.section_values"),
+        SectionRule("Section"),
+        CrossColumnRule("Property label", "Notes", "Section", "Additional Information", "rows.notes_section"),
+        CellRule("Data type", one_of(DATA_TYPES), "rows.data_type_values", params=ACCEPTED_TYPES),
+        CellRule("Vocabulary code", matches(CODE_PATTERN), "rows.vocabulary_code_values", skip=is_none),
+    ],
+    missing_key="rows.missing_second_row_header",
+)
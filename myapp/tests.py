@@ -1,3 +1,1100 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import zipfile
+from types import SimpleNamespace
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+import openpyxl
+import pandas as pd
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, override_settings
+
+from myapp import batch, csv_storage, jobs, masterdata, metrics, openbis_pool, result_cache, revisions, rules, uploads, utils, views
+from myapp.openbis_calls import CallBudgetExceeded, CallTracker
+from myapp.openbis_pool import pool
+from myapp.property_index import PropertySetIndex, jaccard
+from myapp.results import Issue, Report
+
+try:
+    import xlwt
+except ImportError:  # only needed to write the .xls test workbooks
+    xlwt = None
+
+
+def workbook_bytes(rows):
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+SAMPLE_ROWS = [
+    ["SAMPLE_TYPE"],
+    ["Version", "Code", "Description", "Validation script", "Generated code prefix", "Auto generate codes"],
+    [1, "TYPE", "Type//Typ", None, "TYP", "FALSE"],
+    ["Version", "Code", "Description", "Mandatory", "Show in edit views", "Section", "Property label", "Data type",
+     "Vocabulary code", "Metadata", "Dynamic script"],
+    [1, "$NAME", "Name//Name", "FALSE", "TRUE", "General Information", "Name", "VARCHAR", None, None, None],
+]
+
+
+class FakeConnection:
+    # Answers get_object_type from types, after raising the errors queued in failures
+    url = "https://openbis.test"
+
+    def __init__(self, types, failures=(), latency=0):
+        self.types = types
+        self.failures = list(failures)
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_object_type(self, code):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if self.failures:
+            raise self.failures.pop(0)
+        if code not in self.types:
+            raise ValueError(f"no such sampleType: {code}")
+        return SimpleNamespace(code=code)
+
+
+class MasterdataSnapshotTests(SimpleTestCase):
+
+    def setUp(self):
+        masterdata.invalidate()
+
+    def test_missing_entity_is_remembered(self):
+        o = FakeConnection({})
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                masterdata.snapshot(o).entity(o, "SAMPLE_TYPE", "NEW_TYPE")
+        self.assertEqual(o.calls, 1)
+
+    def test_failed_fetch_is_retried(self):
+        o = FakeConnection({"EXPERIMENT_STEP": 1}, [ValueError("Your session expired, please log in again")])
+        with self.assertRaises(masterdata.MasterdataUnavailable):
+            masterdata.snapshot(o).entity(o, "SAMPLE_TYPE", "EXPERIMENT_STEP")
+        self.assertEqual(masterdata.snapshot(o).entity(o, "SAMPLE_TYPE", "EXPERIMENT_STEP").code, "EXPERIMENT_STEP")
+        self.assertEqual(o.calls, 2)
+
+    def test_failed_fetch_is_retried_in_the_same_request(self):
+        o = FakeConnection({"EXPERIMENT_STEP": 1}, [ValueError("login to openBIS failed")])
+        lookups = masterdata.RequestLookups(o)
+        with self.assertRaises(masterdata.MasterdataUnavailable):
+            lookups.entity("SAMPLE_TYPE", "EXPERIMENT_STEP")
+        self.assertEqual(lookups.entity("SAMPLE_TYPE", "EXPERIMENT_STEP").code, "EXPERIMENT_STEP")
+        self.assertEqual(o.calls, 2)
+
+    def test_concurrent_lookups_fetch_once(self):
+        o = FakeConnection({"EXPERIMENT_STEP": 1}, latency=0.05)
+        lookups = masterdata.RequestLookups(o)
+        with ThreadPoolExecutor(max_workers=8) as threads:
+            found = list(threads.map(lambda _: lookups.entity("SAMPLE_TYPE", "EXPERIMENT_STEP"), range(16)))
+        self.assertEqual({entity.code for entity in found}, {"EXPERIMENT_STEP"})
+        self.assertEqual(o.calls, 1)
+        self.assertEqual(lookups.calls["entity"], 1)
+
+    @override_settings(MASTERDATA_CACHE_TTL=60)
+    def test_snapshot_expires_after_the_ttl(self):
+        o = FakeConnection({"EXPERIMENT_STEP": 1})
+        current = masterdata.snapshot(o)
+        current.entity(o, "SAMPLE_TYPE", "EXPERIMENT_STEP")
+        self.assertIs(masterdata.snapshot(o), current)
+        with mock.patch.object(masterdata.time, "monotonic", return_value=current.expires):
+            renewed = masterdata.snapshot(o)
+        self.assertIsNot(renewed, current)
+        self.assertNotEqual(renewed.version, current.version)
+        renewed.entity(o, "SAMPLE_TYPE", "EXPERIMENT_STEP")
+        self.assertEqual(o.calls, 2)
+
+    def test_invalidation_spares_the_running_requests(self):
+        o = FakeConnection({"EXPERIMENT_STEP": 1})
+        lookups = masterdata.RequestLookups(o)
+        lookups.entity("SAMPLE_TYPE", "EXPERIMENT_STEP")
+        self.assertEqual(masterdata.invalidate(o.url), 1)
+        # The request keeps the snapshot it started with, the next one fetches again
+        lookups.entity("SAMPLE_TYPE", "EXPERIMENT_STEP")
+        self.assertEqual(o.calls, 1)
+        self.assertNotEqual(masterdata.RequestLookups(o).version, lookups.version)
+        masterdata.RequestLookups(o).entity("SAMPLE_TYPE", "EXPERIMENT_STEP")
+        self.assertEqual(o.calls, 2)
+
+
+    def test_assignments_get_their_property_types_from_one_search(self):
+        # pybis assignments only name their property type ("code" in recent pybis versions, "propertyType" before)
+        assignments = {"A": pd.DataFrame({"code": ["$NAME", "NOTES"], "section": ["General Information", "Comments"]}),
+                       "B": pd.DataFrame({"propertyType": ["$NAME"], "mandatory": [True]})}
+        property_types = pd.DataFrame({"code": ["$NAME", "NOTES"], "label": ["Name", "Notes"], "dataType": ["VARCHAR", "MULTILINE_VARCHAR"],
+                                       "vocabulary": ["", ""], "description": ["Name//Name", "Notes//Notizen"], "metaData": [{}, {}]})
+        o = FakeConnection({"A": 1, "B": 1})
+        o.get_object_type = lambda code: SimpleNamespace(code=code, get_property_assignments=lambda: SimpleNamespace(df=assignments[code]))
+        o.get_property_types = mock.Mock(return_value=SimpleNamespace(df=property_types))
+        lookups = masterdata.RequestLookups(o)
+        first = lookups.assignments("SAMPLE_TYPE", "A")
+        self.assertEqual([(prop.code, prop.permId, prop.label, prop.section) for prop in first],
+                         [("$NAME", "$NAME", "Name", "General Information"), ("NOTES", "NOTES", "Notes", "Comments")])
+        self.assertEqual(list(first.df["propertyType"]), ["$NAME", "NOTES"])
+        (name,) = lookups.assignments("SAMPLE_TYPE", "B")
+        self.assertEqual((name.dataType, name.mandatory), ("VARCHAR", True))
+        o.get_property_types.assert_called_once_with()
+
+PROPERTY_HEADERS = ("Version", "Code", "Description", "Mandatory", "Show in edit views", "Section", "Property label",
+                    "Data type", "Vocabulary code")
+
+# One row per problem the property rules find, and some valid ones
+PROPERTY_ROWS = [
+    (1, "$NAME", "Name//Name", "FALSE", "TRUE", "General Information", "Name", "VARCHAR", None),
+    ("one", "bad code", "no translation", "maybe", "TRUE", "General Information", "Label", "VARCHAR", None),
+    (1, "$NAME", "Name//Name", "FALSE", "TRUE", "General Information", "Name", "VARCHAR", None),
+    (1, "P.ONE", "One//Eins", "true", "FALSE", "lower section", "One", "TEXT", None),
+    (None, None, None, None, None, None, None, None, None),
+    (1, "P.TWO", "Two//Zwei", "TRUE", "FALSE", "Additional Information", "Notes", "CONTROLLEDVOCABULARY", "-VOCAB"),
+    (1, "P.THREE", "Three//Drei", "TRUE", "FALSE", "General Information", "Notes", "INTEGER", None),
+    (1, "P.FOUR", "Four//Vier", "TRUE", "FALSE", "Comments", "Four", "DATE", None),
+    (1, "P.FIVE", "Five//Fuenf", "TRUE", "FALSE", "Own Section", "Five", "DATE", None),
+]
+
+TERM_ROWS = [
+    (1, "RED", "Red", "Red//Rot"),
+    ("1.5x", "dark red", "Dark red", "Dark red"),
+    (1, "RED", "Red", "Red//Rot"),
+    (None, None, None, None),
+    (2, "BLUE", "Blue", None),
+]
+
+RULE_SHEETS = [
+    (rules.PROPERTY_RULES, PROPERTY_HEADERS, PROPERTY_ROWS, 5),
+    (rules.VOCABULARY_TERM_RULES, ("Version", "Code", "Label", "Description"), TERM_ROWS, 5),
+    (rules.PROPERTY_TYPE_RULES, PROPERTY_HEADERS, [row for row in PROPERTY_ROWS if row[1] != "$NAME"], 3),
+    # Without the optional headers
+    (rules.PROPERTY_RULES, PROPERTY_HEADERS[:3] + PROPERTY_HEADERS[6:], [row[:3] + row[6:] for row in PROPERTY_ROWS], 5),
+]
+
+
+class RuleBackendTests(SimpleTestCase):
+
+    def test_sheets_have_issues(self):
+        for rule_set, headers, rows, first_row in RULE_SHEETS:
+            issues = rule_set.run(headers, rows, first_row)
+            self.assertGreater(len([issue for issue in issues if issue.key not in (rule_set.missing_key, rule_set.optional_key)]), 2)
+
+    def test_incremental_run_reports_the_same_issues(self):
+        for rule_set, headers, rows, first_row in RULE_SHEETS:
+            with self.subTest(rule_set.missing_key, headers=len(headers)):
+                current = {}
+                issues = rule_set.run(headers, rows, first_row, previous={}, current=current)
+                self.assertEqual(issues, rule_set.run(headers, rows, first_row))
+                self.assertFalse(any(issue.reused for issue in issues))
+                self.assertEqual(len(current), len({row for row in rows if any(value is not None for value in row)}))
+
+    @skipIf(rules.pd is None, "the columnar backend needs pandas")
+    def test_columnar_run_reports_the_same_issues(self):
+        for rule_set, headers, rows, first_row in RULE_SHEETS:
+            with self.subTest(rule_set.missing_key, headers=len(headers)):
+                self.assertEqual(rule_set.run(headers, rows, first_row, backend="columnar"), rule_set.run(headers, rows, first_row))
+
+    def test_unchanged_rows_are_reused(self):
+        revision = {}
+        rules.PROPERTY_RULES.run(PROPERTY_HEADERS, PROPERTY_ROWS, previous={}, current=revision)
+        # A new row on top moves all the others down, the bad row is fixed
+        added = (1, "P.ZERO", "Zero", "TRUE", "FALSE", "General Information", "Zero", "VARCHAR", None)
+        fixed = (1, "P.LABEL", "Label//Label", "TRUE", "TRUE", "General Information", "Label", "VARCHAR", None)
+        rows = [added, PROPERTY_ROWS[0], fixed] + PROPERTY_ROWS[2:]
+        with mock.patch.object(rules.CellRule, "check_row", autospec=True, side_effect=rules.CellRule.check_row) as check_row:
+            issues = rules.PROPERTY_RULES.run(PROPERTY_HEADERS, rows, previous=revision, current={})
+        self.assertEqual(issues, rules.PROPERTY_RULES.run(PROPERTY_HEADERS, rows))
+        # Only the new and the fixed row are checked again
+        self.assertEqual({call.args[1]["Code"] for call in check_row.call_args_list}, {"P.ZERO", "P.LABEL"})
+        reused = {issue.key: issue.reused for issue in issues}
+        self.assertFalse(reused["rows.description"])
+        self.assertTrue(reused["rows.data_type"])
+
+
+class CallBudgetTests(SimpleTestCase):
+
+    def test_budget_stops_the_call_before_it_is_made(self):
+        o = FakeConnection({"EXPERIMENT_STEP": 1})
+        with override_settings(OPENBIS_CALL_BUDGET=2), metrics.request("test"):
+            instrumented = metrics.instrument(o)
+            instrumented.get_object_type("EXPERIMENT_STEP")
+            instrumented.get_object_type("EXPERIMENT_STEP")
+            with self.assertRaisesMessage(CallBudgetExceeded, "More than 2 openBIS calls in one request (get_object_type 2)"):
+                instrumented.get_object_type("EXPERIMENT_STEP")
+        self.assertEqual(o.calls, 2)
+
+    def test_repeated_calls_are_reported_once(self):
+        tracker = CallTracker(threshold=3)
+        self.assertEqual([tracker.record("get_property_type", "entity") for _ in range(4)], [False, False, True, False])
+        self.assertEqual(tracker.suspects(), [("get_property_type", 4, {"entity": 4})])
+
+    @override_settings(OPENBIS_N_PLUS_ONE_THRESHOLD=3)
+    def test_repeated_calls_are_logged(self):
+        o = metrics.instrument(FakeConnection({"EXPERIMENT_STEP": 1}))
+        with self.assertLogs("myapp", level="WARNING") as logs:
+            with metrics.request("upload", "object_type_TYPE_v1_S_me.xlsx"), metrics.stage("entity"):
+                for _ in range(3):
+                    o.get_object_type("EXPERIMENT_STEP")
+        self.assertIn("Probable N+1 openBIS calls in upload object_type_TYPE_v1_S_me.xlsx: get_object_type called 3 times (entity 3)",
+                      logs.output[-1])
+
+
+class MetricsTests(SimpleTestCase):
+
+    def test_stages_and_calls_are_rendered(self):
+        registry = metrics.Registry()
+        with mock.patch.object(metrics, "registry", registry):
+            with metrics.request("upload"), self.assertRaises(ValueError):
+                with metrics.stage("load"):
+                    raise ValueError("broken workbook")
+        text = registry.render()
+        self.assertIn('checker_requests_total{kind="upload"} 1', text)
+        self.assertIn('checker_stage_seconds_bucket{stage="load",le="+Inf"} 1', text)
+        self.assertIn('checker_errors_total{stage="load"} 1', text)
+
+    @override_settings(METRICS_ALLOWED_ADDRESSES=("10.0.0.1",))
+    def test_only_allowed_addresses_see_the_metrics(self):
+        self.assertEqual(views.metrics_view(RequestFactory().get("/metrics/", REMOTE_ADDR="10.0.0.2")).status_code, 403)
+        response = views.metrics_view(RequestFactory().get("/metrics/", REMOTE_ADDR="10.0.0.1"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+
+class ReaderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.xlsx = os.path.join(self.directory, "object_type_TYPE_v1_S_me.xlsx")
+        with open(self.xlsx, "wb") as workbook_file:
+            workbook_file.write(workbook_bytes(SAMPLE_ROWS))
+
+    def expected(self, width):
+        return [tuple(row) + (None,) * (width - len(row)) for row in SAMPLE_ROWS]
+
+    @override_settings(CHECKER_READER="openpyxl")
+    def test_openpyxl_reads_the_active_sheet(self):
+        self.assertEqual(utils.reader_for(self.xlsx), "openpyxl")
+        with open(self.xlsx, "rb") as workbook_file:
+            self.assertEqual(utils.reader_for(workbook_file), "openpyxl")
+            self.assertEqual(workbook_file.tell(), 0)
+        self.assertEqual(list(utils.read_workbook_rows(self.xlsx)), self.expected(11))
+
+    def test_reading_stops_at_the_row_limit(self):
+        with self.assertRaisesMessage(uploads.UploadRejected, "more than 4 rows"):
+            utils.ParsedWorkbook.load(self.xlsx, max_rows=4)
+        self.assertEqual(utils.ParsedWorkbook.load(self.xlsx, max_rows=5).max_row, 5)
+
+    @skipUnless(utils.python_calamine is not None, "python-calamine is not installed")
+    def test_calamine_reads_the_same_values(self):
+        self.assertEqual(list(utils.read_workbook_rows(self.xlsx, "calamine")), list(utils.read_workbook_rows(self.xlsx, "openpyxl")))
+
+    def test_xls_files_are_told_by_their_content(self):
+        xls = os.path.join(self.directory, "object_type_TYPE_v1_S_me.xlsx")
+        with open(xls, "wb") as workbook_file:
+            workbook_file.write(uploads.OLE2_SIGNATURE + b"\0" * 512)
+        if utils.xlrd is None and utils.python_calamine is None:
+            with self.assertRaisesMessage(ValueError, "Reading .xls files needs xlrd"):
+                utils.reader_for(xls)
+        else:
+            self.assertEqual(utils.reader_for(xls), "xlrd" if utils.xlrd is not None else "calamine")
+
+    @skipUnless(utils.xlrd is not None and xlwt is not None, "xlrd and xlwt are needed for .xls files")
+    def test_xlrd_reads_the_same_values(self):
+        xls = os.path.join(self.directory, "object_type_TYPE_v1_S_me.xls")
+        book = xlwt.Workbook()
+        sheet = book.add_sheet("Sheet")
+        for i, row in enumerate(SAMPLE_ROWS):
+            for j, value in enumerate(row):
+                if value is not None:
+                    sheet.write(i, j, value)
+        book.save(xls)
+        rows = [tuple(value if value != "" else None for value in row) for row in utils.read_workbook_rows(xls)]
+        self.assertEqual([row + (None,) * (11 - len(row)) for row in rows], self.expected(11))
+
+    @mock.patch.object(revisions, "_store", revisions.RevisionStore(0))
+    def test_streamed_content_checks_find_the_same_issues(self):
+        # Without revisions: every run checks all the rows
+        sheets = {
+            "object_type_TYPE_v1_S_me.xlsx": SAMPLE_ROWS[:4] + [list(row) for row in PROPERTY_ROWS],
+            "vocabulary_COLORS_v1_S_me.xlsx": [["VOCABULARY_TYPE"], ["Version", "Code", "Description"], [1, "COLORS", "Colors"],
+                                               ["Version", "Code", "Label", "Description"]] + [list(row) for row in TERM_ROWS],
+            "property_types.xlsx": [["PROPERTY_TYPE"], list(PROPERTY_HEADERS)] + [list(row) for row in PROPERTY_ROWS],
+        }
+        for file_name, rows in sheets.items():
+            path = os.path.join(self.directory, file_name)
+            with open(path, "wb") as workbook_file:
+                workbook_file.write(workbook_bytes(rows))
+            name_ok = utils.name_checker(file_name)[2]
+            expected = [issue.as_dict() for issue in utils.content_checker(utils.ParsedWorkbook.load(path, file_name), name_ok)]
+            self.assertTrue(expected)
+            with open(path, "rb") as workbook_file:
+                self.assertEqual([issue.as_dict() for issue in utils.stream_content_checker(workbook_file, name_ok, file_name)], expected)
+            workbook, _, _, _, result_content = batch.check_file(path, entity=False)
+            self.assertIsNone(workbook)
+            self.assertEqual([issue.as_dict() for issue in result_content], expected)
+
+
+class ResultCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        path = os.path.join(self.directory, "upload.xlsx")
+        with open(path, "wb") as workbook_file:
+            workbook_file.write(workbook_bytes(SAMPLE_ROWS))
+        self.upload = uploads.SpooledUpload(path, "object_type_TYPE_v1_S_me.xlsx", os.path.getsize(path), "digest", False)
+        patcher = mock.patch.object(result_cache, "_cache", result_cache.ResultCache(2))
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keys_depend_on_the_content_and_the_name(self):
+        renamed = uploads.SpooledUpload(self.upload.path, "object_type_OTHER_v1_S_me.xlsx", 0, "digest", False)
+        changed = uploads.SpooledUpload(self.upload.path, self.upload.name, 0, "other digest", False)
+        keys = {result_cache.upload_key(upload) for upload in (self.upload, renamed, changed)}
+        self.assertEqual(len(keys), 3)
+
+    def test_only_the_entity_checks_run_again_after_a_masterdata_change(self):
+        entity_issues = [Issue("error", "entity", "entity.missing")]
+        with mock.patch("myapp.utils.content_checker", wraps=utils.content_checker) as content, \
+                mock.patch("myapp.utils.entity_checker", return_value=entity_issues) as entity:
+            first = result_cache.check(self.upload, None, SimpleNamespace(version="v1"))
+            self.assertEqual(result_cache.check(self.upload, None, SimpleNamespace(version="v1")), first)
+            self.assertEqual((content.call_count, entity.call_count), (1, 1))
+            self.assertEqual(result_cache.check(self.upload, None, SimpleNamespace(version="v2")), first)
+            self.assertEqual((content.call_count, entity.call_count), (1, 2))
+        self.assertEqual(first[1], "TYPE")
+        self.assertEqual(first[3], entity_issues)
+        self.assertEqual(self.cache.stats()["stale"], 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for key in ("a", "b", "a", "c"):
+            if self.cache.get(key) is None:
+                self.cache.put(key, ([], "TYPE", True), [], "v1", [])
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_disabled_cache_keeps_nothing(self):
+        cache = result_cache.ResultCache(0)
+        cache.put("a", ([], "TYPE", True), [], "v1", [])
+        self.assertIsNone(cache.get("a"))
+
+
+class InvalidateMasterdataTests(SimpleTestCase):
+
+    def setUp(self):
+        masterdata.invalidate()
+        self.o = FakeConnection({})
+        self.o.url = pool.url
+        masterdata.snapshot(self.o)
+
+    def request(self, method="post", username="someone", staff=False, csrf_checked=False):
+        request = getattr(RequestFactory(), method)("/masterdata/invalidate/")
+        request.session = {"openbis_username": username}
+        request.user = SimpleNamespace(is_staff=staff)
+        request._dont_enforce_csrf_checks = not csrf_checked
+        return views.invalidate_masterdata(request)
+
+    def cached(self):
+        return pool.url in masterdata.cache_stats()["instances"]
+
+    def test_get_is_not_allowed(self):
+        self.assertEqual(self.request("get").status_code, 405)
+        self.assertTrue(self.cached())
+
+    def test_other_users_cannot_invalidate(self):
+        self.assertEqual(self.request().status_code, 403)
+        self.assertTrue(self.cached())
+
+    @override_settings(MASTERDATA_ADMINS=("admin",))
+    def test_admins_and_staff_invalidate(self):
+        self.assertEqual(self.request(username="admin").status_code, 200)
+        self.assertFalse(self.cached())
+        masterdata.snapshot(self.o)
+        self.assertEqual(self.request(staff=True).status_code, 200)
+        self.assertFalse(self.cached())
+
+    @override_settings(MASTERDATA_ADMINS=("admin",))
+    def test_csrf_token_is_required(self):
+        self.assertEqual(self.request(username="admin", csrf_checked=True).status_code, 403)
+        self.assertTrue(self.cached())
+
+
+class JobQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(JOB_DB=os.path.join(self.directory, "jobs.sqlite3"), JOB_SPOOL_DIR=os.path.join(self.directory, "spool"))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # The queue is the table: the workers are not started here
+        self.real_wake = jobs.wake
+        patcher = mock.patch.object(jobs, "wake")
+        self.wake = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enqueue(self, name="object_type_TYPE_v1_S_me.xls"):
+        # Only the size of an .xls document is checked before it is parsed
+        return jobs.enqueue(SimpleUploadedFile(name, uploads.OLE2_SIGNATURE + b"not a workbook"), "me", "token", "encrypted")
+
+    def row(self, job_id):
+        with jobs._connect() as connection:
+            return dict(connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def test_queued_job_is_claimed_oldest_first(self):
+        first, second = self.enqueue(), self.enqueue()
+        self.assertEqual(self.wake.call_count, 2)
+        self.assertEqual(jobs.get_job(first)["status"], jobs.QUEUED)
+        self.assertNotIn("password", jobs.get_job(first))
+
+        job = jobs.claim()
+        self.assertEqual(job["id"], first)
+        self.assertEqual(self.row(first)["status"], jobs.RUNNING)
+        self.assertEqual(self.row(first)["owner"], os.getpid())
+        self.assertEqual(jobs.claim()["id"], second)
+        self.assertIsNone(jobs.claim())
+
+    def test_failed_job_forgets_the_credentials(self):
+        job_id = self.enqueue()
+        job = jobs.claim()
+        with mock.patch("myapp.openbis_pool.pool.get", side_effect=ValueError("login to openBIS failed")), \
+                self.assertLogs("myapp", level="ERROR"):
+            jobs.run_job(job, jobs.db_path())
+        row = self.row(job_id)
+        self.assertEqual(row["status"], jobs.FAILED)
+        self.assertIn("login to openBIS failed", row["error"])
+        self.assertIsNone(row["token"])
+        self.assertIsNone(row["password"])
+        self.assertFalse(os.path.exists(row["file_path"]))
+
+    def test_interrupted_job_is_queued_again(self):
+        job_id = self.enqueue()
+        jobs.claim()
+        with mock.patch.object(jobs, "_alive", return_value=False):
+            jobs.recover()
+            self.assertEqual(self.row(job_id)["status"], jobs.QUEUED)
+            for _ in range(jobs.MAX_ATTEMPTS - 1):
+                jobs.claim()
+                jobs.recover()
+        row = self.row(job_id)
+        self.assertEqual(row["status"], jobs.FAILED)
+        self.assertEqual(row["attempts"], jobs.MAX_ATTEMPTS)
+
+    def test_queue_is_bounded(self):
+        with override_settings(JOB_QUEUE_MAX=1):
+            self.enqueue()
+            with self.assertRaises(jobs.QueueFull):
+                self.enqueue()
+        self.assertEqual(os.listdir(jobs.spool_dir()), [os.path.basename(self.row(jobs.claim()["id"])["file_path"])])
+
+    def test_broken_pool_is_replaced(self):
+        broken, fresh = mock.Mock(), mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool("A process in the process pool was terminated abruptly")
+        with mock.patch.object(jobs, "_executor", broken), mock.patch.object(jobs, "process_pool", return_value=fresh), \
+                mock.patch.object(jobs, "recover") as recover, self.assertLogs("myapp", level="WARNING"):
+            self.real_wake()
+            self.assertIs(jobs._executor, fresh)
+        recover.assert_called_once_with()
+        fresh.submit.assert_called_once_with(jobs.work, jobs.db_path())
+
+    def test_pool_broken_while_working_is_discarded(self):
+        pool, future = mock.Mock(), Future()
+        pool.submit.return_value = future
+        with mock.patch.object(jobs, "_executor", pool):
+            self.real_wake()
+            self.assertIs(jobs._executor, pool)
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+            self.assertIsNone(jobs._executor)
+
+    def test_failed_wake_keeps_the_job_queued(self):
+        self.wake.side_effect = OSError("no more processes")
+        with self.assertLogs("myapp", level="ERROR"):
+            job_id = self.enqueue()
+        self.assertEqual(self.row(job_id)["status"], jobs.QUEUED)
+
+    def test_older_table_gets_the_new_columns(self):
+        path = os.path.join(self.directory, "old.sqlite3")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, file_name TEXT, username TEXT, owner INTEGER,"
+                           " created REAL, started REAL, finished REAL, result TEXT, error TEXT)")
+        connection.close()
+        with jobs._connect(path) as connection:
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+        self.assertEqual(columns, {name for name, _ in jobs.COLUMNS})
+
+    def post(self, name, session):
+        request = RequestFactory().post("/jobs/", {"file": SimpleUploadedFile(name, uploads.OLE2_SIGNATURE + b"not a workbook")})
+        request.session = session
+        return views.submit_job(request)
+
+    def status(self, job_id, username):
+        request = RequestFactory().get(f"/jobs/{job_id}/")
+        request.session = {"openbis_username": username}
+        return views.job_status(request, job_id)
+
+    @override_settings(ROOT_URLCONF="excel_checker.urls")
+    def test_submitted_job_is_polled_until_it_fails(self):
+        session = {"openbis_username": "me", "openbis_token": "token", "openbis_password": "encrypted"}
+        self.assertEqual(self.post("object_type_TYPE_v1_S_me.xls", {}).status_code, 403)
+        self.assertEqual(self.post("object_type_TYPE_v1_S_me.csv", session).status_code, 400)
+
+        response = self.post("object_type_TYPE_v1_S_me.xls", session)
+        self.assertEqual(response.status_code, 202)
+        submitted = json.loads(response.content)
+        self.assertEqual(submitted["status_url"], f"/jobs/{submitted['job_id']}/")
+        self.assertEqual(self.status(submitted["job_id"], "other").status_code, 404)
+        self.assertEqual(json.loads(self.status(submitted["job_id"], "me").content)["status"], jobs.QUEUED)
+
+        with mock.patch("myapp.openbis_pool.pool.get", side_effect=ValueError("login to openBIS failed")), \
+                self.assertLogs("myapp", level="ERROR"):
+            jobs.run_job(jobs.claim(), jobs.db_path())
+        job = json.loads(self.status(submitted["job_id"], "me").content)
+        self.assertEqual(job["status"], jobs.FAILED)
+        self.assertIn("login to openBIS failed", job["error"])
+        self.assertNotIn("token", job)
+
+    @override_settings(UPLOAD_MAX_BYTES=8)
+    def test_oversized_job_is_rejected(self):
+        response = self.post("object_type_TYPE_v1_S_me.xls", {"openbis_username": "me", "openbis_password": "encrypted"})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(os.listdir(os.path.join(self.directory, "spool")), [])
+
+
+class UploadLimitsTests(SimpleTestCase):
+
+    def path(self, content, file_name):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, file_name)
+        with open(path, "wb") as workbook_file:
+            workbook_file.write(content)
+        return path
+
+    def test_renamed_zip_bomb_is_rejected(self):
+        bomb = zip_bytes({"xl/worksheets/sheet1.xml": b"0" * (4 * 2 ** 20)})
+        for file_name in ("object_type_TYPE_v1_S_me.xls", "object_type_TYPE_v1_S_me"):
+            with self.assertRaisesMessage(uploads.UploadRejected, "zip bomb"):
+                uploads.check_limits(self.path(bomb, file_name))
+
+    @override_settings(UPLOAD_MAX_ROWS=3)
+    def test_renamed_workbook_dimension_is_checked(self):
+        path = self.path(workbook_bytes(SAMPLE_ROWS), "object_type_TYPE_v1_S_me.xls")
+        with self.assertRaisesMessage(uploads.UploadRejected, "The sheet has 5 rows, the limit is 3."):
+            uploads.check_limits(path)
+
+    def test_xls_document_gets_only_the_size_check(self):
+        uploads.check_limits(self.path(uploads.OLE2_SIGNATURE + b"\0" * 512, "object_type_TYPE_v1_S_me.xlsx"))
+
+    def test_other_files_are_rejected(self):
+        with self.assertRaisesMessage(uploads.UploadRejected, "not a valid workbook"):
+            uploads.check_limits(self.path(b"Code,Description\n", "object_type_TYPE_v1_S_me.xlsx"))
+
+    @override_settings(UPLOAD_MAX_BYTES=1024)
+    def test_oversized_upload_is_rejected_before_it_is_written(self):
+        with mock.patch("myapp.uploads._write") as write, \
+                self.assertRaisesMessage(uploads.UploadRejected, "the limit is 1024 bytes"):
+            uploads.spool(SimpleUploadedFile("object_type_TYPE_v1_S_me.xlsx", workbook_bytes(SAMPLE_ROWS)))
+        write.assert_not_called()
+
+    @override_settings(UPLOAD_MAX_UNCOMPRESSED_BYTES=1024)
+    def test_workbook_unpacking_past_the_limit_is_rejected(self):
+        with self.assertRaisesMessage(uploads.UploadRejected, "The workbook unpacks to"):
+            uploads.check_limits(self.path(workbook_bytes(SAMPLE_ROWS), "object_type_TYPE_v1_S_me.xlsx"))
+
+    @override_settings(UPLOAD_MAX_COLUMNS=10)
+    def test_too_many_columns_are_rejected(self):
+        with self.assertRaisesMessage(uploads.UploadRejected, "The sheet has 11 columns, the limit is 10."):
+            uploads.check_limits(self.path(workbook_bytes(SAMPLE_ROWS), "object_type_TYPE_v1_S_me.xlsx"))
+
+    def test_spooled_upload_is_hashed_and_removed(self):
+        content = workbook_bytes(SAMPLE_ROWS)
+        with uploads.spool(SimpleUploadedFile("object_type_TYPE_v1_S_me.xlsx", content)) as upload:
+            self.assertEqual(upload.digest, hashlib.sha256(content).hexdigest())
+            self.assertEqual(upload.size, len(content))
+        self.assertFalse(os.path.exists(upload.path))
+
+
+class BatchUploadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.workbook = workbook_bytes(SAMPLE_ROWS)
+
+    def read(self, *uploaded_files):
+        files, skipped = batch.read_uploads(list(uploaded_files))
+        self.addCleanup(batch.close, files)
+        return files, dict(skipped)
+
+    def test_zip_members_are_spooled_and_checked(self):
+        members = {
+            "object_type_TYPE_v1_S_me.xlsx": self.workbook,
+            "bomb.xlsx": zip_bytes({"xl/worksheets/sheet1.xml": b"0" * (4 * 2 ** 20)}),
+            "notes.txt": b"not a workbook",
+        }
+        files, skipped = self.read(SimpleUploadedFile("batch.zip", zip_bytes(members)))
+        self.assertEqual([upload.name for upload in files], ["object_type_TYPE_v1_S_me.xlsx"])
+        with open(files[0].path, "rb") as spooled:
+            self.assertEqual(spooled.read(), self.workbook)
+        self.assertIn("zip bomb", skipped["bomb.xlsx"])
+        self.assertIn("Invalid file type", skipped["notes.txt"])
+
+    def test_zip_member_bomb_is_rejected_before_it_is_read(self):
+        bomb = zip_bytes({"object_type_TYPE_v1_S_me.xlsx": b"0" * (4 * 2 ** 20)})
+        with mock.patch("myapp.uploads._write") as write:
+            files, skipped = self.read(SimpleUploadedFile("batch.zip", bomb))
+        write.assert_not_called()
+        self.assertEqual(files, [])
+        self.assertIn("zip bomb", skipped["object_type_TYPE_v1_S_me.xlsx"])
+
+    @override_settings(UPLOAD_MAX_BYTES=1024)
+    def test_oversized_files_are_skipped(self):
+        files, skipped = self.read(SimpleUploadedFile("object_type_TYPE_v1_S_me.xlsx", self.workbook),
+                                   SimpleUploadedFile("batch.zip", zip_bytes({"dataset_type_DATA_v1_S_me.xlsx": self.workbook})))
+        self.assertEqual(files, [])
+        self.assertIn("the limit is 1024 bytes", skipped["object_type_TYPE_v1_S_me.xlsx"])
+        self.assertIn("the limit is 1024 bytes", skipped["dataset_type_DATA_v1_S_me.xlsx"])
+
+    @override_settings(BATCH_MAX_FILES=1)
+    def test_too_many_files_remove_the_spooled_ones(self):
+        with mock.patch.object(batch, "close", wraps=batch.close) as close:
+            with self.assertRaises(batch.BatchTooLarge):
+                batch.read_uploads([SimpleUploadedFile(f"object_type_TYPE_v{i}_S_me.xlsx", self.workbook) for i in range(2)])
+        spooled = close.call_args.args[0]
+        self.assertEqual(len(spooled), 1)
+        self.assertFalse(os.path.exists(spooled[0].path))
+
+    def test_workers_send_back_only_the_entity_columns(self):
+        files, _ = self.read(SimpleUploadedFile("object_type_TYPE_v1_S_me.xlsx", self.workbook))
+        workbook, _, code, name_ok, _ = batch.check_file(files[0].path, files[0].name)
+        self.assertEqual((code, name_ok), ("TYPE", True))
+        self.assertEqual(workbook.entity_value("Code"), "TYPE")
+        # Version and "Show in edit views" are not read by the entity checks
+        self.assertEqual(workbook.row(5), (None, "$NAME", "Name//Name", "FALSE", None, "General Information", "Name", "VARCHAR",
+                                           None, None, None))
+
+    def test_workers_stop_at_the_row_limit(self):
+        files, _ = self.read(SimpleUploadedFile("object_type_TYPE_v1_S_me.xlsx", self.workbook))
+        with override_settings(UPLOAD_MAX_ROWS=3), self.assertRaises(uploads.UploadRejected):
+            batch.check_file(files[0].path, files[0].name)
+
+    def test_broken_pool_is_replaced(self):
+        broken, fresh, future = mock.Mock(), mock.Mock(), Future()
+        broken.submit.side_effect = BrokenProcessPool("A process in the process pool was terminated abruptly")
+        fresh.submit.return_value = future
+        with mock.patch.object(batch, "_executor", broken), mock.patch.object(batch, "process_pool", return_value=fresh), \
+                self.assertLogs("myapp", level="WARNING"):
+            self.assertIs(batch.submit("upload.xlsx", "object_type_TYPE_v1_S_me.xlsx"), future)
+            self.assertIs(batch._executor, fresh)
+            # A worker of the new pool dies as well: the next batch gets another pool
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+            self.assertIsNone(batch._executor)
+        fresh.submit.assert_called_once_with(batch.check_file, "upload.xlsx", "object_type_TYPE_v1_S_me.xlsx")
+
+    @mock.patch.object(result_cache, "_cache", result_cache.ResultCache(0))
+    def test_entity_checks_start_when_their_own_file_is_parsed(self):
+        files = [uploads.SpooledUpload(f"{name}.xlsx", f"object_type_{name}_v1_S_me.xlsx", 1, name, False) for name in ("SLOW", "FAST")]
+        parsed = {upload.path: Future() for upload in files}
+        checked, fast_checked = [], threading.Event()
+
+        def entity_checker(workbook, o, lookups):
+            checked.append(workbook)
+            if workbook == "FAST":
+                fast_checked.set()
+            return []
+
+        with mock.patch.object(batch, "submit", side_effect=lambda path, file_name: parsed[path]), \
+                mock.patch("myapp.utils.entity_checker", side_effect=entity_checker), ThreadPoolExecutor(max_workers=1) as thread:
+            rows = thread.submit(batch.validate, files, FakeConnection({}))
+            parsed["FAST.xlsx"].set_result(("FAST", [], "FAST", True, []))
+            try:
+                # The slow file is still parsing
+                self.assertTrue(fast_checked.wait(5))
+            finally:
+                parsed["SLOW.xlsx"].set_result(("SLOW", [], "SLOW", True, []))
+            rows = rows.result(5)
+        self.assertEqual(checked, ["FAST", "SLOW"])
+        self.assertEqual([(row["code"], row["error"]) for row in rows], [("SLOW", ""), ("FAST", "")])
+
+
+class BatchViewTests(SimpleTestCase):
+
+    async def test_openbis_errors_are_reported_as_json(self):
+        request = RequestFactory().post("/batch/?format=json", {"files": [SimpleUploadedFile("object_type_TYPE_v1_S_me.xlsx", workbook_bytes(SAMPLE_ROWS))]})
+        request.session = SessionStore()
+        await request.session.aset("openbis_username", "me")
+        await request.session.aset("openbis_password", "encrypted")
+        with mock.patch.object(views, "get_openbis", side_effect=ValueError("login to openBIS failed")):
+            response = await views.batch_check(request)
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("login to openBIS failed", json.loads(response.content)["error"])
+
+
+# The sheet and the string report the checks returned before the structured results
+REPORT_ROWS = [("SAMPLE_TYPE",), ("Version", "Code", "Description", "Validation script", "Generated code prefix", "Auto generate codes"),
+               (2, "OTHER", "no translation", "bad script", "XYZ", "maybe"), PROPERTY_HEADERS] + PROPERTY_ROWS
+OLD_NAME_RESULT = "⦿ <strong>Invalid entity type</strong> at position 1.\n⦿ <strong>Invalid division</strong> at position 4."
+# The content messages were joined with "\n\n⦿ "
+OLD_CONTENT_RESULT = "\n\n⦿ ".join([
+    '<strong>Error</strong>: The version should be the same one indicated in the file name',
+    '⦿ <strong>Error</strong>: The code should be the same one indicated in the file name',
+    "<strong>Error</strong>: Description should follow the schema: English Description + '//' + German Description.",
+    "<strong>Error</strong>: Validation script should follow the schema: Words and/or numbers separated by '_' and ending in '.py'",
+    "<em>Warning</em>: It is recommended that the value of 'Generated code prefix' be the first three letters of each part of the 'Code' separated by dots ['.'].",
+    "<strong>Error</strong>: Value below 'Auto generate codes' should be 'TRUE' or 'FALSE'.",
+    "<strong>Error</strong>: Values not valid found in the 'Version' column (they should be Integers) at row(s): 6",
+    "<strong>Error</strong>: Invalid code found in the 'Code' column at row(s): 6",
+    "<strong>Error</strong>: The following properties are repeated: {'$$NAME'}. Please, delete the duplicates, and leave just one occurence",
+    "<strong>Error</strong>: Invalid value(s) found in the 'Description' column at row(s): 6. Description should follow the schema: English Description + '//' + German Description.",
+    "<strong>Error</strong>: Invalid value found in the 'Mandatory' column at row(s): 6. Accepted values: TRUE, FALSE",
+    "<strong>Error</strong>: Invalid value found in the 'Section' column at row(s): 8. Each word in the Section should start with a capital letter.",
+    "<strong>Error</strong>: Non-contiguous rows found for the same 'Section' value at row(s): 11. Ensure that all properties within the same Section are grouped together.",
+    "<strong>Error</strong> at row 11: 'General Information' should only appear at the beginning.",
+    "<strong>Error</strong> at row 13: User-defined section 'Own Section' cannot appear after 'Comments'.",
+    "<strong>Error</strong>: 'Notes' found in the 'Property label' column at row 11, but corresponding 'Section' column does not contain 'Additional Information'. Value found: General Information",
+    "<strong>Error</strong>: Invalid value found in the 'Data type' column at row(s): 8. Accepted types: INTEGER, REAL, VARCHAR, MULTILINE_VARCHAR, HYPERLINK, BOOLEAN, CONTROLLEDVOCABULARY, XML, TIMESTAMP, DATE, SAMPLE",
+    "<strong>Error</strong>: Invalid vocabulary code found in the 'Vocabulary code' column at row(s): 10",
+])
+
+
+class ReportTests(SimpleTestCase):
+
+    def setUp(self):
+        # Without revisions: no issue is marked as reused
+        patcher = mock.patch.object(revisions, "_store", revisions.RevisionStore(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.file_name = "thing_TYPE_v1_S!_me.xlsx"
+        result_name, code, name_ok = utils.name_checker(self.file_name)
+        result_content = utils.content_checker(utils.ParsedWorkbook(REPORT_ROWS, self.file_name), name_ok)
+        self.report = utils.build_report(self.file_name, code, result_name, result_content, [])
+
+    def old_messages(self):
+        name = [message.removeprefix("⦿ ") for message in OLD_NAME_RESULT.split("\n")]
+        content = [message.removeprefix("⦿ ") for message in OLD_CONTENT_RESULT.split("\n\n⦿ ")]
+        # Repeated codes are listed plainly instead of as a Python set
+        return name + [message.replace("{'$$NAME'}", "$$NAME") for message in content]
+
+    def test_messages_are_the_old_ones(self):
+        self.assertEqual([issue.html() for issue in self.report.issues], self.old_messages())
+
+    def test_rendered_report_lists_the_old_messages(self):
+        html = render_to_string("report.html", {"report": self.report})
+        messages = [f"<p>&#10687; {message}</p>" for message in self.old_messages()]
+        position = 0
+        # In the order of the old report: the name, content and entity sections with their messages
+        for expected in ["CHECKED NAME:", *messages[:2], "CHECKED CONTENT:", *messages[2:], "CHECKED ENTITY:"]:
+            self.assertIn(expected, html[position:])
+            position = html.index(expected, position) + len(expected)
+        self.assertNotIn("File content: OK!", html)
+
+    def test_report_as_dict(self):
+        data = json.loads(json.dumps(self.report.as_dict()))
+        self.assertEqual((data["file_name"], data["code"], data["passed"]), (self.file_name, "TYPE", False))
+        self.assertEqual(data["counts"], {"error": 19, "warning": 1, "info": 0})
+        self.assertEqual(data["total"], 20)
+        self.assertEqual([issue["message"] for issue in data["issues"]], [strip_tags(message) for message in self.old_messages()])
+        self.assertEqual(data["issues"][0], {"severity": "error", "check": "name", "key": "name.entity_type", "row": None, "column": None,
+                                              "params": {}, "reused": False, "message": "Invalid entity type at position 1."})
+        self.assertEqual(Report.from_dict(data).issues, self.report.issues)
+
+        page = self.report.as_dict(severity="error", check="content", offset=1, limit=2)
+        self.assertEqual(page["total"], 17)
+        self.assertEqual([issue["key"] for issue in page["issues"]], ["content.code_mismatch", "content.description_schema"])
+
+    def test_values_of_the_sheet_are_escaped(self):
+        issue = Issue("error", "content", "content.code_mismatch_value", row=3, column="Code", value="<script>alert(1)</script>")
+        self.assertIn("Value found: &lt;script&gt;alert(1)&lt;/script&gt;", issue.html())
+        self.assertIn("Value found: <script>alert(1)</script>", issue.text())
+
+
+@override_settings(ROOT_URLCONF="excel_checker.urls", SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+class AsyncViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.o = FakeConnection({})
+        self.o.token = "renewed"
+        patchers = [mock.patch.object(pool, "get", return_value=self.o),
+                    mock.patch.object(views, "entity_checker", return_value=[]),
+                    mock.patch.object(result_cache, "_cache", result_cache.ResultCache(0))]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = AsyncClient()
+        session = SessionStore()
+        session.update({"openbis_username": "me", "openbis_token": "token", "openbis_password": utils.encrypt_password("secret")})
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def upload(self):
+        return SimpleUploadedFile("object_type_TYPE_v1_S_me.xlsx", workbook_bytes(SAMPLE_ROWS))
+
+    def session(self):
+        return SessionStore(session_key=self.client.cookies[settings.SESSION_COOKIE_NAME].value).load()
+
+    async def test_check_api_answers_the_report(self):
+        response = await self.client.post("/api/check/?severity=error", {"file": self.upload()})
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report["file_name"], report["code"], report["passed"]), ("object_type_TYPE_v1_S_me.xlsx", "TYPE", True))
+
+        # The session is read for the pooled connection, the password only decrypted on a new login
+        username, token, password = pool.get.call_args.args
+        self.assertEqual((username, token, password()), ("me", "token", "secret"))
+        self.assertEqual(self.session()["openbis_token"], "renewed")
+
+    async def test_homepage_renders_the_report(self):
+        response = await self.client.post("/", {"upload": "1", "file": self.upload()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["code"], "TYPE")
+        self.assertContains(response, "<strong>File name: OK!</strong>")
+        self.assertContains(response, "File content: OK!")
+
+    async def test_views_need_a_login(self):
+        self.client.cookies.clear()
+        self.assertEqual((await self.client.post("/api/check/", {"file": self.upload()})).status_code, 403)
+        response = await self.client.get("/")
+        self.assertEqual((response.status_code, response.url), (302, "/login/"))
+        pool.get.assert_not_called()
+
+
+class CheckMasterdataCommandTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.output = os.path.join(self.directory, "results.json")
+        os.makedirs(os.path.join(self.directory, "sub"))
+        files = {
+            "object_type_TYPE_v1_S_me.xlsx": workbook_bytes(SAMPLE_ROWS),
+            os.path.join("sub", "object_type_OTHER_v1_S_me.xlsx"): workbook_bytes(SAMPLE_ROWS[:4] + [list(row) for row in PROPERTY_ROWS]),
+            "notes.txt": b"not a workbook",
+        }
+        for name, content in files.items():
+            with open(os.path.join(self.directory, name), "wb") as workbook_file:
+                workbook_file.write(content)
+
+    def check(self):
+        call_command("check_masterdata", self.directory, "--no-entity", "--workers", "1", "--output", self.output, stderr=io.StringIO())
+
+    def records(self):
+        with open(self.output, encoding="utf-8") as results:
+            return {record["file"]: record for record in map(json.loads, results)}
+
+    def test_failed_file_sets_the_exit_status(self):
+        with self.assertRaises(CommandError) as raised:
+            self.check()
+        self.assertEqual(raised.exception.returncode, 1)
+        records = self.records()
+        self.assertEqual(set(records), {"object_type_TYPE_v1_S_me.xlsx", os.path.join("sub", "object_type_OTHER_v1_S_me.xlsx")})
+        self.assertEqual(records["object_type_TYPE_v1_S_me.xlsx"]["status"], "passed")
+        other = records[os.path.join("sub", "object_type_OTHER_v1_S_me.xlsx")]
+        self.assertEqual(other["status"], "failed")
+        self.assertIn("rows.code", {issue["key"] for issue in other["issues"]})
+
+    def test_passing_files_exit_normally(self):
+        os.remove(os.path.join(self.directory, "sub", "object_type_OTHER_v1_S_me.xlsx"))
+        self.check()
+        self.assertEqual({file: record["status"] for file, record in self.records().items()},
+                         {"object_type_TYPE_v1_S_me.xlsx": "passed"})
+
+    def test_missing_directory_is_an_error(self):
+        with self.assertRaisesMessage(CommandError, "is not a directory"):
+            call_command("check_masterdata", os.path.join(self.directory, "missing"), "--no-entity")
+
+
+class FakeOpenbis:
+    # Sessions of a fake openBIS server: a login opens one, a connection built from a token needs an open one
+    sessions = set()
+    logins = 0
+
+    def __init__(self, url, token=None, use_cache=True):
+        if token is not None and token not in self.sessions:
+            raise ValueError("Session is no longer valid. Please log in again.")
+        self.token = token
+
+    def login(self, username, password):
+        if password != "secret":
+            raise ValueError("login to openBIS failed")
+        FakeOpenbis.logins += 1
+        self.token = f"{username}-{FakeOpenbis.logins}"
+        self.sessions.add(self.token)
+
+    def is_session_active(self):
+        return self.token in self.sessions
+
+
+class OpenbisPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        FakeOpenbis.sessions = set()
+        FakeOpenbis.logins = 0
+        patcher = mock.patch.object(openbis_pool, "Openbis", FakeOpenbis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = 1000.0
+        patcher = mock.patch.object(openbis_pool.time, "monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = openbis_pool.OpenbisPool("https://openbis.test", max_size=2, idle_timeout=900, check_interval=60)
+        self.password = mock.Mock(return_value="secret")
+
+    def test_connection_is_reused_by_the_next_requests(self):
+        o = self.pool.login("me", "secret")
+        self.assertIs(self.pool.get("me", o.token, self.password), o)
+        self.now += 59
+        self.assertIs(self.pool.get("me", o.token, self.password), o)
+        self.password.assert_not_called()
+        self.assertEqual(FakeOpenbis.logins, 1)
+
+    def test_token_of_another_process_is_reused_without_login(self):
+        FakeOpenbis.sessions.add("me-0")
+        o = self.pool.get("me", "me-0", self.password)
+        self.assertEqual(o.token, "me-0")
+        self.assertIs(self.pool.get("me", "me-0", self.password), o)
+        self.password.assert_not_called()
+
+    def test_expired_token_logs_in_again(self):
+        o = self.pool.login("me", "secret")
+        FakeOpenbis.sessions.clear()
+        # Trusted until the next check
+        self.assertIs(self.pool.get("me", o.token, self.password), o)
+        self.now += 60
+        with self.assertLogs("myapp", level="INFO"):
+            renewed = self.pool.get("me", o.token, self.password)
+        self.assertIsNot(renewed, o)
+        self.assertEqual(renewed.token, "me-2")
+        self.password.assert_called_once_with()
+        # Only the new session stays pooled
+        self.assertEqual(len(self.pool), 1)
+        self.assertIs(self.pool.get("me", "me-2", self.password), renewed)
+
+    def test_unknown_token_logs_in(self):
+        with self.assertLogs("myapp", level="INFO"):
+            o = self.pool.get("me", "forged", self.password)
+        self.assertEqual(o.token, "me-1")
+        self.assertEqual(len(self.pool), 1)
+
+    def test_idle_connections_are_evicted(self):
+        o = self.pool.login("me", "secret")
+        self.now += 900
+        other = self.pool.login("you", "secret")
+        self.assertEqual(len(self.pool), 1)
+        # The token is still open on the server: a new connection uses it without a login
+        again = self.pool.get("me", o.token, self.password)
+        self.assertIsNot(again, o)
+        self.assertEqual(again.token, o.token)
+        self.assertIs(self.pool.get("you", other.token, self.password), other)
+        self.password.assert_not_called()
+
+    def test_least_recently_used_connection_is_dropped(self):
+        first, second = self.pool.login("me", "secret"), self.pool.login("you", "secret")
+        self.pool.get("me", first.token, self.password)
+        self.pool.login("them", "secret")
+        self.assertEqual(len(self.pool), 2)
+        self.assertIs(self.pool.get("me", first.token, self.password), first)
+        self.assertIsNot(self.pool.get("you", second.token, self.password), second)
+
+
+class CsvDownloadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(INSTANCE_CSV_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.content = "INSTANCE,DATE\r\nhttps://openbis.test,01-01-2026\r\n" + "SPACE,\r\n" * 20000
+        self.handle = csv_storage.save_csv(self.content)
+
+    def download(self, handles):
+        request = RequestFactory().get("/download_csv/openbis.test/")
+        request.session = {"instance_csv": handles}
+        return views.download_csv(request, "openbis.test")
+
+    def test_csv_is_streamed_in_chunks(self):
+        response = self.download({"openbis.test": self.handle})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="openbis.test.csv"')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= csv_storage.CHUNK_SIZE for chunk in chunks))
+        self.assertEqual(b"".join(chunks).decode("utf-8"), self.content)
+
+    def test_forged_handles_are_refused(self):
+        outside = os.path.join(self.directory, os.pardir, "secret")
+        for handle in ("../secret", outside, self.handle + ".csv", self.handle.upper(), "", None):
+            self.assertIsNone(csv_storage.csv_path(handle))
+            self.assertEqual(self.download({"openbis.test": handle}).status_code, 404)
+
+    def test_handle_of_another_session_is_not_found(self):
+        # The handle only lives in the session of the user who generated the CSV
+        self.assertEqual(self.download({}).status_code, 404)
+        self.assertEqual(self.download({"other.test": self.handle}).status_code, 404)
+        # A well-formed handle without a file behind it
+        self.assertEqual(self.download({"openbis.test": "0" * 32}).status_code, 404)
+
+    def test_deleted_csv_is_not_found(self):
+        csv_storage.delete_csv(self.handle)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.download({"openbis.test": self.handle}).status_code, 404)
+
+
+class PropertySetIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        # 200 entity types of 20 properties out of 1000, and three around BASE
+        generator = random.Random(7)
+        self.sets = {f"TYPE_{i}": frozenset(f"P{n}" for n in generator.sample(range(1000), 20)) for i in range(200)}
+        self.base = frozenset(f"BASE_{n}" for n in range(20))
+        self.sets["SAME"] = self.base
+        self.sets["NEAR"] = self.base - {"BASE_0"} | {"OTHER_0"}
+        self.sets["HALF"] = frozenset(sorted(self.base)[:10]) | frozenset(f"OTHER_{n}" for n in range(10))
+        self.index = PropertySetIndex(self.sets)
+
+    def test_identical_set_is_found(self):
+        self.assertEqual(self.index.exact(sorted(self.base, reverse=True)), ["SAME"])
+        self.assertEqual(self.index.exact(self.base | {"MISSING"}), [])
+
+    def test_near_duplicate_is_found_above_the_threshold(self):
+        self.assertAlmostEqual(jaccard(self.base, self.sets["NEAR"]), 19 / 21)
+        self.assertEqual(self.index.similar(self.base), [("SAME", 1.0), ("NEAR", 19 / 21)])
+        self.assertEqual(self.index.similar(self.base, threshold=0.95), [("SAME", 1.0)])
+        self.assertEqual(self.index.similar(self.base, k=1), [("SAME", 1.0)])
+
+    def test_dissimilar_set_is_not_returned(self):
+        self.assertAlmostEqual(jaccard(self.base, self.sets["HALF"]), 1 / 3)
+        self.assertNotIn("HALF", dict(self.index.similar(self.base, threshold=0.5)))
+        self.assertEqual(self.index.similar(frozenset({"UNKNOWN"})), [])
+
+    def test_matches_agree_with_a_full_scan(self):
+        for code, properties in list(self.sets.items())[::20]:
+            expected = sorted(((other, jaccard(properties, candidate)) for other, candidate in self.sets.items()
+                               if jaccard(properties, candidate) >= 0.8), key=lambda item: (-item[1], item[0]))
+            self.assertEqual(self.index.similar(properties, k=len(self.sets)), expected)
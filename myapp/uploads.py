@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Uploaded workbooks, spooled to disk once and checked against the size limits
+before they are parsed.
+
+spool writes the upload to a temporary file in chunks (hashing it on the way, for
+the result cache) and never holds the whole file in memory; an upload Django has
+already written to disk is used where it is. Before any workbook is loaded, the
+cheap guards reject:
+    files larger than UPLOAD_MAX_BYTES
+    workbooks that are not zip archives (.xlsx) nor OLE2 documents (.xls), or
+        whose zip directory announces more than UPLOAD_MAX_UNCOMPRESSED_BYTES, or
+        an entry compressed more than UPLOAD_MAX_COMPRESSION_RATIO times (zip bombs)
+    sheets whose declared dimension exceeds UPLOAD_MAX_ROWS or UPLOAD_MAX_COLUMNS
+The format is told by the first bytes of the file, as the reader backend is (see
+utils.reader_for), never by its name: anything but an OLE2 document is opened
+as a zip archive, so it gets the zip checks.
+Sheets that declare no dimension are stopped while they are read, at
+UPLOAD_MAX_ROWS rows (see ParsedWorkbook.load). The workbooks of a zip (batch
+checks) are spooled one by one with spool_entry, after the same checks of the
+sizes its zip directory declares for them.
+
+Every rejection raises UploadRejected with the reason, for the user.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import zipfile
+from django.conf import settings
+
+CHUNK_SIZE = 1024 * 1024
+
+# First bytes of the OLE2 documents legacy .xls workbooks are stored in
+OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# <dimension ref="A1:K1000"/> comes before the cell data of a sheet
+DIMENSION = re.compile(rb'<(?:\w+:)?dimension\s+ref="\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?"')
+SHEET_DATA = re.compile(rb'<(?:\w+:)?sheetData[\s/>]')
+HEAD_SIZE = 64 * 1024
+
+
+class UploadRejected(Exception):
+    pass
+
+
+def _limit(name, default):
+    return getattr(settings, name, default)
+
+
+def signature(file):
+    # First bytes of a workbook (path, or binary file object left at its position)
+    if hasattr(file, "read"):
+        position = file.tell()
+        head = file.read(len(OLE2_SIGNATURE))
+        file.seek(position)
+        return head
+    with open(file, "rb") as workbook_file:
+        return workbook_file.read(len(OLE2_SIGNATURE))
+
+
+def max_rows():
+    return _limit("UPLOAD_MAX_ROWS", 100000)
+
+
+def _size(count):
+    return f"{count} bytes" if count < 2 ** 20 else f"{count / 2 ** 20:.1f} MB"
+
+
+class SpooledUpload:
+    """
+    An upload on disk: path, name, size and sha256 digest. The temporary file is
+    removed by close (not the one Django owns).
+    """
+
+    def __init__(self, path, name, size, digest, owned):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.digest = digest
+        self.owned = owned
+
+    def close(self):
+        if self.owned and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def spool(uploaded_file):
+    """
+    Writes the upload to a temporary file (unless Django already has) and checks
+    it against the limits; returns a SpooledUpload, or raises UploadRejected.
+    """
+    max_bytes = _limit("UPLOAD_MAX_BYTES", 20 * 2 ** 20)
+    if uploaded_file.size is not None and uploaded_file.size > max_bytes:
+        raise UploadRejected(f"The file is {_size(uploaded_file.size)}, the limit is {_size(max_bytes)}.")
+
+    if hasattr(uploaded_file, "temporary_file_path"):
+        path, owned = uploaded_file.temporary_file_path(), False
+        digest = hashlib.sha256()
+        for chunk in uploaded_file.chunks(CHUNK_SIZE):
+            digest.update(chunk)
+        digest = digest.hexdigest()
+    else:
+        path, owned = _temporary_path(uploaded_file.name), True
+        digest = save(uploaded_file, path)
+
+    return _checked(SpooledUpload(path, uploaded_file.name, os.path.getsize(path), digest, owned))
+
+
+def spool_entry(archive, entry, file_name):
+    """
+    Writes a workbook of a zip archive (zipfile.ZipInfo entry) to a temporary file
+    and checks it like an upload; returns a SpooledUpload, or raises UploadRejected.
+    The sizes its zip directory declares are checked before anything is read.
+    """
+    max_bytes = _limit("UPLOAD_MAX_BYTES", 20 * 2 ** 20)
+    if entry.file_size > max_bytes:
+        raise UploadRejected(f"The file is {_size(entry.file_size)}, the limit is {_size(max_bytes)}.")
+    _check_ratio(entry)
+
+    path = _temporary_path(file_name)
+    try:
+        with archive.open(entry) as member:
+            digest = _write(iter(lambda: member.read(CHUNK_SIZE), b""), path)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return _checked(SpooledUpload(path, file_name, os.path.getsize(path), digest, True))
+
+
+def _temporary_path(file_name):
+    spool_dir = _limit("UPLOAD_SPOOL_DIR", None)
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+    handle, path = tempfile.mkstemp(suffix=os.path.splitext(file_name)[1], dir=spool_dir)
+    os.close(handle)
+    return path
+
+
+def _checked(upload):
+    # The upload, once checked against the limits; removed when it is rejected
+    try:
+        check_limits(upload.path)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+def save(uploaded_file, path):
+    # Writes the upload to path in chunks, up to UPLOAD_MAX_BYTES; returns its sha256 digest
+    return _write(uploaded_file.chunks(CHUNK_SIZE), path)
+
+
+def _write(chunks, path):
+    max_bytes = _limit("UPLOAD_MAX_BYTES", 20 * 2 ** 20)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as spooled:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"The file is larger than the limit of {_size(max_bytes)}.")
+                digest.update(chunk)
+                spooled.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return digest.hexdigest()
+
+
+def check_limits(path):
+    # Size of the file, and unless it is an .xls (OLE2) document its zip directory and declared sheet dimensions
+    max_bytes = _limit("UPLOAD_MAX_BYTES", 20 * 2 ** 20)
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        raise UploadRejected(f"The file is {_size(size)}, the limit is {_size(max_bytes)}.")
+    if signature(path) == OLE2_SIGNATURE:
+        return
+
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise UploadRejected("The file is not a valid workbook (neither an .xlsx zip archive nor an .xls document).") from None
+    with archive:
+        entries = archive.infolist()
+        max_uncompressed = _limit("UPLOAD_MAX_UNCOMPRESSED_BYTES", 200 * 2 ** 20)
+        uncompressed = sum(entry.file_size for entry in entries)
+        if uncompressed > max_uncompressed:
+            raise UploadRejected(f"The workbook unpacks to {_size(uncompressed)}, the limit is {_size(max_uncompressed)}.")
+        for entry in entries:
+            _check_ratio(entry)
+        for entry in entries:
+            if entry.filename.startswith("xl/worksheets/") and entry.filename.endswith(".xml"):
+                _check_dimension(archive, entry)
+
+
+def _check_ratio(entry):
+    # Large entries compressed far more than any workbook are zip bombs
+    max_ratio = _limit("UPLOAD_MAX_COMPRESSION_RATIO", 100)
+    if entry.file_size > 1024 * 1024 and entry.file_size > max_ratio * max(entry.compress_size, 1):
+        raise UploadRejected(f"{entry.filename} is compressed {entry.file_size // max(entry.compress_size, 1)} times, "
+                             f"more than the limit of {max_ratio} (zip bomb?).")
+
+
+def _check_dimension(archive, entry):
+    # Only the beginning of the sheet is read, up to its cell data
+    with archive.open(entry) as sheet:
+        head = sheet.read(HEAD_SIZE)
+    data = SHEET_DATA.search(head)
+    match = DIMENSION.search(head, 0, data.start() if data else len(head))
+    if match is None:
+        return
+    last_column, last_row = (match.group(3), match.group(4)) if match.group(3) else (match.group(1), match.group(2))
+    rows, columns = int(last_row), _column_number(last_column)
+    if rows > max_rows():
+        raise UploadRejected(f"The sheet has {rows} rows, the limit is {max_rows()}.")
+    max_columns = _limit("UPLOAD_MAX_COLUMNS", 200)
+    if columns > max_columns:
+        raise UploadRejected(f"The sheet has {columns} columns, the limit is {max_columns}.")
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters.decode():
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
@@ -6,14 +6,31 @@ Created on Thu Oct 10
 """
 
 import re
+import itertools
 import openpyxl
 import logging
 import csv
 import io
 import base64
+import zipfile
 from datetime import datetime
+from functools import cached_property, partial
 from cryptography.fernet import Fernet, InvalidToken
 from django.conf import settings
+from myapp import masterdata, metrics, revisions, rules
+from myapp.uploads import OLE2_SIGNATURE, UploadRejected, signature
+from myapp.results import Issue, Report, ERROR, WARNING, INFO
+from myapp.rules import PROPERTY_RULES, VOCABULARY_TERM_RULES, PROPERTY_TYPE_RULES, DESCRIPTION_PATTERN, VALIDATION_SCRIPT_PATTERN, fingerprint
+
+try:
+    import xlrd
+except ImportError:  # only needed for the legacy .xls files
+    xlrd = None
+
+try:
+    import python_calamine
+except ImportError:  # the native reader is optional
+    python_calamine = None
 
 logger = logging.getLogger('myapp')
 
@@ -50,8 +67,8 @@ def name_checker(file_name):
     file_name = file_name.split(".xls")
     file_parts = file_name[0].split("_")
     if len(file_parts) < 5:
-        errors.append("⦿ <strong>Invalid name format</strong>. The name should contain different fields separated by underscores (_). Consult the wiki to see which ones.")
-        return ["\n".join(errors), file_name, False]
+        errors.append(Issue(ERROR, "name", "name.format"))
+        return [errors, file_name, False]
     creator = file_parts.pop(-1)
     section = file_parts.pop(-1)
     version = file_parts.pop(-1)
@@ -64,20 +81,20 @@ def name_checker(file_name):
         # Extract parts of the file name
         entity_type, entity_name, version, division, contact_person, extension = match.groups()
         print(entity_type, entity_name, version, division, contact_person, extension)
-        return ["⦿ <strong>File name: OK!</strong>", code, True]
+        return [errors, code, True]
     else:   
         if not re.match(r"^(collection_type|object_type|dataset_type|vocabulary)$", etype):
-            errors.append("⦿ <strong>Invalid entity type</strong> at position 1.")
+            errors.append(Issue(ERROR, "name", "name.entity_type"))
         if not re.match(r"^([\w.]+)$", code):
-            errors.append("⦿ <strong>Invalid entity name</strong> at position 2.")
+            errors.append(Issue(ERROR, "name", "name.entity_name"))
         if not re.match(r"^(v\d+)$", version):
-            errors.append("⦿ <strong>Invalid version</strong> at position 3.")
+            errors.append(Issue(ERROR, "name", "name.version"))
         if not re.match(r"^([a-zA-Z0-9]+(?:\.[0-9]+)?)$", section):
-            errors.append("⦿ <strong>Invalid division</strong> at position 4.")
+            errors.append(Issue(ERROR, "name", "name.division"))
         if not re.match(r"^[a-zA-Z0-9]+$", creator):
-            errors.append("⦿ <strong>Invalid contact person</strong> at position 5.")
+            errors.append(Issue(ERROR, "name", "name.contact_person"))
             
-        return ["\n".join(errors), code, False]
+        return [errors, code, False]
     
 
 def index_to_excel_column(index):
@@ -88,302 +105,296 @@ def index_to_excel_column(index):
     return column
 
 
-def check_properties(sheet, errors):
-    expected_terms = [
-        "Version",
-        "Code",
-        "Description",
-        "Mandatory",
-        "Show in edit views",
-        "Section",
-        "Property label",
-        "Data type",
-        "Vocabulary code"
-    ]
-    row_headers = [cell.value for cell in sheet[4]]
-    for term in expected_terms:
-        if (term not in row_headers):
-            if term in ("Mandatory","Show in edit views","Section"):
-                errors.append(f"⦿ <em>Warning</em>: '{term}' not found in the properties headers.")
-            else:
-                errors.append(f"⦿ <strong>Error</strong>: '{term}' not found in the properties headers.")
-        else:
-             # Find the index of the term in the second row
-             term_index = row_headers.index(term) + 1
-             term_letter = index_to_excel_column(term_index)
-             #print(term_index)
-             
-             # Check the column below "Version"
-             if term == "Version":
-                 column_below_version = []
-                 for cell in sheet[term_letter][4:]:
-                     if cell.value is not None:
-                         column_below_version.append(cell.value)
-                     else:
-                         pass
-
-                 # Check if any value in the column is not an integer
-                 non_integer_indices = [i + 5 for i, cell in enumerate(column_below_version) if not (str(cell).isnumeric() or "$" in str(cell))]
-                 if non_integer_indices:
-                     # Append an error indicating the positions (row numbers) that are not integers
-                     errors.append(f"<strong>Error</strong>: Values not valid found in the 'Version' column (they should be Integers) at row(s): {', '.join(map(str, non_integer_indices))}")
-
-            # Check the column below "Code"
-             elif term == "Code":
-                column_below_code = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_code.append(cell.value)
-                    else:
-                        pass
-                invalid_codes = [i + 5 for i, cell in enumerate(column_below_code) if not (re.match(r'^\$?[A-Z0-9_.]+$', str(cell)) or "$" in str(cell))]
-                if invalid_codes:
-                    # Append an error indicating the positions (row numbers) with invalid values for the current term
-                    errors.append(f"<strong>Error</strong>: Invalid code found in the '{term}' column at row(s): {', '.join(map(str, invalid_codes))}")
-                    
-                #check that all the properties of the object are different using a set (unique terms):
-                if len(set(column_below_code)) != len(column_below_code):
-                    seen_props = set()
-                    repeated_props = set()
-                    for prop in column_below_code:
-                        if prop in seen_props:
-                            repeated_props.add(prop)
-                        else:
-                            seen_props.add(prop)
-                    errors.append(f"<strong>Error</strong>: The following properties are repeated: {repeated_props}. Please, delete the duplicates, and leave just one occurence")
+def header_index(headers):
+    # Map every header to its 0-based position, keeping the first occurrence like list.index()
+    positions = {}
+    for i, header in enumerate(headers):
+        positions.setdefault(header, i)
+    return positions
 
-            
-            
-            # Check the cell below "Description"
-             elif term == "Description":
-                column_below_description = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_description.append(cell.value)
-                    else:
-                        pass
-                invalid_indices = [i + 5 for i, cell in enumerate(column_below_description) if not (re.match(r'.*//.*', str(cell)) or "$" in str(cell))]
-                if invalid_indices:
-                    errors.append(f"<strong>Error</strong>: Invalid value(s) found in the '{term}' column at row(s): {', '.join(map(str, invalid_indices))}. Description should follow the schema: English Description + '//' + German Description.")
-
-            # Check the cell below "Mandatory"
-             elif term == "Mandatory":
-                column_below_mandatory = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_mandatory.append(str(cell.value).upper())
-                    else:
-                        pass
-                invalid_mandatory = [i + 5 for i, cell in enumerate(column_below_mandatory) if (cell not in ["TRUE", "FALSE"] and "$" not in str(cell))]
-                if invalid_mandatory:
-                    errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(map(str, invalid_mandatory))}. Accepted values: TRUE, FALSE")
-
-            # Check the cell below "Show in edit views"
-             elif term == "Show in edit views":
-                column_below_show = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_show.append(str(cell.value).upper())
-                    else:
-                        pass
-                invalid_show = [i + 5 for i, cell in enumerate(column_below_show) if (cell not in ["TRUE", "FALSE"] and "$" not in str(cell))]
-                if invalid_show:
-                    errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(map(str, invalid_show))}. Accepted values: TRUE, FALSE")
-
-            # Check the cell below "Section"
-             elif term == "Section":
-                column_below_section = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_section.append(cell.value) if '$' not in cell.value else column_below_section.append(cell.value.replace('$', ''))
-                    else:
-                        pass
-                    
-                invalid_section = [i + 5 for i, cell in enumerate(column_below_section) if not (re.match(r'^[A-Z][A-Za-z]*(?:\s[A-Z][A-Za-z]*)*$', str(cell)) or "$" in str(cell))]
-                if invalid_section:
-                    errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(map(str, invalid_section))}. Each word in the Section should start with a capital letter.")
-            
-                # Group Check: Ensure all properties within the same section are grouped together
-                seen_sections = {}
-                non_contiguous_rows = []
-                
-                for i, current_value in enumerate(column_below_section):
-                    if current_value in seen_sections:
-                        # If the value has been seen before but the row is not contiguous, add an error
-                        if seen_sections[current_value] != i - 1:
-                            non_contiguous_rows.append(i + 5)
-                    seen_sections[current_value] = i  # Update the last seen row index for the current value
-                
-                if non_contiguous_rows:
-                    errors.append(f"<strong>Error</strong>: Non-contiguous rows found for the same 'Section' value at row(s): {', '.join(map(str, non_contiguous_rows))}. Ensure that all properties within the same Section are grouped together.")
-            
-                # Predefined section order (fixed order)
-                predefined_section_order = ["General Information", "Additional Information", "Comments"]
-            
-                # Validate contiguous groups and predefined section order
-                seen_sections = set()
-                previous_section_type = None
-                section_errors = []  # Store section-specific errors
-                additional_info_seen = False  # Flag to track if "Additional Information" has been seen
-                comments_seen = False  # Flag to track if "Comments" has been seen
-            
-                # Traverse the section list
-                for i, section in enumerate(column_below_section):
-                    if section in predefined_section_order:
-                        if section == "General Information":
-                            if previous_section_type not in [None, "General Information"]:
-                                section_errors.append(f"<strong>Error</strong> at row {i + 5}: 'General Information' should only appear at the beginning.")
-                        elif section == "Additional Information":
-                            if previous_section_type not in ["General Information", "user-defined"]:
-                                section_errors.append(f"<strong>Error</strong> at row {i + 5}: 'Additional Information' should appear after 'General Information' and any user-defined sections.")
-                            additional_info_seen = True  # Mark that "Additional Information" has been encountered
-                        elif section == "Comments":
-                            if previous_section_type not in ["General Information", "user-defined", "Additional Information"]:
-                                section_errors.append(f"<strong>Error</strong> at row {i + 5}: 'Comments' should appear after 'Additional Information'.")
-                            comments_seen = True  # Mark that "Comments" has been encountered
-                        previous_section_type = section
-                    else:
-                        # User-defined section
-                        if comments_seen:
-                            section_errors.append(f"<strong>Error</strong> at row {i + 5}: User-defined section '{section}' cannot appear after 'Comments'.")
-                        if additional_info_seen and not comments_seen:
-                            section_errors.append(f"<strong>Error</strong> at row {i + 5}: User-defined section '{section}' cannot appear after 'Additional Information' but before 'Comments'.")
-                        previous_section_type = "user-defined"
-            
-                # Output any errors
-                if section_errors:
-                    for error in section_errors:
-                        errors.append(error)
-            
-            # Check the cell below "Property label"
-             elif term == "Property label":
-                column_below_label = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_label.append(cell.value)
-                    else:
-                        pass
-                invalid_label = [i + 5 for i, cell in enumerate(column_below_label) if not (re.match(r'.*', str(cell)) or "$" in str(cell))]
-                if invalid_label:
-                    errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(map(str, invalid_label))}. Specify the property label as text format")
-                    
-                # Dynamically find the "Section" column
-                if "Section" in row_headers:
-                    section_index = row_headers.index("Section") + 1
-                    section_letter = index_to_excel_column(section_index)
-                    column_below_section = [cell.value for cell in sheet[section_letter][4:]]
-
-                    # New check: "Notes" in "Property label" should correspond to "Additional Information" in "Section"
-                    for i, label_value in enumerate(column_below_label):
-                        if label_value == "Notes":
-                            section_value = column_below_section[i]
-                            if section_value != "Additional Information":
-                                errors.append(f"<strong>Error</strong>: 'Notes' found in the 'Property label' column at row {i + 5}, but corresponding 'Section' column does not contain 'Additional Information'. Value found: {section_value}")
-
-
-            # Check the cell below "Data type"
-             elif term == "Data type":
-                column_below_type = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_type.append(str(cell.value).upper())
-                    else:
-                        pass
-                invalid_type = [i + 5 for i, cell in enumerate(column_below_type) if (cell not in ["INTEGER", "REAL", "VARCHAR", "MULTILINE_VARCHAR", "HYPERLINK", "BOOLEAN", "CONTROLLEDVOCABULARY", "XML", "TIMESTAMP", "DATE", "SAMPLE"] and "$" not in str(cell))]
-                if invalid_type:
-                    errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(map(str, invalid_type))}. Accepted types: INTEGER, REAL, VARCHAR, MULTILINE_VARCHAR, HYPERLINK, BOOLEAN, CONTROLLEDVOCABULARY, XML, TIMESTAMP, DATE, SAMPLE")
-
-            # Check the column below "Vocabulary code"
-             elif term == "Vocabulary code":
-                column_below_vocab = sheet[term_letter][4:]
-                invalid_vocab = [i + 5 for i, cell in enumerate(column_below_vocab) if cell.value and not (re.match(r'^\$?[A-Z0-9_.]', str(cell.value)) or "$" not in str(cell))]
-                if invalid_vocab:
-                    # Append an error indicating the positions (row numbers) with invalid values for the current term
-                    errors.append(f"<strong>Error</strong>: Invalid vocabulary code found in the '{term}' column at row(s): {', '.join(map(str, invalid_vocab))}")
-    
-    return errors
 
-def check_vocab_terms(sheet, errors):
-    expected_terms = [
-        "Version",
-        "Code",
-        "Label"
-        "Description"
-    ]
-    row_headers = [cell.value for cell in sheet[4]]
-    for term in expected_terms:
-        if term not in row_headers:
-            errors.append(f"<strong>Error</strong>: '{term}' not found in the vocabulary term headers.")
-        else:
-             # Find the index of the term in the second row
-             term_index = row_headers.index(term) + 1
-             term_letter = index_to_excel_column(term_index)
-             #print(term_index)
-             
-             # Check the column below "Version"
-             if term == "Version":
-                 column_below_version = []
-                 for cell in sheet[term_letter][4:]:
-                     if cell.value is not None:
-                         column_below_version.append(cell.value)
-                     else:
-                         pass
-
-                 # Check if any value in the column is not an integer
-                 non_integer_indices = [i + 5 for i, cell in enumerate(column_below_version) if not str(cell).isnumeric()]
-                 if non_integer_indices:
-                     # Append an error indicating the positions (row numbers) that are not integers
-                     errors.append(f"<strong>Error</strong>: Values not valid found in the 'Version' column (they should be Integers) at row(s): {', '.join(map(str, non_integer_indices))}")
-
-            # Check the column below "Code"
-             elif term == "Code":
-                column_below_code = []
-                for cell in sheet[term_letter][4:]:
-                    if cell.value is not None:
-                        column_below_code.append(cell.value)
-                    else:
-                        pass
-                invalid_codes = [i + 5 for i, cell in enumerate(column_below_code) if not re.match(r'^\$?[A-Z0-9_.]+$', str(cell))]
-                if invalid_codes:
-                    # Append an error indicating the positions (row numbers) with invalid values for the current term
-                    errors.append(f"<strong>Error</strong>: Invalid code found in the '{term}' column at row(s): {', '.join(map(str, invalid_codes))}")
-                
-                #check that all the properties of the object are different using a set (unique terms):
-                if len(set(column_below_code)) != len(column_below_code):
-                    seen_terms = set()
-                    repeated_terms = set()
-                    for term in column_below_code:
-                        if term in seen_terms:
-                            repeated_terms.add(term)
-                        else:
-                            seen_terms.add(term)
-                    errors.append(f"<strong>Error</strong>: The following vocabulary terms are repeated: {repeated_terms}. Please, delete the duplicates, and leave just one occurence")
+def read_workbook_rows(file, reader=None):
+    # Stream the values of the active sheet row by row (tuples, None for empty cells),
+    # with the reader backend for the file (see READERS and reader_for)
+    yield from READERS[reader or reader_for(file)](file)
 
-            
-            
-            # Check the cell below "Description"
-             elif term == "Description":
-                column_below_description = sheet[term_letter][4:]
-                invalid_description = [i + 5 for i, cell in enumerate(column_below_description) if cell.value and not re.match(r'.*//.*', str(cell.value))]
-                if invalid_description:
-                    errors.append(f"<strong>Error</strong>: Invalid value(s) found in the '{term}' column at row(s): {', '.join(map(str, invalid_description))}. Description should follow the schema: English Description + '//' + German Description.")
-
-            # Check the cell below "Mandatory"
-             elif term == "Label":
-                column_below_label = sheet[term_letter][4:]
-                invalid_label = [i + 5 for i, cell in enumerate(column_below_label) if cell.value and not re.match(r'.*', str(cell.value))]
-                if invalid_label:
-                    errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(map(str, invalid_label))}. Specify the label as text format")
-            
-    return "\n".join(errors)
 
-def content_checker(file_name, name_ok):
-    logger.info(f"Type {type(file_name)} of file {file_name}")
-    workbook = openpyxl.load_workbook(file_name)
+def openpyxl_rows(file):
+    # .xlsx with openpyxl's read-only mode
+    workbook = openpyxl.load_workbook(file, read_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _number(value):
+    # Numbers are floats in .xls files and for calamine: whole ones are ints, as openpyxl reads them
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def xlrd_rows(file):
+    # Legacy .xls (BIFF) files with xlrd; the active sheet is the first selected one
+    if isinstance(file, (str, bytes)) or hasattr(file, "__fspath__"):
+        workbook = xlrd.open_workbook(file, on_demand=True)
+    else:
+        workbook = xlrd.open_workbook(file_contents=file.read(), on_demand=True)
+    try:
+        sheets = [workbook.sheet_by_index(i) for i in range(workbook.nsheets)]
+        sheet = next((sheet for sheet in sheets if sheet.sheet_selected), sheets[0])
+        for i in range(sheet.nrows):
+            values = []
+            for cell in sheet.row(i):
+                if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                    values.append(None)
+                elif cell.ctype == xlrd.XL_CELL_NUMBER:
+                    values.append(_number(cell.value))
+                elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                    values.append(bool(cell.value))
+                elif cell.ctype == xlrd.XL_CELL_DATE:
+                    values.append(xlrd.xldate_as_datetime(cell.value, workbook.datemode))
+                elif cell.ctype == xlrd.XL_CELL_ERROR:
+                    values.append(xlrd.error_text_from_code.get(cell.value))
+                else:
+                    values.append(cell.value)
+            yield tuple(values)
+    finally:
+        workbook.release_resources()
+
+
+def _active_sheet(file):
+    # Index of the active sheet of an .xlsx workbook (activeTab of its first view), as openpyxl finds it
+    try:
+        with zipfile.ZipFile(file) as archive:
+            match = re.search(rb'<(?:\w+:)?workbookView\b[^>]*\bactiveTab="(\d+)"', archive.read("xl/workbook.xml"))
+    except (KeyError, zipfile.BadZipFile):
+        return 0
+    finally:
+        if hasattr(file, "seek"):
+            file.seek(0)
+    return int(match.group(1)) if match else 0
+
+
+def calamine_rows(file):
+    # .xlsx (and .xls) with the native calamine reader, when python-calamine is installed
+    active = _active_sheet(file)
+    if isinstance(file, (str, bytes)) or hasattr(file, "__fspath__"):
+        workbook = python_calamine.CalamineWorkbook.from_path(file)
+    else:
+        workbook = python_calamine.CalamineWorkbook.from_filelike(file)
+    try:
+        sheet = workbook.get_sheet_by_index(active if active < len(workbook.sheet_names) else 0)
+        for row in sheet.iter_rows():
+            yield tuple(None if value == "" else _number(value) for value in row)
+    finally:
+        workbook.close()
+
+
+READERS = {
+    "openpyxl": openpyxl_rows,
+    "xlrd": xlrd_rows,
+    "calamine": calamine_rows,
+}
+
+def reader_for(file):
+    """
+    Reader backend for a workbook (path or binary file object): .xls files
+    (recognized by their content, not their name) with xlrd, and .xlsx files with
+    CHECKER_READER: "openpyxl", "calamine", or "auto" (calamine when installed).
+    """
+    if signature(file) == OLE2_SIGNATURE:
+        if xlrd is not None:
+            return "xlrd"
+        if python_calamine is not None:
+            return "calamine"
+        raise ValueError("Reading .xls files needs xlrd (pip install xlrd), or save the workbook as .xlsx.")
+
+    backend = getattr(settings, "CHECKER_READER", "auto")
+    if backend == "auto":
+        return "calamine" if python_calamine is not None else "openpyxl"
+    return backend
+
+
+def placeholder_row(row):
+    # Rows containing a "$" placeholder get every filled cell prefixed with "$"
+    if any("$" in str(cell) for cell in row):
+        return tuple("$" + str(cell) if cell is not None else None for cell in row)
+    return row
+
+
+class ParsedWorkbook:
+    """
+    Values of the active sheet of an uploaded workbook. The file is parsed once
+    per upload and the same object is shared by all the checkers.
+
+    Layout of a masterdata sheet:
+        row 1: entity type (cell A1)
+        row 2: entity headers, row 3: entity values
+        row 4: property headers, row 5 onward: property rows
+
+    With placeholders=True the "$" placeholder rows are prefixed when they are
+    read, so the content checks see them without copying or mutating the rows.
+
+    The values of every row are kept (tuples, no cell objects), so the memory
+    grows with the size of the sheet, bounded by UPLOAD_MAX_ROWS and
+    UPLOAD_MAX_COLUMNS (see uploads). It is used where the entity checks run:
+    they read the property rows several times each, and reading the file again
+    for every pass costs more than keeping it. The content checks alone stream
+    the rows instead, see stream_content_checker.
+    """
+
+    def __init__(self, rows, file_name="", placeholders=False):
+        self.file_name = file_name
+        self.rows = rows if isinstance(rows, list) else [tuple(row) for row in rows]
+        self.placeholders = placeholders
+        self.max_row = len(self.rows)
+        self.max_column = max((len(row) for row in self.rows), default=0)
+
+        self.entity_type = self.cell(1, 1)
+        self.entity_headers = self.row(2)
+        self.entity_values = self.row(3)
+        self.property_headers = self.row(4)
+
+        self.entity_index = header_index(self.entity_headers)
+        self.property_index = header_index(self.property_headers)
+
+    @classmethod
+    def load(cls, file, file_name=None, max_rows=None):
+        # file_name: name of the upload, when the file has been stored under another name
+        # max_rows: reading stops with UploadRejected past this many rows
+        reader = read_workbook_rows(file)
+        try:
+            rows = list(reader if max_rows is None else itertools.islice(reader, max_rows + 1))
+        finally:
+            reader.close()
+        if max_rows is not None and len(rows) > max_rows:
+            raise UploadRejected(f"The sheet has more than {max_rows} rows, the limit is {max_rows}.")
+        return cls(rows, file_name or getattr(file, "name", str(file)))
+
+    @property
+    def property_rows(self):
+        # Rows 5 onward, produced lazily on every iteration
+        return self.rows_from(5)
+
+    def rows_from(self, min_row):
+        return (self.row(i) for i in range(min_row, self.max_row + 1))
+
+    def row(self, row):
+        # 1-based like openpyxl; rows beyond the sheet are returned empty
+        values = self.rows[row - 1] if 0 < row <= self.max_row else ()
+        if self.placeholders:
+            values = placeholder_row(values)
+        if len(values) < self.max_column:
+            values += (None,) * (self.max_column - len(values))
+        return values
+
+    def cell(self, row, column):
+        # Read from the stored row: the row is not padded (or prefixed) for a single value
+        if not (0 < row <= self.max_row and 0 < column <= self.max_column):
+            return None
+        values = self.rows[row - 1]
+        value = values[column - 1] if column <= len(values) else None
+        if self.placeholders and value is not None and row in self.placeholder_rows:
+            value = "$" + str(value)
+        return value
+
+    def column(self, column, min_row=5):
+        # All the values of a 1-based column, from min_row to the last row (one lookup per row)
+        return [self.cell(row, column) for row in range(min_row, self.max_row + 1)]
+
+    @cached_property
+    def placeholder_rows(self):
+        # 1-based numbers of the rows containing a "$" placeholder, found once
+        return frozenset(i for i, values in enumerate(self.rows, 1) if any("$" in str(cell) for cell in values))
+
+    def entity_value(self, term):
+        # Value in row 3 below an entity header
+        if term not in self.entity_index:
+            return None
+        return self.entity_values[self.entity_index[term]]
+
+    def with_placeholders(self):
+        # View over the same rows with the "$" placeholder rows prefixed on access
+        return ParsedWorkbook(self.rows, self.file_name, placeholders=True)
+
+    def projected(self, columns):
+        # Copy with rows 1 to 4, and only the values of the given 1-based columns below them
+        # (the other cells are empty, every value keeps its position)
+        kept = sorted(column - 1 for column in columns if column > 0)
+        rows = self.rows[:4]
+        for values in self.rows[4:]:
+            row = [None] * min(len(values), kept[-1] + 1 if kept else 0)
+            for i in kept:
+                if i < len(row):
+                    row[i] = values[i]
+            rows.append(tuple(row))
+        return ParsedWorkbook(rows, self.file_name, self.placeholders)
+
+
+def rule_backend(workbook):
+    # Vectorized rules pay off only on large sheets, and need pandas
+    backend = getattr(settings, "CHECKER_RULE_BACKEND", "auto")
+    if backend == "auto":
+        min_rows = getattr(settings, "CHECKER_COLUMNAR_MIN_ROWS", 10000)
+        return "columnar" if rules.pd is not None and workbook.max_row >= min_rows else "python"
+    return backend
+
+def build_report(file_name, code, result_name, result_content, result_entity):
+    # Issues of the name, content and entity checks of an upload, formatted only when displayed
+    return Report(file_name, code, result_name + result_content + result_entity)
+
+
+def revision_key(workbook):
+    # Entity type and code of the sheet: the revisions of a workbook share them (see revisions.py)
+    code = workbook.entity_value("Code")
+    return (workbook.entity_type, code) if code is not None else None
+
+def run_property_rules(rule_set, workbook, rows=None):
+    # Rows already checked in the last revision of the entity type are not checked again.
+    # rows: the property rows when they are streamed (one pass, python backend)
+    backend = rule_backend(workbook) if rows is None else "python"
+    if rows is None:
+        rows = workbook.property_rows
+    store = revisions.store()
+    key = revision_key(workbook)
+    if backend != "python" or not store.enabled or key is None:
+        return rule_set.run(workbook.property_headers, rows, backend=backend)
+
+    last = store.get(key)
+    previous = last.rows if last is not None else {}
+    current = {}
+    issues = rule_set.run(workbook.property_headers, rows, backend=backend, previous=previous, current=current)
+    store.save_rows(key, current, len(current.keys() & previous.keys()))
+    return issues
+
+def check_properties(workbook, errors, rows=None):
+    # Property assignments below the headers of row 4, see PROPERTY_RULES
+    errors.extend(run_property_rules(PROPERTY_RULES, workbook, rows))
+    return errors
+
+def check_vocab_terms(workbook, errors, rows=None):
+    # Vocabulary terms below the headers of row 4, see VOCABULARY_TERM_RULES
+    errors.extend(run_property_rules(VOCABULARY_TERM_RULES, workbook, rows))
+    return errors
+
+def stream_content_checker(file, name_ok, file_name=None):
+    # Content checks in one pass over the file, for when the entity checks do not run: only
+    # rows 1 to 4 are kept and the rows below go through the rule set one at a time, so the
+    # memory grows with the number of columns and not with the number of rows
+    reader = read_workbook_rows(file)
+    try:
+        head = ParsedWorkbook(list(itertools.islice(reader, 4)), file_name or getattr(file, "name", str(file)))
+        return content_checker(head, name_ok, rows=reader)
+    finally:
+        reader.close()
+
+def content_checker(workbook, name_ok, rows=None):
+    # rows: the rows after row 4 when the workbook holds only the first four (see stream_content_checker)
+    logger.info(f"Checking content of file {workbook.file_name}")
     errors = []  
     
     if(name_ok):
-        file_name = file_name.name.split(".xls")
+        file_name = workbook.file_name.split(".xls")
         file_parts = file_name[0].split("_")
         file_parts.pop(-1)
         file_parts.pop(-1)
@@ -395,33 +406,19 @@ def content_checker(file_name, name_ok):
     else:
         version, etype, code = "", "", ""
 
-    sheet = workbook.active
-    
-    filtered_rows = []
-    
-    for row in sheet.iter_rows(min_row=1, values_only=True):
-    # Check if any cell in the row contains "$"
-        if any("$" in str(cell) for cell in row):
-            filtered_rows.append(["$" + str(cell) if cell is not None else None for cell in row])
-        else:
-            # If the row passed the check, add it to the filtered list
-            filtered_rows.append(row)
-    
-    #remove all the rows in the sheet
-    sheet.delete_rows(0, sheet.max_row)
-
-    # Append the filtered rows to the sheet
-    for row_data in filtered_rows:
-        sheet.append(row_data)
+    # Read the "$" placeholder rows through a prefixed view, the shared rows are never modified
+    sheet = workbook.with_placeholders()
+    if rows is not None:
+        rows = (placeholder_row(row) for row in rows)
 
     # Access a specific cell (e.g., cell A1)
-    cell_value_A1 = sheet['A1'].value
+    cell_value_A1 = sheet.entity_type
     print(f"Entity Type: {cell_value_A1}")
     
     entity_types = ["SAMPLE_TYPE", "EXPERIMENT_TYPE", "DATASET_TYPE", "PROPERTY_TYPE", "VOCABULARY_TYPE"]
     if cell_value_A1 not in entity_types:
-        errors.append("⦿ The entity type (cell A1) should be one of the following: SAMPLE_TYPE, EXPERIMENT_TYPE, DATASET_TYPE, PROPERTY_TYPE, VOCABULARY_TYPE")
-        return "".join(errors)
+        errors.append(Issue(ERROR, "content", "content.entity_type", row=1, column="A"))
+        return errors
     else:
         if cell_value_A1 == "SAMPLE_TYPE":
             expected_terms = [
@@ -432,61 +429,59 @@ def content_checker(file_name, name_ok):
                 "Generated code prefix",
                 "Auto generate codes",
             ]
-            second_row_values = [cell.value for cell in sheet[2]]
+            second_row_values = list(sheet.entity_headers)
             for term in expected_terms:
                 if term not in second_row_values:
-                    errors.append(f"<strong>Error</strong>: '{term}' not found in the entity headers.")
+                    errors.append(Issue(ERROR, "content", "content.missing_entity_header", row=2, column=term))
                 else:
                      # Find the index of the term in the second row
                      term_index = second_row_values.index(term)
 
                      # Check the cell below "Version"
                      if term == "Version":
-                        cell_below_version = sheet.cell(row=3, column=term_index + 1)
-                        if str(cell_below_version.value) != version[1:]:
-                            errors.append("<strong>Error</strong>: The version should be the same one indicated in the file name")
+                        cell_below_version = sheet.cell(3, term_index + 1)
+                        if str(cell_below_version) != version[1:]:
+                            errors.append(Issue(ERROR, "content", "content.version_mismatch", row=3, column=term))
 
                     # Check the cell below "Code"
                      elif term == "Code":
-                        cell_below_code = sheet.cell(row=3, column=term_index + 1)
-                        if cell_below_code.value != code:
-                            errors.append("⦿ <strong>Error</strong>: The code should be the same one indicated in the file name")
+                        cell_below_code = sheet.cell(3, term_index + 1)
+                        if cell_below_code != code:
+                            errors.append(Issue(ERROR, "content", "content.code_mismatch", row=3, column=term))
                     
                     
                     # Check the cell below "Description"
                      elif term == "Description":
-                        cell_below_description = sheet.cell(row=3, column=term_index + 1)
-                        description_pattern = re.compile(r".*//.*")
-                        if not description_pattern.match(cell_below_description.value):
-                            errors.append("<strong>Error</strong>: Description should follow the schema: English Description + '//' + German Description.")
+                        cell_below_description = sheet.cell(3, term_index + 1)
+                        if not DESCRIPTION_PATTERN.match(cell_below_description):
+                            errors.append(Issue(ERROR, "content", "content.description_schema", row=3, column=term))
 
                     # Check the cell below "Generated code prefix"
                      elif term == "Generated code prefix":
-                        cell_below_generated_code = sheet.cell(row=3, column=term_index + 1)
+                        cell_below_generated_code = sheet.cell(3, term_index + 1)
                         code_replace = code.replace('_', '.').split('.')
                         ext_code = [word[:3].upper() for word in code_replace]
                         generated_code = '.'.join(ext_code)
-                        if cell_below_generated_code.value != generated_code:
-                            errors.append("<em>Warning</em>: It is recommended that the value of 'Generated code prefix' be the first three letters of each part of the 'Code' separated by dots ['.'].")
+                        if cell_below_generated_code != generated_code:
+                            errors.append(Issue(WARNING, "content", "content.code_prefix", row=3, column=term))
 
                     # Check the cell below "Validation script"
                      elif term == "Validation script":
-                        cell_below_validation = sheet.cell(row=3, column=term_index + 1)
-                        validation_pattern = re.compile(r"^[A-Za-z0-9_]+\.py$")
-                        if cell_below_validation.value and not validation_pattern.match(cell_below_validation.value):
-                             errors.append("<strong>Error</strong>: Validation script should follow the schema: Words and/or numbers separated by '_' and ending in '.py'")
+                        cell_below_validation = sheet.cell(3, term_index + 1)
+                        if cell_below_validation and not VALIDATION_SCRIPT_PATTERN.match(cell_below_validation):
+                             errors.append(Issue(ERROR, "content", "content.validation_script", row=3, column=term))
 
 
                     # Check the cell below "Auto generate codes"
                      elif term == "Auto generate codes":
-                        cell_below_auto_generate = sheet.cell(row=3, column=term_index + 1)
-                        auto_code = cell_below_auto_generate.value
+                        cell_below_auto_generate = sheet.cell(3, term_index + 1)
+                        auto_code = cell_below_auto_generate
                         if (auto_code == True): auto_code = "TRUE"
                         if (auto_code == False): auto_code = "FALSE"
                         if auto_code not in ["TRUE", "FALSE"]:
-                            errors.append("<strong>Error</strong>: Value below 'Auto generate codes' should be 'TRUE' or 'FALSE'.")
+                            errors.append(Issue(ERROR, "content", "content.auto_generate_codes", row=3, column=term))
             
-            errors = check_properties(sheet, errors)      
+            errors = check_properties(sheet, errors, rows)      
             
         elif cell_value_A1 == "EXPERIMENT_TYPE" or cell_value_A1 == "DATASET_TYPE":
             expected_terms = [
@@ -495,43 +490,41 @@ def content_checker(file_name, name_ok):
                 "Description",
                 "Validation script"
             ]
-            second_row_values = [cell.value for cell in sheet[2]]
+            second_row_values = list(sheet.entity_headers)
             for term in expected_terms:
                 if term not in second_row_values:
-                    errors.append(f"<strong>Error</strong>: '{term}' not found in the second row.")
+                    errors.append(Issue(ERROR, "content", "content.missing_second_row_header", row=2, column=term))
                 else:
                      # Find the index of the term in the second row
                      term_index = second_row_values.index(term)
 
                      # Check the cell below "Version"
                      if term == "Version":
-                        cell_below_version = sheet.cell(row=3, column=term_index + 1)
-                        if str(cell_below_version.value) != version[1:]:
-                            errors.append("<strong>Error</strong>: The version should be the same one indicated in the file name")
+                        cell_below_version = sheet.cell(3, term_index + 1)
+                        if str(cell_below_version) != version[1:]:
+                            errors.append(Issue(ERROR, "content", "content.version_mismatch", row=3, column=term))
 
                     # Check the cell below "Code"
                      elif term == "Code":
-                        cell_below_code = sheet.cell(row=3, column=term_index + 1)
-                        if cell_below_code.value != code:
-                            errors.append("<strong>Error</strong>: The code should be the same one indicated in the file name")
+                        cell_below_code = sheet.cell(3, term_index + 1)
+                        if cell_below_code != code:
+                            errors.append(Issue(ERROR, "content", "content.code_mismatch", row=3, column=term))
                     
                     
                     # Check the cell below "Description"
                      elif term == "Description":
-                        cell_below_description = sheet.cell(row=3, column=term_index + 1)
-                        description_pattern = re.compile(r".*//.*")
-                        if not description_pattern.match(cell_below_description.value):
-                            errors.append("<strong>Error</strong>: Description should follow the schema: English Description + '//' + German Description.")
+                        cell_below_description = sheet.cell(3, term_index + 1)
+                        if not DESCRIPTION_PATTERN.match(cell_below_description):
+                            errors.append(Issue(ERROR, "content", "content.description_schema", row=3, column=term))
             
             
                     # Check the cell below "Validation script"
                      elif term == "Validation script":
-                        cell_below_validation = sheet.cell(row=3, column=term_index + 1)
-                        validation_pattern = re.compile(r"^[A-Za-z0-9_]+\.py$")
-                        if cell_below_validation.value and not validation_pattern.match(cell_below_validation.value):
-                            errors.append("<strong>Error</strong>: Validation script should follow the schema: Words and/or numbers separated by '_' and ending in '.py'")
+                        cell_below_validation = sheet.cell(3, term_index + 1)
+                        if cell_below_validation and not VALIDATION_SCRIPT_PATTERN.match(cell_below_validation):
+                            errors.append(Issue(ERROR, "content", "content.validation_script", row=3, column=term))
 
-            errors = check_properties(sheet, errors) 
+            errors = check_properties(sheet, errors, rows) 
             
         elif cell_value_A1 == "VOCABULARY_TYPE":
             expected_terms = [
@@ -539,241 +532,52 @@ def content_checker(file_name, name_ok):
                 "Code",
                 "Description"
             ]
-            second_row_values = [cell.value for cell in sheet[2]]
+            second_row_values = list(sheet.entity_headers)
             for term in expected_terms:
                 if term not in second_row_values:
-                    errors.append(f"<strong>Error</strong>: '{term}' not found in the second row.")
+                    errors.append(Issue(ERROR, "content", "content.missing_second_row_header", row=2, column=term))
                 else:
                      # Find the index of the term in the second row
                      term_index = second_row_values.index(term)
 
                      # Check the cell below "Version"
                      if term == "Version":
-                        cell_below_version = sheet.cell(row=3, column=term_index + 1)
-                        if str(cell_below_version.value) != version[1:]:
-                            errors.append("<strong>Error</strong>: The version should be the same one indicated in the file name. Value found: {cell_below_version.value}")
+                        cell_below_version = sheet.cell(3, term_index + 1)
+                        if str(cell_below_version) != version[1:]:
+                            errors.append(Issue(ERROR, "content", "content.version_mismatch_value", row=3, column=term, value=cell_below_version))
 
                     # Check the cell below "Code"
                      elif term == "Code":
-                        cell_below_code = sheet.cell(row=3, column=term_index + 1)
-                        if cell_below_code.value != code:
-                            errors.append("<strong>Error</strong>: The code should be the same one indicated in the file name. Value found: {cell_below_code.value}")
+                        cell_below_code = sheet.cell(3, term_index + 1)
+                        if cell_below_code != code:
+                            errors.append(Issue(ERROR, "content", "content.code_mismatch_value", row=3, column=term, value=cell_below_code))
                     
                     
                     # Check the cell below "Description"
                      elif term == "Description":
-                        cell_below_description = sheet.cell(row=3, column=term_index + 1)
-                        description_pattern = re.compile(r".*//.*")
-                        if not description_pattern.match(cell_below_description.value):
-                            errors.append("<strong>Error</strong>: Description should follow the schema: English Description + '//' + German Description. Value found: {cell_below_description.value}")
+                        cell_below_description = sheet.cell(3, term_index + 1)
+                        if not DESCRIPTION_PATTERN.match(cell_below_description):
+                            errors.append(Issue(ERROR, "content", "content.description_schema_value", row=3, column=term, value=cell_below_description))
             
-            errors = check_vocab_terms(sheet, errors)
+            errors = check_vocab_terms(sheet, errors, rows)
 
         elif cell_value_A1 == "PROPERTY_TYPE":
-            expected_terms = [
-                "Version",
-                "Code",
-                "Description",
-                "Mandatory",
-                "Show in edit views",
-                "Section",
-                "Property label",
-                "Data type",
-                "Vocabulary code"
-            ]
-            second_row_values = [cell.value for cell in sheet[2]]
-            for term in expected_terms:
-                if term not in second_row_values:
-                    errors.append(f"<strong>Error</strong>: '{term}' not found in the second row.")
-                else:
-                     # Find the index of the term in the second row
-                     term_index = second_row_values.index(term) + 1
+            # One property type per row below the headers of row 2, see PROPERTY_TYPE_RULES
+            if rows is None:
+                errors.extend(PROPERTY_TYPE_RULES.run(sheet.entity_headers, sheet.rows_from(3), first_row=3, backend=rule_backend(sheet)))
+            else:
+                errors.extend(PROPERTY_TYPE_RULES.run(sheet.entity_headers, itertools.chain(sheet.rows_from(3), rows), first_row=3))
 
 
-                     # Check the column below "Version"
-                     if term == "Version":
-                        column_below_version = sheet[term_index][2:]
-                        # Check if any value in the column is not an integer
-                        non_integer_cells = [(i + 3, cell.value) for i, cell in enumerate(column_below_version) if not isinstance(cell.value, int)]
-                        if non_integer_cells:
-                            # Append an error indicating the positions (row numbers) that are not integers
-                            non_integer_indices = [str(row) for row, _ in non_integer_cells]
-                            invalid_values = [str(value) for _, value in non_integer_cells]
-                            errors.append(f"<strong>Error</strong>: Values not valid found in the 'Version' column (they should be Integers) at row(s): {', '.join(non_integer_indices)}. Value(s) found: {', '.join(invalid_values)}")
-
-                    # Check the column below "Code"
-                     elif term == "Code":
-                        column_below_code = sheet[term_index][2:]
-                        invalid_codes = [(i + 3, cell.value) for i, cell in enumerate(column_below_code) if not re.match(r'^\$?[A-Z0-9_.]+$', str(cell.value))]
-                        if invalid_codes:
-                            invalid_rows = [str(row) for row, _ in invalid_codes]
-                            invalid_values = [str(value) for _, value in invalid_codes]
-                            errors.append(f"<strong>Error</strong>: Invalid code found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Value(s) found: {', '.join(invalid_values)}")
-                    
-                    # Check the cell below "Description"
-                     elif term == "Description":
-                        column_below_description = sheet[term_index][2:]
-                        invalid_descriptions = [(i + 3, cell.value) for i, cell in enumerate(column_below_description) if not re.match(r'.*//.*', str(cell.value))]
-                        if invalid_descriptions:
-                            invalid_rows = [str(row) for row, _ in invalid_descriptions]
-                            invalid_values = [str(value) for _, value in invalid_descriptions]
-                            errors.append(f"<strong>Error</strong>: Invalid value(s) found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Description should follow the schema: English Description + '//' + German Description. Value(s) found: {', '.join(invalid_values)}")
-                    
-                    # Check the cell below "Mandatory"
-                     elif term == "Mandatory":
-                        column_below_mandatory = sheet[term_index][2:]
-                        invalid_mandatory = [(i + 3, cell.value) for i, cell in enumerate(column_below_mandatory) if cell.value not in ["TRUE", "FALSE"]]
-                        if invalid_mandatory:
-                            invalid_rows = [str(row) for row, _ in invalid_mandatory]
-                            invalid_values = [str(value) for _, value in invalid_mandatory]
-                            errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Accepted values: TRUE, FALSE. Value(s) found: {', '.join(invalid_values)}")
-                    
-                    # Check the cell below "Show in edit views"
-                     elif term == "Show in edit views":
-                        column_below_show = sheet[term_index][2:]
-                        invalid_show = [(i + 3, cell.value) for i, cell in enumerate(column_below_show) if cell.value not in ["TRUE", "FALSE"]]
-                        if invalid_show:
-                            invalid_rows = [str(row) for row, _ in invalid_show]
-                            invalid_values = [str(value) for _, value in invalid_show]
-                            errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Accepted values: TRUE, FALSE. Value(s) found: {', '.join(invalid_values)}")
-                    
-                     elif term == "Section":
-                        column_below_section = sheet[term_index][2:]
-                        print(column_below_section)
-                        invalid_section = [(i + 3, cell.value) for i, cell in enumerate(column_below_section) if not re.match(r'^[A-Z][a-z]*(?:\s[A-Z][a-z]*)*$', str(cell.value))]
-                        if invalid_section:
-                            invalid_rows = [str(row) for row, _ in invalid_section]
-                            invalid_values = [str(value) for _, value in invalid_section]
-                            errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Each word should start with a capital letter. Value(s) found: {', '.join(invalid_values)}")
-                    
-                        seen_sections = {}
-                        non_contiguous_rows = []
-
-                        for i, current_value in enumerate(column_below_section):
-                            if current_value in seen_sections:
-                                # If the value has been seen before but the row is not contiguous, add an error
-                                if seen_sections[current_value] != i - 1:
-                                    non_contiguous_rows.append(i + 5)
-                            seen_sections[current_value] = i  # Update the last seen row index for the current value
-
-                        if non_contiguous_rows:
-                            errors.append(f"<strong>Error</strong>: Non-contiguous rows found for the same 'Section' value at row(s): {', '.join(map(str, non_contiguous_rows))}. Ensure that all properties within the same Section are grouped together.")
-                            
-                        # Predefined section order (fixed order)
-                        predefined_section_order = ["General Information", "Additional Information", "Comments"]
-                    
-                        # Validate contiguous groups and predefined section order
-                        seen_sections = set()
-                        previous_section_type = None
-                        section_errors = []  # Store section-specific errors
-                        additional_info_seen = False  # Flag to track if "Additional Information" has been seen
-                        comments_seen = False  # Flag to track if "Comments" has been seen
-                    
-                        # Traverse the section list
-                        for i, section in enumerate(column_below_section):
-                            if section in predefined_section_order:
-                                if section == "General Information":
-                                    if previous_section_type not in [None, "General Information"]:
-                                        section_errors.append(f"<strong>Error</strong> at row {i + 5}: 'General Information' should only appear at the beginning.")
-                                elif section == "Additional Information":
-                                    if previous_section_type not in ["General Information", "user-defined"]:
-                                        section_errors.append(f"<strong>Error</strong> at row {i + 5}: 'Additional Information' should appear after 'General Information' and any user-defined sections.")
-                                    additional_info_seen = True  # Mark that "Additional Information" has been encountered
-                                elif section == "Comments":
-                                    if previous_section_type not in ["General Information", "user-defined", "Additional Information"]:
-                                        section_errors.append(f"<strong>Error</strong> at row {i + 5}: 'Comments' should appear after 'Additional Information'.")
-                                    comments_seen = True  # Mark that "Comments" has been encountered
-                                previous_section_type = section
-                            else:
-                                # User-defined section
-                                if comments_seen:
-                                    section_errors.append(f"<strong>Error</strong> at row {i + 5}: User-defined section '{section}' cannot appear after 'Comments'.")
-                                if additional_info_seen and not comments_seen:
-                                    section_errors.append(f"<strong>Error</strong> at row {i + 5}: User-defined section '{section}' cannot appear after 'Additional Information' but before 'Comments'.")
-                                previous_section_type = "user-defined"
-                    
-                        # Output any errors
-                        if section_errors:
-                            for error in section_errors:
-                                errors.append(error)
-            
-                    # Check the cell below "Property label"
-                     elif term == "Property label":
-                        column_below_label = sheet[term_index][2:]
-                        invalid_label = [(i + 3, cell.value) for i, cell in enumerate(column_below_label) if not re.match(r'.*', str(cell.value))]
-                        if invalid_label:
-                            invalid_rows = [str(row) for row, _ in invalid_label]
-                            invalid_values = [str(value) for _, value in invalid_label]
-                            errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Specify the property label as text format. Value(s) found: {', '.join(invalid_values)}")
-                         # Dynamically find the "Section" column
-                        if "Section" in second_row_values:
-                            section_column_index = second_row_values.index("Section") + 1  # Find the index of the "Section" column
-                            section_letter = index_to_excel_column(section_column_index)  # Convert index to Excel column letter
-                            column_below_section = sheet[section_letter][2:]  # Get all cells below the "Section" header
-
-                            # New check for "Notes" in "Property label" and "Additional Information" in "Section"
-                            for i, cell in enumerate(column_below_label):
-                                if cell.value == "Notes":
-                                    section_value = column_below_section[i].value  # Get the value in the "Section" column for the same row
-                                    if section_value != "Additional Information":
-                                        errors.append(f"<strong>Error</strong>: 'Notes' found in the 'Property label' column at row {i + 5}, but corresponding 'Section' column does not contain 'Additional Information'. Value found: {section_value}")
-                    
-                    # Check the cell below "Data type"
-                     elif term == "Data type":
-                        column_below_type = sheet[term_index][2:]
-                        invalid_type = [(i + 3, cell.value) for i, cell in enumerate(column_below_type) if cell.value not in ["INTEGER", "REAL", "VARCHAR", "MULTILINE_VARCHAR", "HYPERLINK", "BOOLEAN", "CONTROLLEDVOCABULARY", "XML", "TIMESTAMP", "DATE", "SAMPLE"]]
-                        if invalid_type:
-                            invalid_rows = [str(row) for row, _ in invalid_type]
-                            invalid_values = [str(value) for _, value in invalid_type]
-                            errors.append(f"<strong>Error</strong>: Invalid value found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Accepted types: INTEGER, REAL, VARCHAR, MULTILINE_VARCHAR, HYPERLINK, BOOLEAN, CONTROLLEDVOCABULARY, XML, TIMESTAMP, DATE, SAMPLE. Value(s) found: {', '.join(invalid_values)}")
-                    
-                    # Check the column below "Vocabulary code"
-                     elif term == "Vocabulary code":
-                        column_below_vocab = sheet[term_index][2:]
-                        invalid_vocab = [(i + 3, cell.value) for i, cell in enumerate(column_below_vocab) if cell.value is not None and not re.match(r'^\$?[A-Z0-9_.]+$', str(cell.value))]
-                        if invalid_vocab:
-                            invalid_rows = [str(row) for row, _ in invalid_vocab]
-                            invalid_values = [str(value) for _, value in invalid_vocab]
-                            errors.append(f"<strong>Error</strong>: Invalid vocabulary code found in the '{term}' column at row(s): {', '.join(invalid_rows)}. Value(s) found: {', '.join(invalid_values)}")
-
-
-    # Close the workbook after use
-    workbook.close()
-    if type(errors) == list:
-        output = "\n\n⦿ ".join(errors)
-    else:
-        output = "".join(errors)
-    if output == "":
-        return "File content: OK!"
-    else:
-        return output
+    return errors
     
 
 def search_entity(o, e_type, e_code):
-    if e_type == "EXPERIMENT_TYPE":
-        return o.get_collection_type(e_code)
-        
-    elif e_type == "SAMPLE_TYPE":
-        return o.get_object_type(e_code)
-    
-    elif e_type == "DATASET_TYPE":
-        return o.get_dataset_type(e_code)
-    
-    elif e_type == "VOCABULARY_TYPE":
-        return o.get_vocabulary(e_code)
+    # Read from the masterdata snapshot, openBIS is only asked on a miss
+    return masterdata.snapshot(o).entity(o, e_type, e_code)
     
 def get_entity_list(o, entity_type):
-    if entity_type == "EXPERIMENT_TYPE":
-        return o.get_collection_types()
-    
-    elif entity_type == "SAMPLE_TYPE":
-        return o.get_object_types()
-    
-    elif entity_type == "DATASET_TYPE":
-        return o.get_dataset_types()
-    
-    elif entity_type == "VOCABULARY_TYPE":
-        return o.get_vocabularies()
+    return masterdata.snapshot(o).entities(o, entity_type)
     
 def compare_objects(obj1, obj2):
     # Check if both are None or both are empty strings
@@ -808,30 +612,28 @@ def get_df_value(df, prop, attr):
     
 
 
-def check_entity_same_code(file_path, o, openbis_entity):
+def check_entity_same_code(workbook, lookups, openbis_entity):
     errors = []
     description = ""
     auto_code = ""
     val_script = ""
     prefix_code = ""
 
-    workbook = openpyxl.load_workbook(file_path)
-    sheet = workbook.active
-    entity_type = sheet['A1'].value
-    second_row_values = [cell.value for cell in sheet[2]]
+    entity_type = workbook.entity_type
+    second_row_values = list(workbook.entity_headers)
     
     for term in second_row_values:
         term_index = second_row_values.index(term)
         if term == "Code":
-            entity_code = sheet.cell(row=3, column=term_index + 1).value
+            entity_code = workbook.cell(3, term_index + 1)
         elif term == "Description":
-            description = sheet.cell(row=3, column=term_index + 1).value
+            description = workbook.cell(3, term_index + 1)
         elif term == "Auto generate codes":
-            auto_code = sheet.cell(row=3, column=term_index + 1).value
+            auto_code = workbook.cell(3, term_index + 1)
         elif term == "Validation script":
-            val_script = sheet.cell(row=3, column=term_index + 1).value
+            val_script = workbook.cell(3, term_index + 1)
         elif term == "Generated code prefix":
-            prefix_code = sheet.cell(row=3, column=term_index + 1).value
+            prefix_code = workbook.cell(3, term_index + 1)
             
         #format values to match
         if (auto_code == True): auto_code = "TRUE"
@@ -851,41 +653,39 @@ def check_entity_same_code(file_path, o, openbis_entity):
         
     #check description
     if (description != openbis_description):
-        errors.append(f"The Description of ('{entity_type}') '{entity_code}' has been changed compared to the previous version.")
-        description_pattern = re.compile(r".*//.*")
-        if not description_pattern.match(description):
-            errors.append("<strong>ERROR</strong>: The Description of ('{entity_type}') '{entity_code}' should follow the schema: English Description + '//' + German Description.")
+        errors.append(Issue(INFO, "entity", "entity.description_changed", entity_type=entity_type, code=entity_code))
+        if not DESCRIPTION_PATTERN.match(description):
+            errors.append(Issue(ERROR, "entity", "entity.description_schema", entity_type=entity_type, code=entity_code))
         
     #check auto-generated codes
     if (auto_code != openbis_auto_code):
-        errors.append(f"The value of “Auto generate codes” of ('{entity_type}') '{entity_code}' has been changed from '{openbis_auto_code}' to '{auto_code}'.")
+        errors.append(Issue(INFO, "entity", "entity.auto_generate_codes_changed", entity_type=entity_type, code=entity_code, old=openbis_auto_code, new=auto_code))
     
     #check validation scripts
     if (val_script == "" and openbis_val_script != ""):
-        errors.append(f"The validation script '{openbis_val_script}' has been deleted from ('{entity_type}') '{entity_code}'.")
+        errors.append(Issue(INFO, "entity", "entity.validation_script_deleted", entity_type=entity_type, code=entity_code, old=openbis_val_script))
     elif (val_script != "" and openbis_val_script == ""):
-        errors.append(f"A validation script '{val_script}' has been added to ('{entity_type}') '{entity_code}'.")
+        errors.append(Issue(INFO, "entity", "entity.validation_script_added", entity_type=entity_type, code=entity_code, new=val_script))
     elif (val_script != openbis_val_script):
-        errors.append(f"The validation script of ('{entity_type}') '{entity_code}' has been changed from '{openbis_val_script}' to '{val_script}'.")
+        errors.append(Issue(INFO, "entity", "entity.validation_script_changed", entity_type=entity_type, code=entity_code, old=openbis_val_script, new=val_script))
         
     #check generated code prefix
     if (prefix_code != openbis_prefix_code):
-        errors.append(f"The Code Prefix of ('{entity_type}') '{entity_code}' has been changed from '{openbis_prefix_code}' to '{prefix_code}'.")
+        errors.append(Issue(INFO, "entity", "entity.code_prefix_changed", entity_type=entity_type, code=entity_code, old=openbis_prefix_code, new=prefix_code))
             
             
     #get assigned properties from the excel file
-    prop_headers = [cell.value for cell in sheet[4]]
+    prop_headers = list(workbook.property_headers)
     entity_properties = []
     term_index = prop_headers.index("Code") + 1
-    term_letter = index_to_excel_column(term_index)
         
-    for cell in sheet[term_letter][4:]:
-        if cell.value is not None:
-            entity_properties.append(cell.value)
+    for value in workbook.column(term_index):
+        if value is not None:
+            entity_properties.append(value)
         
     #get assigned properties from the openbis instance
     openbis_entity_properties = []
-    for prop in openbis_entity.get_property_assignments():
+    for prop in lookups.assignments(entity_type, openbis_entity.code):
         openbis_entity_properties.append(prop.permId)
             
     # Remove None values from both lists before sorting
@@ -894,7 +694,7 @@ def check_entity_same_code(file_path, o, openbis_entity):
 
     #check if the properties lists are the same
     if sorted(entity_properties) != sorted(openbis_entity_properties):
-        errors.append(f"⦿ The set of Property Types assigned to the ('{entity_type}') '{entity_code}' has been changed compared to the previous version.")
+        errors.append(Issue(INFO, "entity", "entity.assignments_changed", entity_type=entity_type, code=entity_code))
 
             
     #check which properties has been added and removed
@@ -905,9 +705,9 @@ def check_entity_same_code(file_path, o, openbis_entity):
     added_properties = list(set(entity_properties) - set(openbis_entity_properties))
         
     for d_prop in deleted_properties:
-        errors.append(f"The Property type assignment '{d_prop}' has been removed.")
+        errors.append(Issue(INFO, "entity", "entity.assignment_removed", property=d_prop))
     for a_prop in added_properties:
-        errors.append(f"The Property type assignment '{a_prop}' has been added.")
+        errors.append(Issue(INFO, "entity", "entity.assignment_added", property=a_prop))
             
             
 # =============================================================================
@@ -918,7 +718,7 @@ def check_entity_same_code(file_path, o, openbis_entity):
 
     #save dict with all the properties values from the entity in the instance
     openbis_properties_data = {}
-    for prop in openbis_entity.get_property_assignments():
+    for prop in lookups.assignments(entity_type, openbis_entity.code):
         openbis_properties_data[prop.code] = {
             "label": prop.label,
             "description": prop.description,
@@ -928,13 +728,10 @@ def check_entity_same_code(file_path, o, openbis_entity):
         }
             
     #save dict with all the properties values from the excel metadata file
-    prop_headers = [cell.value for cell in sheet[4]]
     properties_data = {}
-    term_index = prop_headers.index("Code") + 1
-    term_letter = index_to_excel_column(term_index)
         
 
-    for row in sheet.iter_rows(min_row=5, values_only=True):
+    for row in workbook.property_rows:
         code_value = row[term_index - 1]  # Index is 0-based
         if code_value is not None:
 
@@ -969,119 +766,134 @@ def check_entity_same_code(file_path, o, openbis_entity):
 # =============================================================================
         
 
-    assigned_properties = openbis_entity.get_property_assignments().df
+    assigned_properties = lookups.assignments(entity_type, openbis_entity.code).df
     #properties present in the excel but not in openbis: not assigned
     not_assigned_properties =  set(properties_data.keys()) - set(openbis_properties_data.keys())
     
     #compare both dicts with sets of properties to check the differences
-    for key in openbis_properties_data.keys() & properties_data.keys():
+    def compare_assigned(key):
+        errors = []
         for assigned_field in ["mandatory", "section", "plugin"]:
             excel_assigned = properties_data[key][assigned_field]
             openbis_assigned = get_df_value(assigned_properties, key, assigned_field)
             if not compare_objects(excel_assigned,openbis_assigned):
                 if assigned_field == "mandatory":
                     if (str(openbis_assigned).upper() == "FALSE" and str(excel_assigned).upper() == "TRUE"):
-                        errors.append(f"The value of the attribute 'Mandatory' of Property type {key} has been changed compared to the previous version from FALSE to TRUE.")
+                        errors.append(Issue(INFO, "entity", "entity.mandatory_set", property=key))
                     elif (str(openbis_assigned).upper() == "TRUE" and str(excel_assigned).upper() == "FALSE"):
-                        errors.append(f"<strong>ERROR</strong>: The value of the attribute 'Mandatory' of Property type {key} has been changed compared to the previous version from TRUE to FALSE. This is NOT allowed")
+                        errors.append(Issue(ERROR, "entity", "entity.mandatory_unset", property=key))
                 elif assigned_field == "section":
-                    errors.append(f"The section of Property type {key} has been changed compared to the previous version from {openbis_assigned} to {excel_assigned}.")
+                    errors.append(Issue(INFO, "entity", "entity.section_changed", property=key, old=openbis_assigned, new=excel_assigned))
                 elif assigned_field == "plugin":
                     if (openbis_assigned == "" or openbis_assigned == None) and (excel_assigned != "" or excel_assigned != None):
-                        errors.append(f"<em>WARNING</em>: A dynamic property script ({excel_assigned}) has been added retrospectively to the Property type {key}.")
+                        errors.append(Issue(WARNING, "entity", "entity.dynamic_script_added", property=key, new=excel_assigned))
                     elif (str(openbis_assigned).upper() != str(excel_assigned).upper()):
-                        errors.append(f"<strong>ERROR</strong>: The dynamic property script of Property type {key} has been changed or deleted compared to the previous version. This is NOT allowed")
+                        errors.append(Issue(ERROR, "entity", "entity.dynamic_script_changed", property=key))
                    
         for field in ["label", "description", "dataType", "vocabulary", "metaData"]:
             value1 = openbis_properties_data[key][field]
             value2 = properties_data[key][field]
             if not compare_objects(value1,value2):
                 if field == "label":
-                    errors.append(f"The label of Property type {key} has been changed compared to the previous version from {value1} to {value2}.")
+                    errors.append(Issue(INFO, "entity", "entity.label_changed", property=key, old=value1, new=value2))
                 elif field == "description":
-                    errors.append(f"The description of Property type {key} has been changed compared to the previous version from {value1} to {value2}.")
+                    errors.append(Issue(INFO, "entity", "entity.property_description_changed", property=key, old=value1, new=value2))
                 elif field == "dataType":
-                    errors.append(f"<em>WARNING</em>: The data type of Property type {key} has been changed compared to the previous version from from {value1} to {value2}. This is only permissible for some cases, e.g., 'CONTROLLEDVOCABULARY' to 'VARCHAR'!")
+                    errors.append(Issue(WARNING, "entity", "entity.data_type_changed", property=key, old=value1, new=value2))
                 elif field == "vocabulary":
-                    errors.append(f"<strong>ERROR</strong>: The vocabulary code of Property type {key} has been changed compared to the previous version from from {value1} to {value2}. This is not allowed.")
+                    errors.append(Issue(ERROR, "entity", "entity.vocabulary_changed", property=key, old=value1, new=value2))
                 elif field == "metaData":
-                    errors.append(f"<strong>ERROR</strong>: The metadata of Property type {key} has been changed compared to the previous version from from {value1} to {value2}. This is not allowed.")
+                    errors.append(Issue(ERROR, "entity", "entity.metadata_changed", property=key, old=value1, new=value2))
+        return errors
 
 
-    for key in not_assigned_properties:
+    def compare_not_assigned(key):
+        errors = []
         try:
-             prop_ob = o.get_property_type(key)
+             prop_ob = lookups.property_type(key)
              if not compare_objects(properties_data[key]['label'],prop_ob.label):
-                 errors.append(f"The label of Property type {key} has been changed compared to the previous version from {prop_ob.label} to {properties_data[key]['label']}.")
+                 errors.append(Issue(INFO, "entity", "entity.property_type_label_changed", property=key, old=prop_ob.label, new=properties_data[key]['label']))
              elif not compare_objects(properties_data[key]['description'],prop_ob.description):
-                 errors.append(f"The description of Property type {key} has been changed compared to the previous version from {prop_ob.description} to {properties_data[key]['description']}.")
+                 errors.append(Issue(INFO, "entity", "entity.property_type_description_changed", property=key, old=prop_ob.description, new=properties_data[key]['description']))
              elif not compare_objects(properties_data[key]['dataType'],prop_ob.dataType):
-                 errors.append(f"The data type of Property type {key} has been changed compared to the previous version from {prop_ob.dataType} to {properties_data[key]['dataType']}. This is only permissible for some cases, e.g., 'CONTROLLEDVOCABULARY' to 'VARCHAR'!")
+                 errors.append(Issue(WARNING, "entity", "entity.property_type_data_type_changed", property=key, old=prop_ob.dataType, new=properties_data[key]['dataType']))
              elif not compare_objects(properties_data[key]['vocabulary'],prop_ob.vocabulary):
-                 errors.append(f"The vocabulary code of Property type {key} has been changed compared to the previous version from {prop_ob.vocabulary} to {properties_data[key]['vocabulary']}. This is not allowed.")
+                 errors.append(Issue(ERROR, "entity", "entity.property_type_vocabulary_changed", property=key, old=prop_ob.vocabulary, new=properties_data[key]['vocabulary']))
              elif not compare_objects(properties_data[key]['metaData'],prop_ob.metaData):
-                 errors.append(f"The metadata of Property type {key} has been changed compared to the previous version from {prop_ob.metaData} to {properties_data[key]['metaData']}. This is not allowed.")
+                 errors.append(Issue(ERROR, "entity", "entity.property_type_metadata_changed", property=key, old=prop_ob.metaData, new=properties_data[key]['metaData']))
         except ValueError:
-             continue
-        
-    workbook.close()
+             pass
+        return errors
+
+    # The comparisons of a property row unchanged since the last revision of the entity type
+    # are reused, as long as the masterdata snapshot is the same (see revisions.py)
+    store = revisions.store()
+    version = getattr(lookups, "version", None)
+    key = revision_key(workbook)
+    last = store.get(key) if store.enabled and version is not None and key is not None else None
+    previous = last.properties if last is not None and last.version == version else {}
+    current = {}
+
+    for compare, keys in ((compare_assigned, openbis_properties_data.keys() & properties_data.keys()), (compare_not_assigned, not_assigned_properties)):
+        for prop_code in keys:
+            row_key = fingerprint(compare.__name__, prop_code, properties_data[prop_code])
+            if row_key in previous:
+                current[row_key] = previous[row_key]
+                errors.extend(issue.as_reused() for issue in previous[row_key])
+            else:
+                current[row_key] = compare(prop_code)
+                errors.extend(current[row_key])
+
+    if store.enabled and version is not None and key is not None:
+        store.save_properties(key, version, current, len(current.keys() & previous.keys()))
     
-    return "\n\n⦿ ".join(errors)
+    return errors
         
-def check_entity_diff_code(file_path, o):
+def check_entity_diff_code(workbook, lookups):
     errors = []
     
-    workbook = openpyxl.load_workbook(file_path)
-    sheet = workbook.active
-    entity_type = sheet['A1'].value
+    entity_type = workbook.entity_type
 
     if(entity_type) == "VOCABULARY_TYPE":
-        return "\n".join(errors)
-    
-    openbis_entity_types = get_entity_list(o, entity_type)
-    
-    openbis_entity_properties = {}
+        return errors
     
-    #get all the properties for each entity type from the instance, and save them in a dictionary
-    for etype in openbis_entity_types:
-        props_by_type = []
-        openbis_entity_properties[etype.code] = []
-        if etype.code != "UNKNOWN":
-            for prop in etype.get_property_assignments():
-                props_by_type.append(prop.permId)
-            openbis_entity_properties[etype.code] = props_by_type
+    #index of the properties assigned to each entity type of the instance (one bulk fetch, shared by the snapshot)
+    property_index = lookups.property_index(entity_type)
     
     #get the assigned properties of the entity in the excel
-    entity_headers = [cell.value for cell in sheet[2]]
+    entity_headers = list(workbook.entity_headers)
     entity_properties = []
     term_index = entity_headers.index("Code") + 1
-    entity_code = sheet.cell(row=3, column=term_index).value
-    term_letter = index_to_excel_column(term_index)
+    entity_code = workbook.cell(3, term_index)
     
-    for cell in sheet[term_letter][4:]:
-        if cell.value is not None:
-            entity_properties.append(cell.value)
+    for value in workbook.column(term_index):
+        if value is not None:
+            entity_properties.append(value)
             
-    for key, prop_list in openbis_entity_properties.items():
-        if set(prop_list) == set(entity_properties):
-            errors.append(f"The {entity_type} '{entity_code}' is very similar to the existing {entity_type} '{key}'. Please consider whether you need to create a new entity type or whether you can re-use '{key}'")
+    for key in property_index.exact(entity_properties):
+        errors.append(Issue(INFO, "entity", "entity.same_properties", entity_type=entity_type, code=entity_code, other=key))
     
-    return "\n\n⦿ ".join(errors)
+    #near matches: types sharing most of their properties with the new one
+    threshold = getattr(settings, "ENTITY_SIMILARITY_THRESHOLD", 0.8)
+    top_k = getattr(settings, "ENTITY_SIMILARITY_TOP_K", 5)
+    for key, score in property_index.similar(entity_properties, threshold, top_k):
+        if score < 1:
+            errors.append(Issue(INFO, "entity", "entity.similar_properties", entity_type=entity_type, code=entity_code, other=key, score=score))
+    
+    return errors
 
 
-def check_prefix_sufix(file_path, o):
+def check_prefix_sufix(workbook, lookups):
     errors = []
     
-    workbook = openpyxl.load_workbook(file_path)
-    sheet = workbook.active
-    entity_type = sheet['A1'].value
+    entity_type = workbook.entity_type
 
     if(entity_type) == "VOCABULARY_TYPE":
-        return "\n\n⦿ ".join(errors)
+        return errors
     
-    entity_headers = [cell.value for cell in sheet[2]]
+    entity_headers = list(workbook.entity_headers)
     term_index = entity_headers.index("Code") + 1
-    entity_code = sheet.cell(row=3, column=term_index).value
+    entity_code = workbook.cell(3, term_index)
     
     pattern = re.compile(r'^[A-Za-z0-9_.]+\.[A-Za-z0-9_]+$')
     
@@ -1089,31 +901,30 @@ def check_prefix_sufix(file_path, o):
         parts = entity_code.rsplit('.', 1)
         prefix = parts[0]
         
-        prop_headers = [cell.value for cell in sheet[4]]
+        prop_headers = list(workbook.property_headers)
         entity_properties = []
         term_index = prop_headers.index("Code") + 1
-        term_letter = index_to_excel_column(term_index)
         
-        for cell in sheet[term_letter][4:]:
-            if cell.value is not None:
-                entity_properties.append(cell.value)
+        for value in workbook.column(term_index):
+            if value is not None:
+                entity_properties.append(value)
         
         #get assigned properties from the openbis instance
         try:
-            prefix_entity = search_entity(o, entity_type, prefix)
+            prefix_entity = lookups.entity(entity_type, prefix)
         except ValueError as e:
-            errors.append(f"⦿ Entity type '{prefix}' is not present in the system, and cannot be the prefix of a new entity to be registered.")
-            return "\n\n⦿ ".join(errors)
+            errors.append(Issue(ERROR, "entity", "entity.prefix_missing", prefix=prefix))
+            return errors
         
         prefix_properties = []
-        for prop in prefix_entity.get_property_assignments():
+        for prop in lookups.assignments(entity_type, prefix_entity.code):
             prefix_properties.append(prop.permId)
             
         #get the properties that are in the PREFIX but not in the SUFIX
         difference = [value for value in prefix_properties if value not in entity_properties]
         
         prefix_properties_data = {}
-        for prop in prefix_entity.get_property_assignments():
+        for prop in lookups.assignments(entity_type, prefix_entity.code):
             prefix_properties_data[prop.code] = {
                 "label": prop.label,
                 "description": prop.description,
@@ -1123,7 +934,7 @@ def check_prefix_sufix(file_path, o):
             }
             
         entity_properties_data = {}
-        for row in sheet.iter_rows(min_row=5, values_only=True):
+        for row in workbook.property_rows:
             code_value = row[term_index - 1]  # Index is 0-based
             if code_value is not None:
                 entity_properties_data[code_value] = {
@@ -1142,53 +953,46 @@ def check_prefix_sufix(file_path, o):
                 value2 = entity_properties_data[key][field]
                 if value1 != value2:
                     if field == "label":
-                        changes.append(f"Change in label of Property type {key}.")
+                        changes.append(f"label of Property type {key}")
                     elif field == "description":
-                        changes.append(f"Change in description of Property type {key}.")
+                        changes.append(f"description of Property type {key}")
                     elif field == "dataType":
-                        changes.append(f"Change in data type of Property type {key}.")
+                        changes.append(f"data type of Property type {key}")
                     elif field == "vocabulary":
-                        changes.append(f"Change in vocabulary code of Property type {key}.")
+                        changes.append(f"vocabulary code of Property type {key}")
                     elif field == "metaData":
-                        changes.append(f"Change in metadata of Property type {key}.")
+                        changes.append(f"metadata of Property type {key}")
 
         if (len(difference) != 0) or (len(changes) != 0):
-            errors.append(f"As a specification of the entity type {prefix}, the entity type {entity_code} must include all Property types of {prefix} without any changes.")
-            errors.append("The missing properties are: ")
-            missing = ", ".join(difference)
-            errors.append(missing)
-            errors.append("\n")
-            errors.append("The changed property attributes are: ")
-            changed = "\n".join(changes)
-            errors.append(changed)
+            errors.append(Issue(ERROR, "entity", "entity.prefix_incomplete", code=entity_code, prefix=prefix, missing=difference, changes=changes))
     
             
-        check_prefix_prefix(o, prefix, entity_type, errors)
+        check_prefix_prefix(lookups, prefix, entity_type, errors)
     
     
-    return "\n\n⦿ ".join(errors)
+    return errors
 
 
-def check_prefix_prefix(o, prefix, entity_type, errors):
+def check_prefix_prefix(lookups, prefix, entity_type, errors):
     if '.' in prefix:
         # Split the string by the last dot
         prefix_2, suffix = prefix.rsplit('.', 1)
         
-        prefix_entity = search_entity(o, entity_type, prefix_2)
-        suffix_entity = search_entity(o, entity_type, suffix)
+        prefix_entity = lookups.entity(entity_type, prefix_2)
+        suffix_entity = lookups.entity(entity_type, suffix)
         
         prefix_properties = []
-        for prop in prefix_entity.get_property_assignments():
+        for prop in lookups.assignments(entity_type, prefix_entity.code):
             prefix_properties.append(prop.permId)
             
         suffix_properties = []
-        for prop in suffix_entity.get_property_assignments():
+        for prop in lookups.assignments(entity_type, suffix_entity.code):
             suffix_properties.append(prop.permId)
             
         difference = [value for value in prefix_properties if value not in suffix_properties]
         
         prefix_properties_data = {}
-        for prop in prefix_entity.get_property_assignments():
+        for prop in lookups.assignments(entity_type, prefix_entity.code):
             prefix_properties_data[prop.code] = {
                 "label": prop.label,
                 "description": prop.description,
@@ -1198,7 +1002,7 @@ def check_prefix_prefix(o, prefix, entity_type, errors):
             }
             
         suffix_properties_data = {}
-        for prop2 in suffix_entity.get_property_assignments():
+        for prop2 in lookups.assignments(entity_type, suffix_entity.code):
             suffix_properties_data[prop2.code] = {
                 "label": prop2.label,
                 "description": prop2.description,
@@ -1215,64 +1019,79 @@ def check_prefix_prefix(o, prefix, entity_type, errors):
                 value2 = suffix_properties_data[key][field]
                 if value1 != value2:
                     if field == "label":
-                        changes.append(f"Change in label of Property type {key}.")
+                        changes.append(f"label of Property type {key}")
                     elif field == "description":
-                        changes.append(f"Change in description of Property type {key}.")
+                        changes.append(f"description of Property type {key}")
                     elif field == "dataType":
-                        changes.append(f"Change in data type of Property type {key}.")
+                        changes.append(f"data type of Property type {key}")
                     elif field == "vocabulary":
-                        changes.append(f"Change in vocabulary code of Property type {key}.")
+                        changes.append(f"vocabulary code of Property type {key}")
                     elif field == "metaData":
-                        changes.append(f"Change in metadata of Property type {key}.")
+                        changes.append(f"metadata of Property type {key}")
 
         if (len(difference) != 0) or (len(changes) != 0):
-            errors.append(f"As a specification of the entity type {prefix}, the entity type {suffix} must include all Property types of {prefix} without any changes.")
-            missing = ", ".join(difference)
-            if missing != "":
-                errors.append("The missing properties are: ")
-                errors.append(missing)
+            if difference:
+                errors.append(Issue(ERROR, "entity", "entity.prefix_incomplete", code=suffix, prefix=prefix, missing=difference, changes=changes))
             else:
-                errors.append("There are no missing properties")
-            errors.append("The changed property attributes are: ")
-            changed = "\n\n⦿ ".join(changes)
-            errors.append(changed)
+                errors.append(Issue(ERROR, "entity", "entity.prefix_changed", code=suffix, prefix=prefix, changes=changes))
 
 
         # Recursively call the function with the prefix
-        check_prefix_prefix(o, prefix_2, entity_type, errors)
+        check_prefix_prefix(lookups, prefix_2, entity_type, errors)
         
         
-def entity_checker(file_path, o):
+# Property columns read by the entity checks
+ENTITY_PROPERTY_COLUMNS = ("Code", "Property label", "Description", "Data type", "Vocabulary code", "Metadata",
+                           "Mandatory", "Section", "Dynamic script")
+
+
+def entity_workbook(workbook):
+    # What entity_checker reads of a workbook (e.g. to send it back from a worker process): the
+    # first four rows, the ENTITY_PROPERTY_COLUMNS and the property column below the entity Code
+    columns = {workbook.property_index[term] + 1 for term in ENTITY_PROPERTY_COLUMNS if term in workbook.property_index}
+    if "Code" in workbook.entity_index:
+        columns.add(workbook.entity_index["Code"] + 1)
+    return workbook.projected(columns)
+
+
+def entity_checker(workbook, o, lookups=None):
     
     errors = []
     
-    workbook = openpyxl.load_workbook(file_path)
-    sheet = workbook.active
-    entity_type = sheet['A1'].value
-    entity_headers = [cell.value for cell in sheet[2]]
+    # Every entity type is fetched at most once per upload (pass lookups to inspect the call counts)
+    if lookups is None:
+        lookups = masterdata.RequestLookups(o)
+    
+    entity_type = workbook.entity_type
+    entity_headers = list(workbook.entity_headers)
     term_index = entity_headers.index("Code") + 1
-    entity_code = sheet.cell(row=3, column=term_index).value
+    entity_code = workbook.cell(3, term_index)
     
     try:
-        openbis_entity = search_entity(o, entity_type, entity_code)
+        with metrics.stage("entity.lookup"):
+            openbis_entity = lookups.entity(entity_type, entity_code)
     except ValueError as e:
-        errors.append(f"⦿ Entity type '{entity_code}' is a new entity type (not present in the system) to be registered.")
+        errors.append(Issue(INFO, "entity", "entity.new", code=entity_code))
         openbis_entity = ""
     
         
     if (openbis_entity != ""):
-        errors.append(f"⦿ Entity type '{entity_code}' already exists.")
-        same_code_errors = check_entity_same_code(file_path, o, openbis_entity)
-        errors.append(same_code_errors)
+        errors.append(Issue(INFO, "entity", "entity.exists", code=entity_code))
+        with metrics.stage("entity.same_code"):
+            same_code_errors = check_entity_same_code(workbook, lookups, openbis_entity)
+        errors.extend(same_code_errors)
     else:
-        diff_code_errors = check_entity_diff_code(file_path, o)
-        errors.append(diff_code_errors)
+        with metrics.stage("entity.diff_code"):
+            diff_code_errors = check_entity_diff_code(workbook, lookups)
+        errors.extend(diff_code_errors)
         
-    prefix_errors = check_prefix_sufix(file_path, o)
-    errors.append(prefix_errors)
+    with metrics.stage("entity.prefix"):
+        prefix_errors = check_prefix_sufix(workbook, lookups)
+    errors.extend(prefix_errors)
+    logger.debug(f"Entity lookups of {workbook.file_name}: {dict(lookups.calls)}")
     
     
-    return "\n\n".join(errors)
+    return errors
 
 def generate_csv_and_download(o, instance):
     """
@@ -1287,14 +1106,27 @@ def generate_csv_and_download(o, instance):
     info = [instance, current_date]
 
     # Fetch data from the server (using pybis) and serialize
-    spaces = [space.code for space in o.get_spaces()]  # Convert Space objects to simple strings
-    projects = [project.code for project in o.get_projects()]
-    experiment_types = [exp.code for exp in o.get_experiment_types()]
-    object_types = [obj.code for obj in o.get_object_types() if obj.code != "UNKNOWN"]
-    material_types = [material.code for material in o.get_material_types()]
-    dataset_types = [dataset.code for dataset in o.get_dataset_types()]
-    vocabs = [vocab.code for vocab in o.get_vocabularies()]
-    plugins = [plug.name for plug in o.get_plugins()]
+    # Spaces and projects depend on the user, the masterdata is read from the snapshot
+    # The calls are independent: run them concurrently (see OPENBIS_FETCH_WORKERS)
+    snapshot = masterdata.snapshot(o)
+    fetched = masterdata.fetch_concurrently({
+        "spaces": lambda: masterdata.materialize(o.get_spaces()),
+        "projects": lambda: masterdata.materialize(o.get_projects()),
+        "experiment_types": lambda: snapshot.entities(o, "EXPERIMENT_TYPE"),
+        "object_types": lambda: snapshot.entities(o, "SAMPLE_TYPE"),
+        "material_types": lambda: snapshot.entities(o, "MATERIAL_TYPE"),
+        "dataset_types": lambda: snapshot.entities(o, "DATASET_TYPE"),
+        "vocabs": lambda: snapshot.entities(o, "VOCABULARY_TYPE"),
+        "plugins": lambda: snapshot.plugins(o),
+    })
+    spaces = [space.code for space in fetched["spaces"]]  # Convert Space objects to simple strings
+    projects = [project.code for project in fetched["projects"]]
+    experiment_types = [exp.code for exp in fetched["experiment_types"]]
+    object_types = [obj.code for obj in fetched["object_types"] if obj.code != "UNKNOWN"]
+    material_types = [material.code for material in fetched["material_types"]]
+    dataset_types = [dataset.code for dataset in fetched["dataset_types"]]
+    vocabs = [vocab.code for vocab in fetched["vocabs"]]
+    plugins = [plug.name for plug in fetched["plugins"]]
 
     masterdata_headers = [
         f"SPACES ({len(spaces)})", f"PROJECTS ({len(projects)})", f"EXPERIMENT TYPES ({len(experiment_types)})",
@@ -1302,7 +1134,7 @@ def generate_csv_and_download(o, instance):
         f"VOCABULARIES ({len(vocabs)})", f"PLUGINS ({len(plugins)})", f"MATERIAL TYPES ({len(material_types)})"
     ]
 
-    masterdata = [
+    masterdata_columns = [
         current_date,
         spaces,
         projects,
@@ -1332,9 +1164,9 @@ def generate_csv_and_download(o, instance):
     csv_rows.append(masterdata_headers)
 
     # Write master data rows
-    max_length = max(len(data) for data in masterdata)
+    max_length = max(len(data) for data in masterdata_columns)
     for i in range(max_length):
-        row = [data[i] if i < len(data) else "" for data in masterdata]
+        row = [data[i] if i < len(data) else "" for data in masterdata_columns]
         writer.writerow(row)
         csv_rows.append(row)
 
@@ -1350,14 +1182,15 @@ def generate_csv_and_download(o, instance):
     writer.writerow(object_types)
     csv_rows.append(object_types)
 
+    # One assignment list per object type, fetched concurrently (one openBIS call each on a cold snapshot)
+    assignments = masterdata.fetch_concurrently({
+        code: partial(snapshot.property_assignments, o, "SAMPLE_TYPE", code) for code in object_types
+    })
     props_by_obj = []
-    for obj in o.get_object_types():
-        if obj.code == "UNKNOWN":
-            continue
+    for code in object_types:
         props = []
-        assignments_df = obj.get_property_assignments().df
-        if 'propertyType' in assignments_df.columns:
-            for prop in obj.get_property_assignments():
+        if 'propertyType' in assignments[code].df.columns:
+            for prop in assignments[code]:
                 props.append(f"{prop.code} ({str(prop.dataType).lower()})")
         props_by_obj.append(props)
 
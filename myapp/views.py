@@ -1,26 +1,108 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponse
+from django.urls import reverse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.contrib import messages
 from django.contrib.auth import logout
-from pybis import Openbis
-from myapp.utils import name_checker, content_checker, entity_checker, generate_csv_and_download, encrypt_password, decrypt_password
+from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import require_POST
+from myapp.utils import ParsedWorkbook, name_checker, content_checker, entity_checker, build_report, generate_csv_and_download, encrypt_password, decrypt_password
+from myapp.openbis_pool import pool
+from myapp import masterdata, metrics, csv_storage, jobs, batch, result_cache, revisions, uploads
+from myapp.results import Report
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
 import logging
 
 # Get an instance of the logger for the app (replace 'myapp' with your app name)
 logger = logging.getLogger('myapp')
 
-def homepage(request):
+# The async views run the blocking work (pybis calls, parsing) on this bounded pool, off the event loop
+executor = ThreadPoolExecutor(max_workers=getattr(settings, "CHECKER_ASYNC_WORKERS", 16))
+
+async def run_blocking(function, *args):
+    # In the context of the caller: the stages run on the pool are added to its request timings
+    return await asyncio.get_running_loop().run_in_executor(executor, metrics.bind(partial(function, *args)))
+
+async def get_openbis(request):
+    # Pooled connection of the logged-in user (its pybis calls are timed, see metrics). The session
+    # is read and written through its async API, on Django's thread where the database connection
+    # lives; only the pool lookup (a login when the token expired) runs on the executor, and the
+    # password is only decrypted when openBIS asks for a new login
+    username = await request.session.aget('openbis_username')
+    token = await request.session.aget('openbis_token')
+    encrypted_password = await request.session.aget('openbis_password')
+    o = await run_blocking(metrics.timed("login", pool.get), username, token, partial(decrypt_password, encrypted_password))
+    if o.token != token:
+        await request.session.aset('openbis_token', o.token)
+    return metrics.instrument(o)
+
+async def check_upload(request, uploaded_file):
+    # Stage timings of the upload are logged when it is done (see metrics)
+    with metrics.request("upload", uploaded_file.name):
+        # Spooled to disk once and checked against the upload limits before anything is parsed
+        # (raises uploads.UploadRejected), then every load reads the spooled file
+        upload = await run_blocking(metrics.timed("spool", uploads.spool), uploaded_file)
+        try:
+            return await _check_upload(request, upload)
+        finally:
+            upload.close()
+
+async def _check_upload(request, upload):
+    file_name = upload.name
+
+    @metrics.timed("load")
+    def load():
+        # From a file object, as the upload was read before (openpyxl refuses a path by its extension)
+        with open(upload.path, "rb") as spooled:
+            return ParsedWorkbook.load(spooled, file_name, uploads.max_rows())
+
+    # A workbook checked before (same bytes and name) is not parsed again
+    cache_key = result_cache.upload_key(upload)
+    cached = result_cache.cache().get(cache_key)
+
+    # Reuse the pooled openBIS session of the user while the workbook is parsed
+    # (once, shared across all the checkers)
+    o, workbook = await asyncio.gather(
+        get_openbis(request),
+        run_blocking(load) if cached is None else asyncio.sleep(0),
+    )
+    lookups = masterdata.RequestLookups(o)
+
+    if cached is None:
+        # The content and the entity checks are independent
+        with metrics.stage("name"):
+            result_name, code, name_ok = name_checker(file_name)
+        result_content, result_entity = await asyncio.gather(
+            run_blocking(metrics.timed("content", content_checker), workbook, name_ok),
+            run_blocking(metrics.timed("entity", entity_checker), workbook, o, lookups),
+        )
+        result_cache.cache().put(cache_key, (result_name, code, name_ok), result_content, lookups.version, result_entity)
+    else:
+        (result_name, code, name_ok), result_content = cached.name, cached.content
+        result_entity = cached.entity(lookups.version)
+        if result_entity is None:
+            # The masterdata snapshot changed since: only the entity checks run again
+            workbook = await run_blocking(load)
+            result_entity = await run_blocking(metrics.timed("entity", entity_checker), workbook, o, lookups)
+            result_cache.cache().put(cache_key, cached.name, result_content, lookups.version, result_entity)
+    logger.info(f"Type {type(file_name)} of file {file_name}")
+
+    # Issues of the three checks, the messages are only rendered when displayed
+    return build_report(file_name, code, result_name, result_content, result_entity)
+
+async def homepage(request):
     # Check if the user is logged in
-    username = request.session.get('openbis_username')
-    encrypted_password = request.session.get('openbis_password')
+    username = await request.session.aget('openbis_username')
+    encrypted_password = await request.session.aget('openbis_password')
 
     # Redirect to login page if credentials are missing
     if not username or not encrypted_password:
         return redirect('login')
     
-    # Decrypt the password for use
-    password = decrypt_password(encrypted_password)
-    
     context = {}
 
     if request.method == "POST":
@@ -29,74 +111,177 @@ def homepage(request):
             # Check file extension
             if uploaded_file.name.endswith(('.xls', '.xlsx')):
                 try:
-                    
-                    url = f"url"
-                    o = Openbis(url)
-                    o.login(username, password, save_token=True)
-                    
-                    file_name = uploaded_file.name
-
-                    result_name, code, name_ok = name_checker(file_name)
-                    result_content = str(content_checker(uploaded_file, name_ok))
-                    result_entity = str(entity_checker(uploaded_file, o))
-                    logger.info(f"Type {type(file_name)} of file {file_name}")
-                    result_format = "CHECKED NAME:" + "\n----------------------------\n" + result_name + "\n" + "\nCHECKED CONTENT:" + "\n----------------------------\n" + result_content + "\n" + "\nCHECKED ENTITY" + "\n----------------------------\n" + result_entity
-
-
-                    context["result"] = result_format
-                    context["file_name"] = file_name
-                    context["code"] = code
+                    report = await check_upload(request, uploaded_file)
+                    context["report"] = report
+                    context["file_name"] = report.file_name
+                    context["code"] = report.code
 
+                except uploads.UploadRejected as e:
+                    context["error"] = f"File rejected: {str(e)}"
                 except Exception as e:
                     context["error"] = f"Error processing file: {str(e)}"
             else:
                 context["error"] = "Invalid file type. Only .xls and .xlsx files are allowed."
 
-    return render(request, 'homepage.html', context)
+    return await sync_to_async(render)(request, 'homepage.html', context)
+
+# JSON API: issues of an upload, filtered by ?severity= and ?check=, paged with ?offset= and ?limit=
+async def check_api(request):
+    username = await request.session.aget('openbis_username')
+    encrypted_password = await request.session.aget('openbis_password')
+    if not username or not encrypted_password:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+
+    if request.method != 'POST' or not request.FILES.get("file"):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    uploaded_file = request.FILES["file"]
+    if not uploaded_file.name.endswith(('.xls', '.xlsx')):
+        return JsonResponse({'error': "Invalid file type. Only .xls and .xlsx files are allowed."}, status=400)
+
+    try:
+        offset = int(request.GET.get('offset', 0))
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'offset and limit must be integers'}, status=400)
+
+    try:
+        report = await check_upload(request, uploaded_file)
+    except uploads.UploadRejected as e:
+        return JsonResponse({'error': f"File rejected: {str(e)}"}, status=413)
+    except Exception as e:
+        return JsonResponse({'error': f"Error processing file: {str(e)}"}, status=422)
+
+    return JsonResponse(report.as_dict(severity=request.GET.get('severity'), check=request.GET.get('check'), offset=offset, limit=limit))
+
+# Check a set of workbooks (several files and/or zips of workbooks) and show one result per file
+async def batch_check(request):
+    username = await request.session.aget('openbis_username')
+    encrypted_password = await request.session.aget('openbis_password')
+    if not username or not encrypted_password:
+        return redirect('login')
+
+    if request.method != 'POST' or not request.FILES.getlist("files"):
+        return redirect('homepage')
+
+    context = {}
+    uploaded_files = request.FILES.getlist("files")
+    results, files, status = None, [], 200
+    with metrics.request("batch", f"of {len(uploaded_files)} uploads"):
+        try:
+            # Every workbook is spooled to disk and checked against the upload limits
+            files, skipped = await run_blocking(metrics.timed("read", batch.read_uploads), uploaded_files)
+            # One openBIS session for the whole batch
+            o = await get_openbis(request)
+            results = await run_blocking(metrics.timed("validate", batch.validate), files, o)
+            results += [{"file_name": file_name, "code": "", "report": None, "error": reason} for file_name, reason in skipped]
+        except batch.BatchTooLarge as e:
+            context["error"], status = str(e), 400
+        except Exception as e:
+            context["error"], status = f"Error processing files: {str(e)}", 422
+        finally:
+            await run_blocking(batch.close, files)
+
+    if request.GET.get('format') == 'json':
+        if results is None:
+            return JsonResponse({'error': context["error"]}, status=status)
+        return JsonResponse({'results': [batch.row_as_dict(row) for row in results]})
+
+    context["batch_results"] = results
+    return await sync_to_async(render)(request, 'homepage.html', context)
+
+# Queue the validation of an upload in the background and return its job id right away
+def submit_job(request):
+    username = request.session.get('openbis_username')
+    encrypted_password = request.session.get('openbis_password')
+    if not username or not encrypted_password:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+
+    if request.method != 'POST' or not request.FILES.get("file"):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    uploaded_file = request.FILES["file"]
+    if not uploaded_file.name.endswith(('.xls', '.xlsx')):
+        return JsonResponse({'error': "Invalid file type. Only .xls and .xlsx files are allowed."}, status=400)
+
+    try:
+        job_id = jobs.enqueue(uploaded_file, username, request.session.get('openbis_token'), encrypted_password)
+    except uploads.UploadRejected as e:
+        return JsonResponse({'error': f"File rejected: {str(e)}"}, status=413)
+    except jobs.QueueFull as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+    return JsonResponse({'job_id': job_id, 'status': jobs.QUEUED, 'status_url': reverse('job_status', args=[job_id])}, status=202)
+
+# Status of a validation job (queued, running, done or failed) and its result once done
+def job_status(request, job_id):
+    job = jobs.get_job(job_id)
+    if job is None or job.pop('username') != request.session.get('openbis_username'):
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    if job['result'] is not None:
+        job['html'] = render_to_string('report.html', {'report': Report.from_dict(job['result'])})
+    return JsonResponse(job)
 
 # View to handle instance check and CSV generation
-def check_instance(request):
+async def check_instance(request):
     
     # Check if the user is logged in
-    username = request.session.get('openbis_username')
-    encrypted_password = request.session.get('openbis_password')
+    username = await request.session.aget('openbis_username')
+    encrypted_password = await request.session.aget('openbis_password')
 
     # Redirect to login page if credentials are missing
     if not username or not encrypted_password:
         return redirect('login')
-    
-    # Decrypt the password for use
-    password = decrypt_password(encrypted_password)
 
     if request.method == 'POST':
         instance = request.POST.get('instance')
 
-        # Simulate fetching data from the OpenBIS instance
-        url = f"url"
-        o = Openbis(url)
-        o.login(username, password, save_token=True)
+        with metrics.request("instance", instance):
+            # Fetch the data from the OpenBIS instance with the pooled session of the user
+            o = await get_openbis(request)
 
-        # Generate CSV data and capture the rows being written
-        csv_rows, csv_file, masterdata = generate_csv_and_download(o, instance)
+            # Generate CSV data and capture the rows being written
+            csv_rows, csv_file, instance_masterdata = await run_blocking(metrics.timed("csv", generate_csv_and_download), o, instance)
 
-        # Store the CSV content in the session for later download
-        request.session[instance] = csv_file
-        request.session[f'{instance}_masterdata'] = masterdata
+        # Store the CSV on the server for later download, the session only keeps its handle
+        handles = await request.session.aget('instance_csv', {})
+        await run_blocking(csv_storage.delete_csv, handles.get(instance))
+        handles[instance] = await run_blocking(csv_storage.save_csv, csv_file)
+        await request.session.aset('instance_csv', handles)
 
         # Return the rows back to the client for display
         return JsonResponse({
             'rows': csv_rows,  # This is JSON serializable (a list of lists)
             'csv_file': instance,  # The filename is just the instance name
-            'masterdata': masterdata
+            'masterdata': instance_masterdata
         })
 
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
-# View to handle the CSV file download (in memory)
+# Drop the cached masterdata snapshot (e.g. right after the masterdata has been changed in openBIS).
+# The snapshot is shared by all the users of the instance: only staff and MASTERDATA_ADMINS may drop it
+@require_POST
+@csrf_protect
+def invalidate_masterdata(request):
+    if not request.session.get('openbis_username'):
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+    if not masterdata.may_invalidate(request):
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+
+    dropped = masterdata.invalidate(pool.url)
+    return JsonResponse({'invalidated': dropped, 'stats': masterdata.cache_stats(), 'results': result_cache.cache().stats(), 'revisions': revisions.store().stats()})
+
+# Timing histograms and counters of the checks in the Prometheus text format, for local scrapers only
+def metrics_view(request):
+    if not metrics.allowed(request):
+        return HttpResponse('Forbidden', status=403)
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# View to handle the CSV file download (streamed from the server-side storage)
 def download_csv(request, filename):
-    csv_file = request.session.get(filename)  # Retrieve the in-memory CSV file from the session
-    if csv_file:
-        response = HttpResponse(csv_file, content_type='text/csv')
+    chunks = csv_storage.iter_csv(request.session.get('instance_csv', {}).get(filename))
+    if chunks is not None:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
         return response
     else:
@@ -110,9 +295,7 @@ def login(request):
 
         # Simulate OpenBIS login
         try:
-            url = f"url"
-            o = Openbis(url)
-            o.login(username, password, save_token=True)
+            o = pool.login(username, password)
 
             # Encrypt password before saving to the session
             encrypted_password = encrypt_password(password)
@@ -120,6 +303,7 @@ def login(request):
             # If login is successful, save credentials to the session
             request.session['openbis_username'] = username
             request.session['openbis_password'] = encrypted_password
+            request.session['openbis_token'] = o.token
 
             # Redirect to homepage after successful login
             return redirect('homepage')
@@ -134,6 +318,10 @@ def login(request):
     return render(request, 'login.html')
 
 def logout_view(request):
+    # Close the pooled openBIS session of the user
+    pool.discard(request.session.get('openbis_username'), request.session.get('openbis_token'), logout=True)
+    for handle in request.session.get('instance_csv', {}).values():
+        csv_storage.delete_csv(handle)
     request.session.flush()  # Clear all session data
     logout(request)
     return redirect('login')
\ No newline at end of file